@@ -8,8 +8,8 @@ Outputs:
     -Hillshade, saved to outputs folder and displayed on map using 
         cumulative count cut symbology (the grayscale color ramp is stretched 
         between the 2nd and 98th percentiles of the raster's values)
-    -DEM converted to vertical units of feet, saved to outputs folder
     -Base and index contours (vector), saved to outputs folder and displayed on map
+        (each contour's INDEX attribute is 1 for index contours and 0 otherwise)
     -Slope as percent (raster), saved to outputs folder and displayed on map 
         using a classified color scheme
     -Classified slope (raster), saved to outputs folder
@@ -22,8 +22,11 @@ Outputs:
         using a classified color scheme matching the rainbow color gradient
         of the raster aspect layer
     -Filled DEM (used for drainage analysis), saved to outputs folder
+    -D8 flow direction and Strahler order (raster), saved to outputs folder
     -Vector channel network (drainage), saved to outputs folder and displayed 
         on map using a classified color scheme based on Strahler order
+    -Optionally, previews of hillshade, slope, and/or aspect, displayed on map as
+        soon as the DEM is ready and computed on the fly for the current view
     
 Maja Cannavo, Rhumb Line Maps, July 2020
 
@@ -41,6 +44,25 @@ BEFORE YOU RUN THE SCRIPT:
     3. Also inside the "Script-Data" folder, create a folder named "Script-Outputs".
         This folder will be the location for all files created by the script.
         Make sure to copy the folder name exactly!
+
+    Keep terrainengine.py, terrainhydrology.py, terrainpolygons.py,
+    terrainpipeline.py, terrainjobs.py, terraintiles.py, terrainincremental.py,
+    and terrainlazy.py (the engine modules this script uses; they need only
+    the NumPy and GDAL Python packages that ship with QGIS) in the same folder
+    as this script or as your QGIS project.
+
+    To run without QGIS (e.g. to batch many project areas on a server), put
+    the settings below in a JSON file, one job or a list of jobs, and run
+        python terrainjobs.py jobs.json
+    (see terrainjobs.py for the settings and their defaults). To run many
+    (possibly overlapping) project areas from one DEM folder, mosaicking and
+    deriving their union once and clipping each area from it, run
+        python terrainbatch.py batch.json
+    (see terrainbatch.py). To time every
+    stage on synthetic DEMs of several sizes and check that a change keeps
+    the outputs the same, run
+        python terrainbenchmark.py <folder>
+    (see terrainbenchmark.py).
     
     4. Specify which outputs you'd like the script to produce. For each output
         variable, "1" means "do produce" and "0" means "don't produce."
@@ -64,8 +86,8 @@ BEFORE YOU RUN THE SCRIPT:
             The lower the number, the more detailed your channel network will be.
 *********************************************************************************
 """
-from os import listdir
-from os.path import isfile, join
+import sys
+from os.path import abspath, basename, dirname, splitext
 
 # *** STEP 4 ***
 # *** specify which outputs you'd like the script to produce ***
@@ -97,6 +119,129 @@ indexContourInt = 10
 # *** specify the channel threshold (min. Strahler order) you'd like to use for channel computation***
 channel_threshold = 5
 
+# *** OPTIONAL ***
+# *** memory ceiling (in MB) for mosaicking and resampling the raw DEMs ***
+mosaic_memoryMB = 512
+
+# *** OPTIONAL ***
+# *** area of interest: only the raw DEMs that intersect it are used ***
+# None = use every DEM in DTM-RAW; otherwise a bounding box (xmin, ymin, xmax, ymax)
+# or a polygon as WKT, e.g. 'POLYGON ((...))', in the raw DEMs' coordinate system
+AOI = None
+
+# *** OPTIONAL ***
+# *** reuse the outputs of stages whose inputs and parameters haven't changed since
+# an earlier run (1 = yes; 0 = no), and the size limit (in GB) of the cache of stage
+# outputs kept in Script-Outputs/cache (least recently used outputs are dropped first) ***
+use_cache = 1
+cache_sizeLimitGB = 20
+
+# *** OPTIONAL ***
+# *** number of worker processes for stages that can run side by side
+# (0 = one per CPU core; 1 = run everything in this process) ***
+worker_count = 0
+
+# *** OPTIONAL ***
+# *** additional channel thresholds and contour intervals (in feet) to produce in the
+# same run, e.g. [3, 4] and [1, 5]--each extra network/contour set is computed from
+# the same drainage rasters/contouring pass and saved to the outputs folder
+# (as vectorChannels_<threshold> and <interval>ft) but not added to the map ***
+channel_thresholdSweep = []
+contour_intervalSweep = []
+
+# *** OPTIONAL ***
+# *** minimum area (in square meters) of the polygons in the vectorized classified
+# slope and aspect (smaller areas are merged into their largest neighbor; 0 = keep
+# every area), and the tolerance (in meters) for simplifying their boundaries
+# (0 = keep the boundaries' stair steps) ***
+vector_minArea = 100
+vector_simplifyTolerance = 2
+
+# *** OPTIONAL ***
+# *** format of the output rasters: 'COG' (Cloud-Optimized GeoTIFF), 'GTiff' (tiled,
+# compressed GeoTIFF with overviews), or 'SAGA' (SAGA grid) ***
+raster_format = 'COG'
+
+# *** OPTIONAL ***
+# *** format of the intermediate rasters (classified slope and aspect, filled DEM,
+# flow direction, and Strahler order): None = the same as raster_format, or 'SAGA'
+# (uncompressed grids, which the stages that read them memory-map instead of
+# decoding--faster, but larger files) ***
+intermediate_format = None
+
+# *** OPTIONAL ***
+# *** format of the output vectors: 'GPKG' (GeoPackage), 'FlatGeobuf', or
+# 'ESRI Shapefile' (limited to 2 GB)--each is written in large batches and
+# spatially indexed, so large layers load and pan quickly--and whether to also
+# combine them in one GeoPackage, terrainVectors.gpkg, in Script-Outputs (1 = yes,
+# and the layers are added to the map from it; 0 = no) ***
+vector_format = 'GPKG'
+vector_package = 0
+
+# *** OPTIONAL ***
+# *** extra hillshades to produce in the same pass as the main one, e.g.
+# [{'azimuth':270, 'altitude':30}, {'zFactor':2}, {'multidirectional':1}]--any
+# of azimuth, altitude, zFactor (vertical exaggeration) and multidirectional
+# (1 = shade with lights from several directions) left out match the main
+# hillshade (315, 45, 1, 0); each is saved to the outputs folder (as
+# hillshade_<grain>m_<settings>) but not added to the map ***
+hillshade_variants = []
+
+# *** OPTIONAL ***
+# *** tile size (in cells) for filling sinks in DEMs too large to fill in memory
+# (0 = fill the whole DEM in memory, unless it's too large to) ***
+fill_tileSize = 0
+
+# *** OPTIONAL ***
+# *** tile size (in cells) for computing hillshade, slope, and aspect tile by tile
+# on a pool of worker processes (0 = in one pass), the number of local workers
+# (0 = one per CPU core), and the folder for the tiles' job queue (None = a
+# "queue" folder in Script-Outputs)--workers on other machines that can reach
+# the queue folder can help with: python terraintiles.py worker <queue folder> ***
+tile_size = 0
+tile_workers = 0
+tile_queueFolder = None
+
+# *** OPTIONAL ***
+# *** when DEM tiles are added to or replaced in the DEM folder, recompute only
+# the areas they cover and patch them into the last run's outputs (1 = yes;
+# 0 = always recompute everything)--the mosaic, hillshade, slope, aspect, and
+# contours are patched; the other outputs are recomputed in full ***
+incremental = 1
+
+# *** OPTIONAL ***
+# *** save a report of each run's stages (wall and CPU time, peak memory, bytes
+# read and written, and the sizes of their inputs and outputs) to runreport.json
+# in Script-Outputs, and add a row per stage to runhistory.csv there (1 = yes;
+# 0 = no), and stages to profile with cProfile, e.g. ['terrainDerivatives',
+# 'fillSinks'] (of mosaicResample, terrainDerivatives, contours, vectorSlope,
+# vectorAspect, fillSinks, drainage, channels; profiles are saved to a
+# "profiles" folder in Script-Outputs) ***
+run_report = 1
+profile_stages = []
+
+# *** OPTIONAL ***
+# *** add the outputs to the map as they're produced (1 = yes; 0 = no--the
+# outputs are still saved to the outputs folder) ***
+display_outputs = 1
+
+# *** OPTIONAL ***
+# *** products to preview as soon as the DEM is ready, e.g. ['hillshade', 'slope']
+# (of hillshade, slope, and aspect)--each preview layer is computed on the fly
+# for just the current map view, at its zoom level, from the DEM and its
+# overviews (so a statewide DEM can be browsed without waiting for the full
+# rasters; set the produce_ options above to 0 to skip them), and is re-rendered
+# once you stop panning or zooming; computed tiles are kept in memory up to lazy_cacheMB
+# (least recently used tiles are dropped first). The map must use the DEM's
+# coordinate system ***
+lazy_products = []
+lazy_cacheMB = 256
+
+# *** OPTIONAL ***
+# *** after the run, time the fill against the SAGA Fill Sinks XXL tool and
+# compare their outputs (1 = yes; 0 = no) ***
+benchmark_fill = 0
+
 # make sure you're in the correct QGIS project, located in the correct project folder
 # project_path will look for the filepath of the currently open project
 project_path = QgsProject.instance().readPath("./")
@@ -110,41 +255,100 @@ DEM_folder = project_path + '/' + data_folder + '/DTM-RAW/'
 # folder for outputs--must end in "/"
 analysis_folder = project_path + '/' + data_folder + '/Script-Outputs/'
 
-# list the DEM filenames, avoiding any invisible '.DS_Store' files
-DEM_fns = [DEM_folder + f for f in listdir(DEM_folder) if \
-    (isfile(join(DEM_folder, f)) and ('.DS_Store' not in f))]
-
-# filepath to save mosaicked DEM
-mDEM_fn = analysis_folder + 'dtm_Vm_' + str(DEM_grain) + 'm.sdat'
-
-# filepath to save resampled mosaicked DEM
-rmDEM_fn = analysis_folder + 'dtm_Vm_' + str(desired_grain) + 'm.sdat'
-
-# filepath to save hillshade
-hs_fn = analysis_folder + 'hillshade_' + str(desired_grain) + 'm.tif'
-
-# filepath to save DEM converted to feet
-ftDEM_fn = analysis_folder + 'dtm_Vft_' + str(desired_grain) + 'm.tif'
-
-# filepaths to save slope, classified slope, and vectorized classified slope
-s_fn = analysis_folder + 'slope.tif'
-cs_fn = analysis_folder + 'classedSlope.tif'
-vcs_fn = analysis_folder + 'vectorSlope.shp'
-
-# filepaths to save aspect, classified aspect, and vectorized classified aspect
-a_fn = analysis_folder + 'aspect.tif'
-ca_fn = analysis_folder + 'classedAspect.tif'
-vca_fn = analysis_folder + 'vectorAspect.shp'
-
-# filepaths to save contour shapefiles
-bc_fn = analysis_folder + str(baseContourInt) + 'ft.shp'
-ic_fn = analysis_folder + str(indexContourInt) + 'ft.shp'
+# folder holding this script and the engine modules--the QGIS Python Console
+# doesn't always define __file__, so fall back to the project folder
+try:
+    script_folder = dirname(abspath(__file__))
+except NameError:
+    script_folder = project_path
+if script_folder not in sys.path:
+    sys.path.append(script_folder)
+
+from terrainengine import queryTileIndex, readBandStatistics, \
+    readVectorSummary, updateTileIndex
+from terrainhydrology import benchmarkFill, defaultFillTileSize
+from terrainjobs import jobConfig, jobPaths, runTerrainAnalysis
+from terrainlazy import DerivativeTileSource
+
+
+# define slope classes (percent)--each key is the upper bound of a class;
+# used both to classify slope and for the slope symbology
+
+slopeClassDict = { 5 : ('#000000', '<=5'),
+    10 : ('#420a68', '5-10'),
+    15 : ('#932567', '10-15'),
+    20 : ('#dd5039', '15-20'),
+    30 : ('#fcbf0b', '20-30'),
+    float('inf') : ('#fcffa4', '>30') }
+
+
+# gather the settings above into a job config--the pipeline itself runs
+# headless in terrainjobs.py (which can also run jobs from the command line)
+
+config = {'DEM_folder':DEM_folder, # raw DEMs
+    'analysis_folder':analysis_folder, # outputs
+    'produce_hillshade':produce_hillshade,
+    'produce_baseContours':produce_baseContours,
+    'produce_indexContours':produce_indexContours,
+    'produce_rasterSlope':produce_rasterSlope,
+    'produce_vectorSlope':produce_vectorSlope,
+    'produce_rasterAspect':produce_rasterAspect,
+    'produce_vectorAspect':produce_vectorAspect,
+    'produce_channels':produce_channels,
+    'DEM_grain':DEM_grain,
+    'desired_grain':desired_grain,
+    'baseContourInt':baseContourInt,
+    'indexContourInt':indexContourInt,
+    'channel_threshold':channel_threshold,
+    'slope_classBounds':list(slopeClassDict), # slope class upper bounds
+    'mosaic_memoryMB':mosaic_memoryMB,
+    'AOI':AOI,
+    'use_cache':use_cache,
+    'cache_sizeLimitGB':cache_sizeLimitGB,
+    'worker_count':worker_count,
+    'channel_thresholdSweep':channel_thresholdSweep,
+    'contour_intervalSweep':contour_intervalSweep,
+    'vector_minArea':vector_minArea,
+    'vector_simplifyTolerance':vector_simplifyTolerance,
+    'raster_format':raster_format,
+    'intermediate_format':intermediate_format,
+    'hillshade_variants':hillshade_variants,
+    'fill_tileSize':fill_tileSize,
+    'tile_size':tile_size,
+    'tile_workers':tile_workers,
+    'tile_queueFolder':tile_queueFolder,
+    'incremental':incremental,
+    'vector_format':vector_format,
+    'vector_package':vector_package,
+    'run_report':run_report,
+    'profile_stages':profile_stages}
+
+# filepaths of the outputs (the same ones the pipeline writes)
+paths = jobPaths(jobConfig(config))
+
+
+# define function to find where to display a vector output from
+
+def vectorSource(vector_fn):
+    """
+    Gets the data source to display a vector output from: its layer in the
+    vector package, if one is made, or else its own file
+    """
+    if vector_package == 1:
+        return paths['vectorPackage'] + '|layername=' \
+            + splitext(basename(vector_fn))[0]
+    return vector_fn
 
-# filepath to save filled DEM
-fDEM_fn = analysis_folder + 'filledDEM.sdat'
 
-# filepath to save vectorized channels
-vc_fn = analysis_folder + 'vectorChannels.shp'
+rmDEM_fn = paths['rmDEM'] # resampled mosaicked DEM
+hs_fn = paths['hillshade'] # hillshade
+s_fn = paths['slope'] # slope
+vcs_fn = vectorSource(paths['vectorSlope']) # vectorized classified slope
+a_fn = paths['aspect'] # aspect
+vca_fn = vectorSource(paths['vectorAspect']) # vectorized classified aspect
+bc_fn = vectorSource(paths['baseContours']) # base contours
+ic_fn = vectorSource(paths['indexContours']) # index contours
+vc_fn = vectorSource(paths['channels']) # vectorized channels
 
 
 # define function to display a raster on the map
@@ -165,96 +369,32 @@ def displayRaster(raster_fn):
     return rlayer
 
 
-# define function to extract contours
+# define function to fill sinks in a DEM with SAGA (used to benchmark the
+# fill in terrainhydrology.py)
 
-def extractContours(inDEM, contourInt, contourOut):
+def fillSinksSaga(inDEM, outDEM):
     """
-    Extracts contours from a DEM using the GDAL contour tool
-    for a given contour interval
-    
+    Fills sinks in a DEM using the SAGA Fill Sinks (Wang & Liu) XXL tool
+
     Args:
         inDEM, DEM filename to use for input
-        contourInt, interval between contours (DEM units)
-        contourOut, filename to use for output
+        outDEM, filename to use for output
     Returns:
         None
     """
-    processing.run("gdal:contour", # GDAL contour tool
-        {'INPUT':inDEM, # input layer
-        'BAND':1, # use band 1
-        'INTERVAL':contourInt, # interval between contours
-        'FIELD_NAME':'ELEV', # optional attribute name
-        'CREATE_3D':False, # do not produce 3D vector
-        'IGNORE_NODATA':False, # do not treat all raster values as valid
-        'NODATA':None, # optional input pixel value to treat as "nodata"
-        'OFFSET':0, # optional offset from 0 relative to which to interpret intervals
-        'EXTRA':'', # optional additional command-line parameters
-        'OUTPUT':contourOut}) # where to save output
-
-    
-# mosaic DEMs, if necessary
-
-if len(DEM_fns) != 1: # mosaic if we have more than 1 DEM
-
-    processing.run("saga:mosaicrasterlayers", # SAGA Mosaic Raster Layers tool
-        {'GRIDS':DEM_fns, # input grids
-        'NAME':'Mosaic', # Name--not important
-        'TYPE':7, # data storage type: 4 byte floating point
-        'RESAMPLING':1, # bilinear interpolation
-        'OVERLAP':4, # overlapping areas: mean
-        'BLEND_DIST':8,# blend distance: 8m
-        'MATCH':0, # match: none
-        'TARGET_USER_XMIN TARGET_USER_XMAX TARGET_USER_YMIN TARGET_USER_YMAX':None, # optional output extent
-        'TARGET_USER_SIZE':DEM_grain, # raw DEM grain size
-        'TARGET_USER_FITS':1, # fit to cells
-        'TARGET_OUT_GRID':mDEM_fn}) # where to save output
-
-else: # if we have only 1 DEM, leave as is and treat as mosaicked DEM
-
-    mDEM_fn = DEM_fns[0]
-
-
-# resample mosaicked DEM, if necessary, and display on map
-
-if DEM_grain != desired_grain:
-    
-    processing.run("saga:resampling", # SAGA resampling tool
-    {'INPUT':mDEM_fn, # input grid
-    'KEEP_TYPE':True, # preserve data type
-    'SCALE_UP':3, # B-spline interpolation
-    'SCALE_DOWN':3, # B-spline interpolation
-    'TARGET_USER_XMIN TARGET_USER_XMAX TARGET_USER_YMIN TARGET_USER_YMAX':None, # optional output extent
-    'TARGET_USER_SIZE':desired_grain, # new grain size
-    'TARGET_USER_FITS':1, # fit to cells
-    'TARGET_TEMPLATE':None, # optional target system
-    'OUTPUT':rmDEM_fn}) # where to save output
-
-else: 
-    # we don't have a resampled DEM, so just use the mosaicked one in place of it
-    rmDEM_fn = mDEM_fn
-
-displayRaster(rmDEM_fn)
-
+    processing.run("saga:fillsinksxxlwangliu", # SAGA Fill Sinks (wang & liu) XXL tool
+        {'ELEV':inDEM, # input DEM
+        'MINSLOPE':0.01, # minimum slope (degrees)
+        'FILLED':outDEM}) # where to save output
 
-# compute hillshade using desired-grain DEM and display on map
 
-if produce_hillshade == 1:
-    
-    processing.run("gdal:hillshade", # GDAL hillshade tool
-        {'INPUT':rmDEM_fn, # input DEM
-        'BAND':1, # band number
-        'Z_FACTOR':1, # Z factor (vertical exaggeration)
-        'SCALE':1, # scale (ratio of vertical units to horizontal)
-        'AZIMUTH':315, # azimuth of the light
-        'ALTITUDE':45, # altitude of the light
-        'COMPUTE_EDGES':False, # do not compute edges
-        'ZEVENBERGEN':False, # do not use ZevenbergenThorne formula
-        'COMBINED':False, # do not use combined shading
-        'MULTIDIRECTIONAL':False, # do not use multidirectional shading
-        'OPTIONS':'', # optional additional creation options
-        'EXTRA':'', # optional additional command-line parameters
-        'OUTPUT':hs_fn}) # where to save output
+# define functions to display the outputs on the map (each is called once the
+# stage that produces its layer completes)
 
+def displayHillshade():
+    """
+    Displays the hillshade on the map using cumulative count cut symbology
+    """
     hs_rlayer = displayRaster(hs_fn)
 
     # apply cumulative cut count setting (set min to 2% and max to 98%)--
@@ -268,8 +408,14 @@ if produce_hillshade == 1:
     enhancement = QgsContrastEnhancement(hs_dataType)
     enhancement.setContrastEnhancementAlgorithm(enhancementAlg,True)
 
-    # set cumulative min and max to 2nd and 98th percentiles of band 1 values
-    cumulativeMin,cumulativeMax = hs_rlayer.dataProvider().cumulativeCut(1, 0.02, 0.98)
+    # set cumulative min and max to 2nd and 98th percentiles of band 1 values--
+    # read from the statistics stored when the hillshade was written, so the
+    # raster isn't scanned again (fall back to QGIS's cut if they're missing)
+    hs_stats = readBandStatistics(hs_fn)
+    if 'PERCENTILE_2' in hs_stats and 'PERCENTILE_98' in hs_stats:
+        cumulativeMin,cumulativeMax = hs_stats['PERCENTILE_2'],hs_stats['PERCENTILE_98']
+    else:
+        cumulativeMin,cumulativeMax = hs_rlayer.dataProvider().cumulativeCut(1, 0.02, 0.98)
 
     enhancement.setMinimumValue(cumulativeMin)
     enhancement.setMaximumValue(cumulativeMax)
@@ -280,82 +426,23 @@ if produce_hillshade == 1:
     iface.layerTreeView().refreshLayerSymbology(hs_rlayer.id()) # update legend
 
 
-# convert desired-grain DEM to feet
-
-if produce_baseContours == 1 or produce_indexContours == 1:
-
-    # set up raster calculator
-
-    rmDEM = QgsRasterLayer(rmDEM_fn)
-    output = ftDEM_fn
-    entries = []
-
-    rmDEM1 = QgsRasterCalculatorEntry()
-    rmDEM1.ref = 'rmDEM@1'
-    rmDEM1.raster = rmDEM
-    rmDEM1.bandNumber = 1
-
-    entries.append(rmDEM1)
-
-    ftConversionMethod = 'rmDEM@1 * 3.28084'
-
-    # perform calculation
-
-    calc = QgsRasterCalculator(ftConversionMethod, output, 'GTiff',\
-        rmDEM.extent(), rmDEM.width(), rmDEM.height(), entries)
-    calc.processCalculation()
-
-
-# extract base contours and display on map
-    
-if produce_baseContours == 1:
-
-    extractContours(ftDEM_fn, baseContourInt, bc_fn)
-    iface.addVectorLayer(bc_fn, '', 'ogr')
-
-# extract index contours and display on map
-
-if produce_indexContours == 1:
-        
-    extractContours(ftDEM_fn, 10, ic_fn)
-    iface.addVectorLayer(ic_fn, '', 'ogr')
-
-
-# compute slope and display on map
-
-if produce_rasterSlope == 1 or produce_vectorSlope == 1:
-
-    processing.run("gdal:slope",  # GDAL slope tool
-        {'INPUT':rmDEM_fn, # input layer
-        'BAND':1, # band number
-        'SCALE':1, # ratio of vertical units to horizontal
-        'AS_PERCENT':True, # express as percent instead of degrees
-        'COMPUTE_EDGES':False, # do not compute edges
-        'ZEVENBERGEN':False, # do not use ZevenbergenThorne formula
-        'OPTIONS':'', # optional additional creation options
-        'EXTRA':'', # optional additional command-line parameters
-        'OUTPUT':s_fn}) # where to save output
-
-if produce_rasterSlope == 1:
-    
+def displaySlope():
+    """
+    Displays the slope on the map using a classified color scheme
+    """
     s_rlayer = displayRaster(s_fn)
+    styleSlope(s_rlayer)
 
-    # change slope symbology to a classified color scheme
 
+def styleSlope(s_rlayer):
+    """
+    Styles a slope raster layer with the classified slope color scheme
+    """
     # set shader
 
     sShader = QgsColorRampShader()
     sShader.setColorRampType(QgsColorRampShader.Discrete)
 
-    # define symbol categorization
-
-    slopeClassDict = { 5 : ('#000000', '<=5'),
-        10 : ('#420a68', '5-10'),
-        15 : ('#932567', '10-15'),
-        20 : ('#dd5039', '15-20'),
-        30 : ('#fcbf0b', '20-30'),
-        float('inf') : ('#fcffa4', '>30') }
-        
     s_colorRampList = []
         
     for slopeClass, (color, label) in slopeClassDict.items():
@@ -374,87 +461,18 @@ if produce_rasterSlope == 1:
     s_rlayer.triggerRepaint() # make sure symbology updates
 
 
-if produce_vectorSlope == 1:
-
-    # classify slope using raster calculator
-
-    # set up raster calculator
-
-    lyr1 = QgsRasterLayer(s_fn)
-    output = cs_fn
-    entries = []
-
-    ras = QgsRasterCalculatorEntry()
-    ras.ref = 'ras@1'
-    ras.raster = lyr1
-    ras.bandNumber = 1
-
-    entries.append(ras)
-
-    slopeClassMethod = '(ras@1 >= 0) + (ras@1 > 5) + (ras@1 > 10)\
-        + (ras@1 > 15) + (ras@1 > 20) + (ras@1 > 30)'
-
-    # perform calculation
-
-    calc = QgsRasterCalculator(slopeClassMethod, output, 'GTiff', 
-        lyr1.extent(), lyr1.width(), lyr1.height(), entries)
-    calc.processCalculation()
-
-
-    # vectorize classed slope and display on map
-
-    processing.run("gdal:polygonize", # GDAL polygonize tool
-        {'INPUT':cs_fn, # input layer
-        'BAND':1, # band number
-        'FIELD':'class', # field to create
-        'EIGHT_CONNECTEDNESS':False, # do not use 8-connectedness
-        'EXTRA':'', # additional command-line parameters (optional)
-        'OUTPUT':vcs_fn}) # where to save output
-
-    # define layer
-    vcs_layer = QgsVectorLayer(vcs_fn, 'vectorSlope', 'ogr')
-
-    # define symbol categorization
-
-    categories = []
-
-    vectorSlopeClassDict = { 1 : ('#000000', '<=5'),
-        2 : ('#420a68', '5-10'),
-        3 : ('#932567', '10-15'),
-        4 : ('#dd5039', '15-20'),
-        5 : ('#fcbf0b', '20-30'),
-        6 : ('#fcffa4', '>30') }
-
-    for slopeClass, (color, label) in vectorSlopeClassDict.items():
-        sym = QgsSymbol.defaultSymbol(vcs_layer.geometryType())
-        sym.setColor(QColor(color))
-        sym.symbolLayer(0).setStrokeColor(QColor('transparent'))
-        category = QgsRendererCategory(slopeClass, sym, label)
-        categories.append(category)
-
-    # set renderer
-
-    field = 'class'
-    vcsRenderer = QgsCategorizedSymbolRenderer(field, categories)
-    vcs_layer.setRenderer(vcsRenderer)
-
-    # add to map
-    QgsProject.instance().addMapLayer(vcs_layer)
-
-
-# compute aspect and display on map
-
-if produce_rasterAspect == 1 or produce_vectorAspect == 1:
-
-    processing.run("qgis:aspect", # QGIS aspect tool
-        {'INPUT': rmDEM_fn, # elevation layer
-        'Z_FACTOR':1, # Z factor
-        'OUTPUT': a_fn}) # where to save output
-
-if produce_rasterAspect == 1:
-    
+def displayAspect():
+    """
+    Displays the aspect on the map using a rainbow color gradient
+    """
     a_rlayer = displayRaster(a_fn)
+    styleAspect(a_rlayer)
+
 
+def styleAspect(a_rlayer):
+    """
+    Styles an aspect raster layer with the rainbow color gradient
+    """
     # set shader
 
     aShader = QgsColorRampShader()
@@ -489,49 +507,139 @@ if produce_rasterAspect == 1:
     a_rlayer.triggerRepaint() # make sure symbology updates
 
 
-if produce_vectorAspect == 1:
-    
-    # classify aspect using raster calculator
+# define functions to preview hillshade, slope, and aspect computed on the fly
+# for the current map view (see terrainlazy.py)
 
-    # set up raster calculator
+lazyLayers = {} # product: (tile source, raster layer, view filename)
+lazy_delayMS = 250 # wait for the view to settle this long before re-rendering
 
-    lyr1 = QgsRasterLayer(a_fn)
-    output = ca_fn
-    entries = []
 
-    ras = QgsRasterCalculatorEntry()
-    ras.ref = 'ras@1'
-    ras.raster = lyr1
-    ras.bandNumber = 1
+def renderLazyLayers():
+    """
+    Re-renders the preview layers for the current map view
+    """
+    canvas = iface.mapCanvas()
+    extent = canvas.extent()
+    for product, (source, rlayer, view_fn) in lazyLayers.items():
+        source.writeView(view_fn, (extent.xMinimum(), extent.yMinimum(),
+            extent.xMaximum(), extent.yMaximum()), canvas.width(), canvas.height())
+        rlayer.dataProvider().reloadData()
+        rlayer.setExtent(rlayer.dataProvider().extent())
+        rlayer.triggerRepaint()
 
-    entries.append(ras)
 
-    aspectClassMethod = '((ras@1 >=0) + \
-        ((ras@1 >= 22.5) AND (ras@1 < 337.5)) + \
-        ((ras@1 >= 67.5) AND (ras@1 < 337.5)) + \
-        ((ras@1 >= 112.5) AND (ras@1 < 337.5)) + \
-        ((ras@1 >= 157.5) AND (ras@1 < 337.5)) + \
-        ((ras@1 >= 202.5) AND (ras@1 < 337.5)) + \
-        ((ras@1 >= 247.5) AND (ras@1 < 337.5)) + \
-        ((ras@1 >= 292.5) AND (ras@1 < 337.5)))'
+def displayLazyDerivatives(dem_fn):
+    """
+    Adds a preview layer for each of lazy_products, computed on the fly from
+    a DEM for the current map view and re-rendered once the view stops
+    changing (so panning and zooming aren't held up by every step of it)
 
-    # perform calculation
+    Args:
+        DEM filename
+    Returns:
+        None
+    """
+    global lazyTimer
+    canvas = iface.mapCanvas()
+    extent = canvas.extent()
+    for product in lazy_products:
+        source = DerivativeTileSource(dem_fn, product, cacheMB=lazy_cacheMB)
+        view_fn = '/vsimem/' + product + '_preview.tif'
+        source.writeView(view_fn, (extent.xMinimum(), extent.yMinimum(),
+            extent.xMaximum(), extent.yMaximum()), canvas.width(), canvas.height())
+        rlayer = iface.addRasterLayer(view_fn, product + '_preview')
+        if product == 'slope':
+            styleSlope(rlayer)
+        elif product == 'aspect':
+            styleAspect(rlayer)
+        lazyLayers[product] = (source, rlayer, view_fn)
+
+    if lazyLayers:
+        lazyTimer = QTimer()
+        lazyTimer.setSingleShot(True)
+        lazyTimer.setInterval(lazy_delayMS)
+        lazyTimer.timeout.connect(renderLazyLayers)
+        canvas.extentsChanged.connect(lazyTimer.start) # restarts the wait
+        QCoreApplication.processEvents() # draw the previews before the run goes on
+
+
+def displayDerivatives():
+    """
+    Displays the requested hillshade, slope, and aspect rasters on the map
+    """
+    if produce_hillshade == 1:
+        displayHillshade()
+    if produce_rasterSlope == 1:
+        displaySlope()
+    if produce_rasterAspect == 1:
+        displayAspect()
 
-    calc = QgsRasterCalculator(aspectClassMethod, output, 'GTiff', \
-        lyr1.extent(), lyr1.width(), lyr1.height(), entries)
-    calc.processCalculation()
+
+def displayContours():
+    """
+    Displays the requested base and index contours on the map
+    """
+    if produce_baseContours == 1:
+        iface.addVectorLayer(bc_fn, '', 'ogr')
+    if produce_indexContours == 1:
+        iface.addVectorLayer(ic_fn, '', 'ogr')
 
 
-    # vectorize classed aspect and display on map
+def presentClasses(vector_fn):
+    """
+    Gets the number of polygons of each class in a vectorized classified
+    raster, from the summary saved when it was written (None if it's missing)
+    """
+    summary = readVectorSummary(vector_fn)
+    if summary is None:
+        return None
+    return summary['fields']['class']['counts']
 
-    processing.run("gdal:polygonize", # GDAL polygonize tool
-        {'INPUT':ca_fn, # input layer
-        'BAND':1, # band number
-        'FIELD':'class', # field to create
-        'EIGHT_CONNECTEDNESS':False, # do not use 8-connectedness
-        'EXTRA':'', # additional command-line parameters (optional)
-        'OUTPUT':vca_fn}) # where to save output
 
+def displayVectorSlope():
+    """
+    Displays the vectorized classified slope on the map using the same
+    classified color scheme as the raster slope layer
+    """
+    # define layer
+    vcs_layer = QgsVectorLayer(vcs_fn, 'vectorSlope', 'ogr')
+
+    # define symbol categorization
+
+    categories = []
+
+    vectorSlopeClassDict = { 1 : ('#000000', '<=5'),
+        2 : ('#420a68', '5-10'),
+        3 : ('#932567', '10-15'),
+        4 : ('#dd5039', '15-20'),
+        5 : ('#fcbf0b', '20-30'),
+        6 : ('#fcffa4', '>30') }
+
+    vcs_counts = presentClasses(paths['vectorSlope'])
+    for slopeClass, (color, label) in vectorSlopeClassDict.items():
+        if vcs_counts is not None and slopeClass not in vcs_counts:
+            continue
+        sym = QgsSymbol.defaultSymbol(vcs_layer.geometryType())
+        sym.setColor(QColor(color))
+        sym.symbolLayer(0).setStrokeColor(QColor('transparent'))
+        category = QgsRendererCategory(slopeClass, sym, label)
+        categories.append(category)
+
+    # set renderer
+
+    field = 'class'
+    vcsRenderer = QgsCategorizedSymbolRenderer(field, categories)
+    vcs_layer.setRenderer(vcsRenderer)
+
+    # add to map
+    QgsProject.instance().addMapLayer(vcs_layer)
+
+
+def displayVectorAspect():
+    """
+    Displays the vectorized classified aspect on the map using a classified
+    color scheme matching the rainbow color gradient of the raster aspect layer
+    """
     # define layer
     vca_layer = QgsVectorLayer(vca_fn, 'vectorAspect', 'ogr')
 
@@ -548,7 +656,10 @@ if produce_vectorAspect == 1:
         7 : ('#4d2d8f', 'W'),
         8: ('#bf5095', 'NW')}
 
+    vca_counts = presentClasses(paths['vectorAspect'])
     for aspectClass, (color, label) in vectorAspectClassDict.items():
+        if vca_counts is not None and aspectClass not in vca_counts:
+            continue
         sym = QgsSymbol.defaultSymbol(vca_layer.geometryType())
         sym.setColor(QColor(color))
         sym.symbolLayer(0).setStrokeColor(QColor('transparent'))
@@ -565,61 +676,110 @@ if produce_vectorAspect == 1:
     QgsProject.instance().addMapLayer(vca_layer)
 
 
-if produce_channels == 1:
-
-    # fill sinks in DEM
-
-    processing.run("saga:fillsinksxxlwangliu", # SAGA Fill Sinks (wang & liu) XXL tool
-        {'ELEV':rmDEM_fn, # input DEM
-        'MINSLOPE':0.01, # minimum slope (degrees)
-        'FILLED':fDEM_fn}) # where to save output
-
-
-    # compute channel network (vector) and display on map
-
-    processing.run("saga:channelnetworkanddrainagebasins",
-        {'DEM':fDEM_fn, # input DEM
-        'THRESHOLD':channel_threshold, # threshold
-        'DIRECTION':'TEMPORARY_OUTPUT', # flow direction, which we don't need
-        'CONNECTION':'TEMPORARY_OUTPUT', # flow connectivity, which we don't need
-        'ORDER':'TEMPORARY_OUTPUT', # Strahler order, which we don't need
-        'BASIN':'TEMPORARY_OUTPUT', # drainage basins (raster), which we don't need
-        'SEGMENTS':vc_fn, # where to save vector channels (the output we want)
-        'BASINS':'TEMPORARY_OUTPUT', # drainage basins (vector), which we don't need
-        'NODES':'TEMPORARY_OUTPUT'}) # junctions, which we don't need
-
+def displayChannels():
+    """
+    Displays the vector channel network on the map using a classified
+    color scheme based on Strahler order
+    """
     # define layer
 
     vc_layer = QgsVectorLayer(vc_fn, 'vectorChannels', 'ogr')
 
     # define field name ('ORDER'--the renumbered Strahler order) to use for symbology
-    # and obtain max Strahler order value
+    # and obtain max Strahler order value--read from the summary saved when the
+    # channels were written, so the layer isn't scanned again (fall back to
+    # QGIS's scan if it's missing)
 
     order_fieldName='ORDER'
-    order_fieldIndex = vc_layer.fields().indexFromName(order_fieldName)
-    max_order = vc_layer.maximumValue(order_fieldIndex)
+    vc_summary = readVectorSummary(paths['channels'])
+    if vc_summary is not None:
+        max_order = vc_summary['fields'][order_fieldName]['maximum'] or 0
+    else:
+        order_fieldIndex = vc_layer.fields().indexFromName(order_fieldName)
+        max_order = vc_layer.maximumValue(order_fieldIndex)
 
     # obtain Viridis color ramp (built-in)
 
     vcStyle = QgsStyle().defaultStyle()
-    defaultRamps = vcStyle.colorRampNames()
-    viridisRamp = vcStyle.colorRamp(defaultRamps[-5]) # this is the index of the Viridis color ramp in Q
+    viridisRamp = vcStyle.colorRamp('Viridis')
 
-    # define symbol graduation
+    # define symbol graduation--each order's color is taken from the ramp as its
+    # symbol is made, so the renderer is built in one pass
 
     categories = []
 
     for channel_order in range(1, max_order+1):
         sym = QgsSymbol.defaultSymbol(vc_layer.geometryType())
+        sym.setColor(viridisRamp.color((channel_order - 1) / max(max_order - 1, 1)))
         label = str(channel_order)
         category = QgsRendererRange(channel_order, channel_order, sym, label)
         categories.append(category)
 
     # set renderer
 
-    vcRenderer = QgsGraduatedSymbolRenderer('ORDER', categories) 
+    vcRenderer = QgsGraduatedSymbolRenderer(order_fieldName, categories)
+    vcRenderer.setSourceColorRamp(viridisRamp)
     vc_layer.setRenderer(vcRenderer)
-    vcRenderer.updateColorRamp(viridisRamp)
 
     # add to map
     QgsProject.instance().addMapLayer(vc_layer) 
+
+
+# run the pipeline--each stage runs as soon as the stages that write its inputs
+# are done, so independent products (hillshade/slope/aspect, contours, and fill
+# sinks/channels) run side by side on a pool of worker_count processes. Stages
+# whose inputs and parameters are unchanged since an earlier run are skipped
+# (their cached outputs are reused instead). If display_outputs is 1, each layer
+# is added to the map once the stage that produces it completes.
+
+def displayDEM(paths):
+    """
+    Displays the DEM the derivatives were computed from (the resampled
+    mosaicked DEM, or the raw DEM if no mosaicking or resampling was needed)
+    """
+    global rmDEM_fn
+    rmDEM_fn = paths['rmDEM']
+    displayRaster(rmDEM_fn)
+    if not lazyLayers:
+        displayLazyDerivatives(rmDEM_fn)
+
+
+displayCallbacks = {'mosaicResample':displayDEM,
+    'terrainDerivatives':lambda paths: displayDerivatives(),
+    'contours':lambda paths: displayContours(),
+    'vectorSlope':lambda paths: displayVectorSlope(),
+    'vectorAspect':lambda paths: displayVectorAspect()}
+if produce_channels == 1:
+    displayCallbacks['channels'] = lambda paths: displayChannels()
+
+# with a vector package, the vector layers are displayed from it once it's made
+if vector_package == 1:
+    vectorCallbacks = [displayCallbacks.pop(name) for name in ('contours',
+        'vectorSlope', 'vectorAspect', 'channels') if name in displayCallbacks]
+
+    def displayVectors(paths):
+        for callback in vectorCallbacks:
+            callback(paths)
+
+    displayCallbacks['vectorPackage'] = displayVectors
+
+# a single raw DEM at the desired grain is used as is, with no mosaicResample
+# stage to display it from--display it (and start the previews) before the run
+if display_outputs == 1 and AOI is None and DEM_grain == desired_grain:
+    DEM_tiles = queryTileIndex(updateTileIndex(DEM_folder, paths['tileIndex']),
+        DEM_folder)
+    if len(DEM_tiles) == 1:
+        displayDEM({'rmDEM':DEM_tiles[0]['fn']})
+
+paths = runTerrainAnalysis(config,
+    onComplete = displayCallbacks if display_outputs == 1 else None)
+if display_outputs == 1 and paths['rmDEM'] != rmDEM_fn:
+    displayDEM(paths) # the raw DEM was used in place of a mosaicked one
+rmDEM_fn = paths['rmDEM']
+
+# optionally, benchmark the fill against SAGA's
+
+if benchmark_fill == 1:
+    for name, result in benchmarkFill(rmDEM_fn, analysis_folder, fillSinksSaga,
+        0.01, fill_tileSize or defaultFillTileSize).items():
+        print(name, result)
@@ -0,0 +1,312 @@
+"""
+Batch runs of the terrain analysis pipeline over many project areas.
+
+Project areas drawn from one shared DTM-RAW archive often overlap, and run
+one by one each area mosaics, resamples and derives its own copy of the
+cells it shares with its neighbors. runBatch does that work once per group
+of overlapping areas: the areas are clustered (see clusterAreas) so that
+each cluster's bounding box is mostly covered by its areas, a shared run per
+cluster mosaics and resamples the raw DEMs for the cluster's bounding box
+and computes hillshade, slope, aspect and their classes over it (tiled, if
+tile_size is set), and then each area runs as its own job on a pool of
+worker processes, clipping its DEM and derivatives from its cluster's
+shared run (see clipRasters) and computing only what depends on the area's
+extent itself: contours, vectorized classes, fill, drainage and channels.
+An area that overlaps no other (or whose cluster would be mostly empty
+box) runs on its own, with no shared run. The shared runs keep their cache
+and incremental manifest, so a later batch over the same areas reuses them
+(or patches them where raw DEM tiles changed).
+
+Outputs are saved to <batch_folder>/shared_<n> (the shared DEM and
+derivatives of each cluster) and <batch_folder>/<area name> (one
+Script-Outputs-style folder per area); no QGIS project folder layout is
+needed.
+
+Command line:
+    python terrainbatch.py batch.json [--workers N]
+
+where batch.json holds the job settings every area uses (see defaultConfig
+in terrainjobs.py), the batch folder, and the areas, each with a name, an
+AOI (bounding box or polygon WKT) and any settings of its own, e.g.
+    {"batch_folder": "/data/batch", "DEM_folder": "/data/DTM-RAW",
+     "desired_grain": 2,
+     "areas": [{"name": "north", "AOI": [500000, 4510000, 504000, 4514000]},
+        {"name": "ridge", "AOI": "POLYGON ((...))", "channel_threshold": 4}]}
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+
+from terrainengine import aoiExtent
+from terrainjobs import jobConfig, runTerrainAnalysis
+from terrainpipeline import createWorkerPool
+
+# settings that determine the shared DEM and derivatives (the same for
+# every area), and the run settings the shared run takes from the batch
+sharedProductSettings = ['DEM_folder', 'DEM_grain', 'desired_grain',
+    'slope_classBounds', 'mosaic_memoryMB', 'raster_format',
+    'intermediate_format', 'hillshade_variants']
+sharedRunSettings = ['use_cache', 'cache_sizeLimitGB', 'tile_size',
+    'tile_workers', 'tile_queueFolder', 'incremental', 'run_report',
+    'profile_stages']
+
+# derivative outputs (any area producing one has the shared run produce it)
+sharedProduceSettings = ['produce_hillshade', 'produce_rasterSlope',
+    'produce_rasterAspect', 'produce_vectorSlope', 'produce_vectorAspect']
+
+# stages of the shared run
+sharedStages = ['mosaicResample', 'terrainDerivatives']
+
+# most a cluster's bounding box may be, as a multiple of the area its areas
+# cover, for the cluster to share a run (larger boxes would mosaic and derive
+# mostly cells no area uses)
+maxSharedBoxRatio = 2.0
+
+
+# define functions to work out the shared runs and the areas' jobs
+
+def unionExtent(aois):
+    """
+    Gets the bounding box (xmin, ymin, xmax, ymax) of several areas of
+    interest (each a bounding box or polygon WKT)
+    """
+    extents = [aoiExtent(aoi) for aoi in aois]
+    return (min(e[0] for e in extents), min(e[1] for e in extents),
+        max(e[2] for e in extents), max(e[3] for e in extents))
+
+
+def coveredArea(extents):
+    """
+    Gets the area covered by several bounding boxes (overlaps counted once)
+    """
+    xs = sorted(set(e[0] for e in extents) | set(e[2] for e in extents))
+    ys = sorted(set(e[1] for e in extents) | set(e[3] for e in extents))
+    area = 0
+    for x0, x1 in zip(xs[:-1], xs[1:]):
+        for y0, y1 in zip(ys[:-1], ys[1:]):
+            if any(e[0] <= x0 and x1 <= e[2] and e[1] <= y0 and y1 <= e[3]
+                for e in extents):
+                area += (x1 - x0) * (y1 - y0)
+    return area
+
+
+def clusterAreas(aois, maxBoxRatio=maxSharedBoxRatio):
+    """
+    Groups areas of interest into clusters to share a run: clusters start
+    as single areas, and two clusters are merged while their bounding boxes
+    overlap and the merged bounding box is at most maxBoxRatio times the
+    area its areas cover
+
+    Args:
+        aois, list of areas of interest (each a bounding box or polygon WKT)
+        maxBoxRatio, most a cluster's bounding box may be, as a multiple of
+            the area its areas cover
+    Returns:
+        list of clusters, each a sorted list of indices into aois
+    """
+    extents = [aoiExtent(aoi) for aoi in aois]
+    clusters = [[i] for i in range(len(aois))]
+    boxes = list(extents)
+    merged = True
+    while merged:
+        merged = False
+        for a in range(len(clusters)):
+            for b in range(a + 1, len(clusters)):
+                boxA, boxB = boxes[a], boxes[b]
+                if boxA[0] >= boxB[2] or boxB[0] >= boxA[2] \
+                    or boxA[1] >= boxB[3] or boxB[1] >= boxA[3]:
+                    continue # the boxes don't overlap
+                members = clusters[a] + clusters[b]
+                box = unionExtent([boxA, boxB])
+                boxArea = (box[2] - box[0]) * (box[3] - box[1])
+                if boxArea > maxBoxRatio * coveredArea([extents[i] for i in members]):
+                    continue
+                clusters[a], boxes[a] = sorted(members), box
+                del clusters[b], boxes[b]
+                merged = True
+                break
+            if merged:
+                break
+    return clusters
+
+
+def areaConfigs(config, areas, batch_folder):
+    """
+    Works out the job config of each area (on its own; see batchJobs for
+    the areas that clip from a shared run)
+
+    Args:
+        config, dict of job settings every area uses (see defaultConfig)
+        areas, list of dicts, each with a 'name', an 'AOI' and any
+            settings of the area's own
+        batch_folder, folder for the batch's outputs
+    Returns:
+        list of config dicts (complete, as from jobConfig)
+    """
+    names = [area.get('name') for area in areas]
+    if None in names or len(set(names)) != len(names):
+        raise ValueError('every area needs a name of its own')
+
+    configs = []
+    for area in areas:
+        settings = {key: value for key, value in area.items() if key != 'name'}
+        fixed = set(settings) & set(sharedProductSettings)
+        if fixed:
+            raise ValueError('area ' + area['name'] + ' sets '
+                + ', '.join(sorted(fixed)) + ', which must be the same for '
+                'every area (they determine the shared DEM and derivatives)')
+        if settings.get('AOI') is None:
+            raise ValueError('area ' + area['name'] + ' needs an AOI')
+        areaConfig = dict(config, **settings)
+        areaConfig.update(analysis_folder=os.path.join(batch_folder, area['name']),
+            worker_count=1) # areas run side by side, each in one process
+        configs.append(jobConfig(areaConfig))
+    return configs
+
+
+def sharedConfig(config, configs, shared_folder):
+    """
+    Works out the config of a shared run: the bounding box of its areas,
+    and every derivative any of them produces (the other settings keep
+    their defaults, so changing them doesn't invalidate the shared outputs)
+
+    Args:
+        config, dict of job settings every area uses
+        configs, the configs of the areas sharing the run (from areaConfigs)
+        shared_folder, folder for the shared run's outputs
+    Returns:
+        config dict (complete, as from jobConfig)
+    """
+    shared = {key: config[key] for key in sharedProductSettings + sharedRunSettings
+        if key in config}
+    shared.update((key, max(areaConfig[key] for areaConfig in configs))
+        for key in sharedProduceSettings)
+    shared.update(DEM_folder=configs[0]['DEM_folder'],
+        analysis_folder=shared_folder,
+        AOI=unionExtent([areaConfig['AOI'] for areaConfig in configs]),
+        produce_channels=0) # (it runs no drainage, whatever the union's size)
+    return jobConfig(shared)
+
+
+def batchJobs(config, areas, batch_folder, maxBoxRatio=maxSharedBoxRatio):
+    """
+    Works out the shared runs of a batch (one per cluster of overlapping
+    areas, see clusterAreas) and the areas' jobs, clipping from their
+    cluster's shared run
+
+    Args:
+        config, dict of job settings every area uses (see defaultConfig)
+        areas, list of dicts, each with a 'name', an 'AOI' and any
+            settings of the area's own
+        batch_folder, folder for the batch's outputs
+        maxBoxRatio, see clusterAreas
+    Returns:
+        (list of the shared runs' configs, list of the areas' configs)
+    """
+    configs = areaConfigs(config, areas, batch_folder)
+    shared = []
+    for members in clusterAreas([areaConfig['AOI'] for areaConfig in configs],
+        maxBoxRatio):
+        if len(members) < 2:
+            continue # an area on its own mosaics and derives for itself
+        shared_folder = os.path.join(batch_folder, 'shared_' + str(len(shared) + 1))
+        shared.append(sharedConfig(config, [configs[i] for i in members],
+            shared_folder))
+        for i in members:
+            configs[i] = jobConfig(dict(configs[i], shared_folder=shared_folder,
+                incremental=0)) # the DEM and derivatives are clipped, not mosaicked
+    return shared, configs
+
+
+# define function to run a batch
+
+def runBatch(config, areas, batch_folder, workers=None,
+    maxBoxRatio=maxSharedBoxRatio):
+    """
+    Runs the terrain analysis for many project areas, sharing the mosaic,
+    resampling and derivatives of their overlaps: a shared run over each
+    cluster of overlapping areas (see batchJobs), then each area's job
+    (clipping from its cluster's shared run, if it has one) on a pool of
+    worker processes
+
+    Args:
+        config, dict of job settings every area uses (see defaultConfig)
+        areas, list of dicts, each with a 'name', an 'AOI' (bounding box or
+            polygon WKT) and any settings of the area's own (other than
+            the shared ones, see sharedProductSettings)
+        batch_folder, folder for the batch's outputs
+        workers, number of worker processes (None or 0 = one per CPU)
+        maxBoxRatio, see clusterAreas
+    Returns:
+        (list of the shared runs' paths, list of each area's paths), as
+        from runTerrainAnalysis
+    """
+    shared, configs = batchJobs(config, areas, batch_folder, maxBoxRatio)
+    for job in shared + configs:
+        os.makedirs(job['analysis_folder'], exist_ok=True)
+
+    pool = createWorkerPool(workers)
+    try:
+        # each shared run's stages run side by side on the pool
+        sharedPaths = [runTerrainAnalysis(sharedRun, pool=pool,
+            stageNames=sharedStages) for sharedRun in shared]
+
+        # the areas start from a shared run's tile index, so they don't
+        # reopen every raw DEM to build their own
+        if sharedPaths:
+            for areaConfig in configs:
+                index_fn = os.path.join(areaConfig['analysis_folder'],
+                    'tileindex.json')
+                if not os.path.exists(index_fn):
+                    shutil.copyfile(sharedPaths[0]['tileIndex'], index_fn)
+
+        if pool is None:
+            areaPaths = [runTerrainAnalysis(areaConfig) for areaConfig in configs]
+        else:
+            futures = [pool.submit(runTerrainAnalysis, areaConfig)
+                for areaConfig in configs]
+            areaPaths = [future.result() for future in futures]
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return sharedPaths, areaPaths
+
+
+def readBatch(batch_fn):
+    """
+    Reads a batch from a JSON file (see the module docstring)
+
+    Returns:
+        (config, areas, batch folder)
+    """
+    with open(batch_fn) as f:
+        batch = json.load(f)
+    if 'batch_folder' not in batch or not batch.get('areas'):
+        raise ValueError(batch_fn + ' needs a batch_folder and a list of areas')
+    config = {key: value for key, value in batch.items()
+        if key not in ('batch_folder', 'areas')}
+    return config, batch['areas'], batch['batch_folder']
+
+
+def main(argv=None):
+    """
+    Runs the batch in the JSON file named on the command line
+    """
+    parser = argparse.ArgumentParser(description='Run terrain analysis for '
+        'many project areas, sharing the work of their overlaps.')
+    parser.add_argument('batch', help='JSON file holding the job settings, '
+        'batch_folder and areas')
+    parser.add_argument('--workers', type=int, default=0, help='worker '
+        'processes (0 = one per CPU core)')
+    args = parser.parse_args(argv)
+
+    config, areas, batch_folder = readBatch(args.batch)
+    sharedPaths, areaPaths = runBatch(config, areas, batch_folder, args.workers)
+    for area, paths in zip(areas, areaPaths):
+        print('done:', area['name'], os.path.dirname(paths['tileIndex']))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
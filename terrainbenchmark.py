@@ -0,0 +1,551 @@
+"""
+Benchmarks for the terrain analysis pipeline.
+
+Synthetic DEMs are generated offline (no data needed): fractal terrain
+(octaves of smooth value noise) on a gentle regional slope, with flat areas
+(patches terraced into level steps) and closed depressions (bowls cut into
+the surface), written as a grid of GeoTIFF tiles like a DTM-RAW
+folder. The terrain is a function of each cell's position alone, so it's
+seamless across tiles, the same for any tile size, and generated block by
+block in bounded memory at any size (1k^2 to 30k^2 cells and beyond); the
+tiles for a size are reused by later runs. Sizes above 4k^2 cells take
+hours and tens of gigabytes of disk, so they only run when asked for
+(allowLarge, or --large on the command line, which also adds the 8k^2 to
+30k^2 presets).
+
+Each benchmark runs the whole pipeline (see terrainjobs.py) on each DEM
+size, resampled from the raw 1 m grain to each benchmark grain (1 m runs
+the mosaic alone; 2 m also resamples), under each variant--a named set of
+config overrides, e.g. SAGA
+intermediates or tiled execution, so an engine change can be run side by
+side with the current one--and reports, per stage (mosaicResample,
+terrainDerivatives, contours, vectorSlope, vectorAspect, fillSinks,
+drainage, channels): wall and CPU time, throughput (cells per second),
+peak memory, and bytes read and written (from each run's report; see
+RunReport). Every variant's outputs are checked against the first
+variant's: rasters cell by cell, vectors by feature count and total length
+or area.
+
+Command line:
+    python terrainbenchmark.py <folder> [--sizes 1000 4000 ...] [--large]
+        [--grains 1 2 ...] [--tileSize N]
+        [--variants baseline sagaIntermediates ...] [--variant NAME JSON]
+        [--repeats N] [--workers N] [--seed N]
+
+Results are saved to benchmark.json and benchmark.csv in the folder.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+from terrainengine import createRaster, defaultBlockRows, finishRaster, openBand
+from terrainjobs import runTerrainAnalysis
+
+# synthetic terrain settings
+syntheticNodata = -9999
+syntheticEPSG = 32618 # UTM zone 18N
+syntheticOrigin = (500000.0, 4500000.0) # upper-left corner (map units)
+baseElevation = 200.0 # meters
+terrainRelief = 300.0 # meters, top to bottom of the noise
+regionalSlope = 0.01 # meters per meter, down to the lower right
+largestPeriod = 4096 # cells, wavelength of the coarsest noise octave
+smallestPeriod = 4 # cells, wavelength of the finest noise octave
+roughness = 0.8 # amplitude falloff per octave (Hurst exponent)
+flatPeriod = 512 # cells, wavelength of the noise that places flat areas
+flatThreshold = 0.7 # noise above this is terraced into flats
+flatStep = 5.0 # meters between terrace levels
+pitSpacing = 256 # cells between candidate depressions
+pitChance = 0.5 # chance of a depression at each candidate
+pitRadius = (8, 40) # cells
+pitDepth = (2.0, 12.0) # meters
+
+# config for every benchmark run: the full pipeline, with no cache or
+# incremental patching (each run computes everything)
+benchmarkConfig = {'use_cache':0, 'incremental':0, 'run_report':1,
+    'DEM_grain':1}
+
+# DEM sizes (cells per side) run by default, and the large presets, run only
+# when asked for (sizes above maxDefaultSize need allowLarge)
+defaultSizes = [1000, 2000, 4000]
+largeSizes = [8000, 16000, 30000]
+maxDefaultSize = 4000
+
+# grains (meters) to resample the 1 m synthetic DEMs to
+benchmarkGrains = [1, 2]
+
+# named config overrides to compare
+benchmarkVariants = {
+    'baseline':{}, # default settings
+    'sagaIntermediates':{'intermediate_format':'SAGA'}, # memory-mapped intermediates
+    'tiled':{'tile_size':2048, 'fill_tileSize':4096}, # tiled derivatives and fill
+    'serial':{'worker_count':1}, # every stage in one process
+}
+
+# raster values closer than this count as equal in the equivalence checks
+equivalenceTolerance = 1e-4
+
+# columns of benchmark.csv
+benchmarkColumns = ['size', 'tiles', 'grain', 'variant', 'repeat', 'stage',
+    'wallSeconds', 'cpuSeconds', 'cells', 'cellsPerSecond', 'peakMemoryBytes',
+    'bytesRead', 'bytesWritten']
+
+
+# define functions to generate synthetic terrain
+
+def latticeNoise(ix, iy, octave, seed):
+    """
+    Hashes integer lattice coordinates to repeatable values in [0, 1)
+
+    Args:
+        ix, iy, integer arrays of lattice coordinates (broadcastable)
+        octave, octave number
+        seed, random seed
+    Returns:
+        float array of values
+    """
+    with np.errstate(over='ignore'): # wrapping multiplies are the point
+        h = (np.asarray(ix).astype(np.uint32) * np.uint32(0x8da6b343)) \
+            ^ (np.asarray(iy).astype(np.uint32) * np.uint32(0xd8163841)) \
+            ^ np.uint32((octave * 0xcb1ab31f + seed * 0x165667b1) & 0xffffffff)
+        h ^= h >> np.uint32(13)
+        h *= np.uint32(0x5bd1e995)
+        h ^= h >> np.uint32(15)
+        h *= np.uint32(0x27d4eb2d)
+        h ^= h >> np.uint32(16)
+    return h.astype(np.float64) / 2.0 ** 32
+
+
+def smoothNoise(rows, cols, period, octave, seed):
+    """
+    Evaluates one octave of value noise (random values on a square lattice,
+    smoothly interpolated) on a block of cells
+
+    Args:
+        rows, cols, 1D arrays of the block's global cell indices
+        period, lattice spacing (cells)
+        octave, seed, as for latticeNoise
+    Returns:
+        (len(rows), len(cols)) array of values in [0, 1)
+    """
+    gy, gx = (rows + 0.5) / period, (cols + 0.5) / period
+    iy, ix = np.floor(gy).astype(np.int64), np.floor(gx).astype(np.int64)
+    fy, fx = gy - iy, gx - ix
+    fy, fx = fy * fy * (3 - 2 * fy), fx * fx * (3 - 2 * fx) # smoothstep
+
+    # lattice values covering the block, then bilinear weights per cell
+    iy0, ix0 = iy.min(), ix.min()
+    lattice = latticeNoise(np.arange(ix0, ix.max() + 2)[None, :],
+        np.arange(iy0, iy.max() + 2)[:, None], octave, seed)
+    top = lattice[np.ix_(iy - iy0, ix - ix0)] * (1 - fx) \
+        + lattice[np.ix_(iy - iy0, ix - ix0 + 1)] * fx
+    bottom = lattice[np.ix_(iy - iy0 + 1, ix - ix0)] * (1 - fx) \
+        + lattice[np.ix_(iy - iy0 + 1, ix - ix0 + 1)] * fx
+    return top * (1 - fy)[:, None] + bottom * fy[:, None]
+
+
+def syntheticTerrain(row0, col0, rows, cols, cellSize=1, seed=0):
+    """
+    Computes the synthetic terrain on a block of cells
+
+    Args:
+        row0, col0, global indices of the block's upper-left cell
+        rows, cols, block size (cells)
+        cellSize, cell size (map units)
+        seed, random seed
+    Returns:
+        (rows, cols) float32 array of elevations
+    """
+    rowIdx = np.arange(row0, row0 + rows)
+    colIdx = np.arange(col0, col0 + cols)
+
+    # fractal noise: octaves from the largest period down, each smaller in
+    # amplitude by the roughness
+    noise = np.zeros((rows, cols))
+    totalAmplitude = 0.0
+    period, octave = largestPeriod, 0
+    while period >= smallestPeriod:
+        amplitude = (period / largestPeriod) ** roughness
+        noise += amplitude * smoothNoise(rowIdx, colIdx, period, octave, seed)
+        totalAmplitude += amplitude
+        period, octave = period / 2, octave + 1
+    z = baseElevation + terrainRelief * (noise / totalAmplitude - 0.5)
+
+    # gentle regional slope (so water drains across the area), then flat
+    # areas: patches where the ground is cut down to level terraces
+    z -= regionalSlope * cellSize * (rowIdx[:, None] + colIdx[None, :])
+    flat = smoothNoise(rowIdx, colIdx, flatPeriod, 100, seed) > flatThreshold
+    z[flat] = np.floor(z[flat] / flatStep) * flatStep
+
+    # closed depressions: bowls at some of the candidate points near the block
+    margin = pitRadius[1]
+    for py in range((row0 - margin) // pitSpacing, (row0 + rows + margin) // pitSpacing + 1):
+        for px in range((col0 - margin) // pitSpacing, (col0 + cols + margin) // pitSpacing + 1):
+            draws = [float(latticeNoise(px, py, 1000 + k, seed)) for k in range(5)]
+            if draws[0] >= pitChance:
+                continue
+            radius = pitRadius[0] + draws[1] * (pitRadius[1] - pitRadius[0])
+            depth = pitDepth[0] + draws[2] * (pitDepth[1] - pitDepth[0])
+            cy = (py + draws[3]) * pitSpacing - row0
+            cx = (px + draws[4]) * pitSpacing - col0
+            r0, r1 = max(int(cy - radius), 0), min(int(cy + radius) + 1, rows)
+            c0, c1 = max(int(cx - radius), 0), min(int(cx + radius) + 1, cols)
+            if r1 <= r0 or c1 <= c0:
+                continue
+            d2 = ((np.arange(r0, r1)[:, None] - cy) ** 2
+                + (np.arange(c0, c1)[None, :] - cx) ** 2) / radius ** 2
+            z[r0:r1, c0:c1] -= depth * np.clip(1 - d2, 0, None)
+    return z.astype(np.float32)
+
+
+def writeSyntheticTiles(DEM_folder, size, tileSize, cellSize=1, seed=0):
+    """
+    Writes a square synthetic DEM as a grid of GeoTIFF tiles (reusing the
+    tiles already there if they were written with the same settings, as
+    recorded in synthetic.json beside the folder)
+
+    Args:
+        DEM_folder, folder for the tiles
+        size, DEM size (cells per side)
+        tileSize, tile size (cells per side; edge tiles may be smaller)
+        cellSize, cell size (map units)
+        seed, random seed
+    Returns:
+        list of tile filenames
+    """
+    settings = {'size':size, 'tileSize':tileSize, 'cellSize':cellSize,
+        'seed':seed, 'version':1}
+    # (the settings go next to the tiles' folder, since every file in it is
+    # indexed as a DEM)
+    settings_fn = os.path.join(os.path.dirname(os.path.abspath(DEM_folder)),
+        'synthetic.json')
+    tileStarts = range(0, size, tileSize)
+    tile_fns = [os.path.join(DEM_folder, 'synthetic_%d_%d.tif' % (row0, col0))
+        for row0 in tileStarts for col0 in tileStarts]
+    if os.path.isfile(settings_fn) and all(os.path.isfile(fn) for fn in tile_fns):
+        with open(settings_fn) as f:
+            if json.load(f) == settings:
+                return tile_fns
+
+    if os.path.isdir(DEM_folder):
+        shutil.rmtree(DEM_folder)
+    os.makedirs(DEM_folder)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(syntheticEPSG)
+    projection = srs.ExportToWkt()
+
+    for row0 in tileStarts:
+        for col0 in tileStarts:
+            rows, cols = min(tileSize, size - row0), min(tileSize, size - col0)
+            tile_fn = os.path.join(DEM_folder, 'synthetic_%d_%d.tif' % (row0, col0))
+            geotransform = (syntheticOrigin[0] + col0 * cellSize, cellSize, 0,
+                syntheticOrigin[1] - row0 * cellSize, 0, -cellSize)
+            ds = createRaster(tile_fn, cols, rows, geotransform, projection,
+                gdal.GDT_Float32, syntheticNodata, 'GTiff')
+            band = ds.GetRasterBand(1)
+            for blockRow in range(0, rows, defaultBlockRows):
+                blockRows = min(defaultBlockRows, rows - blockRow)
+                band.WriteArray(syntheticTerrain(row0 + blockRow, col0,
+                    blockRows, cols, cellSize, seed), 0, blockRow)
+            band = ds = None
+            finishRaster(tile_fn, 'GTiff')
+
+    with open(settings_fn, 'w') as f:
+        json.dump(settings, f)
+    return tile_fns
+
+
+# define functions to compare outputs
+
+def outputDatasets(paths):
+    """
+    Lists a job's output datasets that exist (as name -> filename, with
+    sweep outputs named by their setting)
+    """
+    skip = {'tileIndex', 'cache', 'runReport', 'runHistory', 'profiles',
+        'vectorPackage'}
+    datasets = {}
+    for name, value in paths.items():
+        if name in skip:
+            continue
+        if isinstance(value, str):
+            datasets[name] = value
+        elif isinstance(value, list):
+            datasets.update((name + str(i), fn) for i, fn in enumerate(value))
+        elif isinstance(value, dict):
+            datasets.update((name + str(key), fn) for key, fn in value.items())
+    return {name: fn for name, fn in datasets.items() if os.path.isfile(fn)}
+
+
+def compareRasters(a_fn, b_fn):
+    """
+    Compares two rasters cell by cell (block by block)
+
+    Returns:
+        dict of maxDifference (over cells with data in both), differingCells
+        (beyond equivalenceTolerance, or data in only one), and equivalent
+    """
+    aBand, bBand = openBand(a_fn), openBand(b_fn)
+    if (aBand.XSize, aBand.YSize) != (bBand.XSize, bBand.YSize):
+        return {'maxDifference':None, 'differingCells':None, 'equivalent':False}
+    aNodata, bNodata = aBand.GetNoDataValue(), bBand.GetNoDataValue()
+    width, height = aBand.XSize, aBand.YSize
+
+    maxDifference, differing = 0.0, 0
+    for row0 in range(0, height, defaultBlockRows):
+        rows = min(defaultBlockRows, height - row0)
+        a = aBand.ReadAsArray(0, row0, width, rows).astype(np.float64)
+        b = bBand.ReadAsArray(0, row0, width, rows).astype(np.float64)
+        aData = ~np.isnan(a) if aNodata is None else (a != aNodata) & ~np.isnan(a)
+        bData = ~np.isnan(b) if bNodata is None else (b != bNodata) & ~np.isnan(b)
+        both = aData & bData
+        difference = np.abs(a[both] - b[both])
+        if difference.size:
+            maxDifference = max(maxDifference, float(difference.max()))
+        differing += int(np.count_nonzero(difference > equivalenceTolerance)) \
+            + int(np.count_nonzero(aData != bData))
+    return {'maxDifference':maxDifference, 'differingCells':differing,
+        'equivalent':differing == 0}
+
+
+def vectorSummary(vector_fn):
+    """
+    Summarizes a vector layer: feature count, and total length (lines) or
+    area (polygons)
+    """
+    layer = ogr.Open(vector_fn).GetLayer(0)
+    count, total = 0, 0.0
+    for feature in layer:
+        geometry = feature.GetGeometryRef()
+        count += 1
+        if geometry is not None:
+            total += geometry.GetArea() if geometry.GetDimension() == 2 \
+                else geometry.Length()
+    return count, total
+
+
+def compareVectors(a_fn, b_fn):
+    """
+    Compares two vector layers by feature count and total length or area
+
+    Returns:
+        dict of both summaries and equivalent
+    """
+    (aCount, aTotal), (bCount, bTotal) = vectorSummary(a_fn), vectorSummary(b_fn)
+    return {'features':[aCount, bCount], 'total':[aTotal, bTotal],
+        'equivalent':aCount == bCount
+            and abs(aTotal - bTotal) <= equivalenceTolerance * max(abs(aTotal), 1)}
+
+
+def compareOutputs(basePaths, paths):
+    """
+    Compares a run's outputs with a baseline run's
+
+    Returns:
+        dict of output name -> comparison (see compareRasters/compareVectors)
+    """
+    baseDatasets, datasets = outputDatasets(basePaths), outputDatasets(paths)
+    comparisons = {}
+    for name, base_fn in sorted(baseDatasets.items()):
+        data_fn = datasets.get(name)
+        if data_fn is None:
+            comparisons[name] = {'equivalent':False, 'missing':True}
+        elif os.path.splitext(base_fn)[1].lower() in ('.tif', '.sdat'):
+            comparisons[name] = compareRasters(base_fn, data_fn)
+        else:
+            comparisons[name] = compareVectors(base_fn, data_fn)
+    return comparisons
+
+
+# define functions to run benchmarks
+
+def stageTimings(report_fn):
+    """
+    Reads the per-stage measurements of a run from its report, with each
+    stage's throughput (cells of its largest raster per second of wall time)
+    """
+    with open(report_fn) as f:
+        report = json.load(f)
+    timings = []
+    for record in report['stages']:
+        rasters = [info for info in record['inputs'] + record['outputs']
+            if 'width' in info]
+        cells = max((info['width'] * info['height'] for info in rasters),
+            default=None)
+        timings.append({'stage':record['stage'],
+            'wallSeconds':record['wallSeconds'],
+            'cpuSeconds':record['cpuSeconds'], 'cells':cells,
+            'cellsPerSecond':cells / record['wallSeconds']
+                if cells and record['wallSeconds'] > 0 else None,
+            'peakMemoryBytes':record['peakMemoryBytes'],
+            'bytesRead':record['bytesRead'],
+            'bytesWritten':record['bytesWritten']})
+    return timings
+
+
+def environmentInfo():
+    """
+    Describes the machine and library versions (saved with the results)
+    """
+    return {'python':platform.python_version(), 'numpy':np.__version__,
+        'gdal':gdal.VersionInfo('RELEASE_NAME'), 'platform':platform.platform(),
+        'processor':platform.processor(), 'cpuCount':os.cpu_count()}
+
+
+def runBenchmarks(folder, sizes, tileSize=2000, variants=None, repeats=1,
+    workers=0, seed=0, grains=None, allowLarge=False):
+    """
+    Runs the pipeline on synthetic DEMs of each size, resampled to each
+    grain, under each variant, timing every stage and checking each
+    variant's outputs against the first variant's (at the same size and
+    grain)
+
+    Args:
+        folder, working folder (DEMs, outputs and results)
+        sizes, list of DEM sizes (cells per side)
+        tileSize, raw tile size (cells per side)
+        variants, dict of variant name -> config overrides (default: baseline)
+        repeats, runs per variant, size and grain (each timed separately)
+        workers, worker processes (0 = one per CPU core)
+        seed, random seed of the synthetic terrain
+        grains, list of grains (meters) to resample to (default:
+            benchmarkGrains)
+        allowLarge, whether to run sizes above maxDefaultSize
+    Returns:
+        dict of environment, settings, runs (per-stage timings) and
+        comparisons
+    """
+    if not allowLarge and max(sizes) > maxDefaultSize:
+        raise ValueError('sizes above ' + str(maxDefaultSize) + ' cells per '
+            'side take hours and tens of GB of disk; pass allowLarge=True '
+            '(--large) to run them')
+    if variants is None:
+        variants = {'baseline':benchmarkVariants['baseline']}
+    if grains is None:
+        grains = benchmarkGrains
+    results = {'environment':environmentInfo(), 'started':time.time(),
+        'settings':{'sizes':sizes, 'grains':grains, 'tileSize':tileSize,
+            'repeats':repeats, 'workers':workers, 'seed':seed,
+            'variants':variants},
+        'runs':[], 'comparisons':[]}
+
+    for size in sizes:
+        size_folder = os.path.join(folder, 'dem' + str(size))
+        DEM_folder = os.path.join(size_folder, 'DTM-RAW')
+        generateStart = time.perf_counter()
+        tile_fns = writeSyntheticTiles(DEM_folder, size, tileSize, seed=seed)
+        print('%d^2 cells: %d tiles ready in %.1f s' % (size, len(tile_fns),
+            time.perf_counter() - generateStart))
+
+        for grain in grains:
+            basePaths = None
+            for variant, overrides in variants.items():
+                for repeat in range(repeats):
+                    analysis_folder = os.path.join(size_folder,
+                        '%s_%gm' % (variant, grain))
+                    if os.path.isdir(analysis_folder):
+                        shutil.rmtree(analysis_folder)
+                    os.makedirs(analysis_folder)
+                    config = dict(benchmarkConfig, desired_grain=grain,
+                        worker_count=workers, DEM_folder=DEM_folder,
+                        analysis_folder=analysis_folder)
+                    config.update(overrides)
+
+                    start = time.perf_counter()
+                    paths = runTerrainAnalysis(config)
+                    wallSeconds = time.perf_counter() - start
+                    timings = stageTimings(paths['runReport'])
+                    results['runs'].append({'size':size, 'tiles':len(tile_fns),
+                        'grain':grain, 'variant':variant, 'repeat':repeat,
+                        'wallSeconds':wallSeconds, 'stages':timings})
+                    print('  %g m %s #%d: %.1f s (%s)' % (grain, variant,
+                        repeat + 1, wallSeconds, ', '.join('%s %.1f s'
+                        % (t['stage'], t['wallSeconds']) for t in timings)))
+
+                # outputs of the last repeat are kept for the equivalence check
+                if basePaths is None:
+                    basePaths = paths
+                else:
+                    comparisons = compareOutputs(basePaths, paths)
+                    results['comparisons'].append({'size':size, 'grain':grain,
+                        'variant':variant, 'against':next(iter(variants)),
+                        'outputs':comparisons})
+                    different = [name for name, c in comparisons.items()
+                        if not c['equivalent']]
+                    print('  %g m %s outputs: %s' % (grain, variant,
+                        'equivalent' if not different
+                        else 'differ in ' + ', '.join(different)))
+    return results
+
+
+def saveResults(results, folder):
+    """
+    Saves benchmark results as JSON (everything) and CSV (a row per stage
+    per run)
+    """
+    with open(os.path.join(folder, 'benchmark.json'), 'w') as f:
+        json.dump(results, f, indent=1)
+    with open(os.path.join(folder, 'benchmark.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(benchmarkColumns)
+        for run in results['runs']:
+            for timing in run['stages']:
+                row = dict(run, **timing)
+                writer.writerow(['' if row.get(column) is None else row[column]
+                    for column in benchmarkColumns])
+
+
+def main(argv=None):
+    """
+    Runs benchmarks from the command line
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the terrain '
+        'analysis pipeline on synthetic DEMs.')
+    parser.add_argument('folder', help='working folder (DEMs, outputs, results)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=None,
+        help='DEM sizes (cells per side; default: %s, plus %s with --large)'
+        % (' '.join(map(str, defaultSizes)), ' '.join(map(str, largeSizes))))
+    parser.add_argument('--large', action='store_true', help='run the large '
+        'sizes (hours of runtime and tens of GB of disk)')
+    parser.add_argument('--grains', type=float, nargs='+',
+        default=benchmarkGrains, help='grains (meters) to resample the 1 m '
+        'DEMs to')
+    parser.add_argument('--tileSize', type=int, default=2000, help='raw DEM '
+        'tile size (cells per side)')
+    parser.add_argument('--variants', nargs='+', default=['baseline'],
+        choices=sorted(benchmarkVariants), help='built-in variants to run '
+        '(the first is the reference for the equivalence checks)')
+    parser.add_argument('--variant', nargs=2, action='append', default=[],
+        metavar=('NAME', 'JSON'), help='extra variant: a name and a JSON '
+        'object of config overrides')
+    parser.add_argument('--repeats', type=int, default=1, help='runs per '
+        'variant and size')
+    parser.add_argument('--workers', type=int, default=0, help='worker '
+        'processes (0 = one per CPU core)')
+    parser.add_argument('--seed', type=int, default=0, help='terrain seed')
+    args = parser.parse_args(argv)
+
+    grains = [int(grain) if grain == int(grain) else grain
+        for grain in args.grains] # 2, not 2.0, in the output names
+    sizes = args.sizes
+    if sizes is None:
+        sizes = defaultSizes + (largeSizes if args.large else [])
+    variants = {name: benchmarkVariants[name] for name in args.variants}
+    for name, overrides in args.variant:
+        variants[name] = json.loads(overrides)
+    os.makedirs(args.folder, exist_ok=True)
+    results = runBenchmarks(args.folder, sizes, args.tileSize, variants,
+        args.repeats, args.workers, args.seed, grains, args.large)
+    saveResults(results, args.folder)
+    print('results:', os.path.join(args.folder, 'benchmark.json'))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
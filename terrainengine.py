@@ -0,0 +1,1645 @@
+"""
+Headless raster engine used by terrainanalysis.py.
+
+Computes slope (percent), aspect and hillshade from a DEM in a single
+blocked pass: each block of DEM rows is read once (with a one-cell halo),
+the Horn gradient is computed once, and every requested product is derived
+from that shared gradient. Classified slope and aspect are binned from the
+same in-memory blocks with table-driven (searchsorted) lookups and written
+as compact Byte rasters. Raw DEM tiles are mosaicked and resampled in one
+streaming pass over windows of the output grid, so no full-size intermediate
+mosaic is ever written or held in memory; a persisted tile index lets runs
+limited to an area of interest touch only the intersecting tiles. Output
+rasters are written as Cloud-Optimized GeoTIFFs by default (or tiled,
+compressed GeoTIFFs with overviews, or SAGA grids, which later stages
+memory-map rather than decode). Contours
+for several intervals come from a single contouring pass. Vector outputs
+are written in large transactions and spatially indexed in bulk once
+written (GeoPackage or FlatGeobuf, or shapefile), with summaries of their
+fields (e.g. the highest Strahler order or the count of each class) saved
+beside them so they can be styled without a rescan. Only NumPy
+and the GDAL Python bindings (both shipped with QGIS) are required, so the
+engine also runs outside the QGIS Python Console.
+"""
+import json
+import os
+
+import numpy as np
+try:
+    from osgeo import gdal, ogr, osr
+except ImportError: # only raster and vector I/O needs GDAL; the array cores don't
+    gdal = ogr = osr = None
+
+# nodata values for the derivative rasters (the same ones the GDAL DEM tools use)
+slopeNodata = -9999.0
+aspectNodata = -9999.0
+hillshadeNodata = 0
+classNodata = 0
+demNodata = -9999.0
+
+# number of DEM rows read per block
+defaultBlockRows = 256
+
+# output raster formats and their GDAL creation options: Cloud-Optimized
+# GeoTIFF (written as a tiled GeoTIFF, then copied to a COG once complete,
+# since GDAL's COG driver can only copy), tiled and compressed GeoTIFF with
+# internal overviews, or SAGA grid
+defaultRasterFormat = 'COG'
+rasterFormats = {'COG':['COMPRESS=DEFLATE', 'PREDICTOR=YES', 'OVERVIEWS=AUTO',
+        'BIGTIFF=IF_SAFER'],
+    'GTiff':['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER'],
+    'SAGA':[]}
+
+# number of DEM rows contoured per strip
+defaultContourRows = 1024
+
+# output vector drivers by file extension (shapefile otherwise), the layer
+# creation options each is written with, and the features written per
+# transaction. GeoPackage layers are created without a spatial index, which
+# is built in bulk once every feature is written (much faster than updating
+# the R-tree per feature); FlatGeobuf writes its packed R-tree as the file
+# is closed; shapefiles get a .qix index.
+vectorDrivers = {'.gpkg':'GPKG', '.fgb':'FlatGeobuf', '.geojson':'GeoJSON'}
+vectorLayerOptions = {'GPKG':['SPATIAL_INDEX=NO'],
+    'FlatGeobuf':['SPATIAL_INDEX=YES']}
+defaultVectorBatch = 100000
+
+# vertical scale from meters to feet
+feetPerMeter = 3.28084
+
+
+# define functions for blocked raster access
+
+def rasterFormatFor(raster_fn, rasterFormat=defaultRasterFormat):
+    """
+    Picks the format of an output raster: SAGA grid for .sdat files,
+    otherwise the given format (a key of rasterFormats)
+    """
+    if raster_fn.lower().endswith('.sdat'):
+        return 'SAGA'
+    if rasterFormat not in rasterFormats:
+        raise ValueError('Unknown raster format: ' + str(rasterFormat))
+    return rasterFormat
+
+
+def writePath(raster_fn, rasterFormat=defaultRasterFormat):
+    """
+    Gets the file an output raster is written to before finishRaster (a
+    temporary tiled GeoTIFF for COGs, otherwise the raster itself)
+    """
+    if rasterFormatFor(raster_fn, rasterFormat) == 'COG':
+        return raster_fn + '.tmp.tif'
+    return raster_fn
+
+
+def overviewLevels(width, height, minSize=256):
+    """
+    Lists the overview decimation factors (2, 4, 8, ...) down to the first
+    overview smaller than minSize cells on its longer side
+    """
+    levels = []
+    while max(width, height) / 2 ** len(levels) > minSize:
+        levels.append(2 ** (len(levels) + 1))
+    return levels
+
+
+def createRaster(raster_fn, width, height, geotransform, projection,
+    dataType, nodata, rasterFormat=defaultRasterFormat):
+    """
+    Creates a single-band raster (call finishRaster once it's written
+    and closed)
+
+    Args:
+        raster_fn, filename to use for output
+        width, height, raster size (cells)
+        geotransform, GDAL geotransform of the output grid
+        projection, WKT of the output coordinate reference system
+        dataType, GDAL data type of the output band
+        nodata, nodata value of the output band (None = no nodata)
+        rasterFormat, output format (a key of rasterFormats; .sdat
+            filenames are always written as SAGA grids)
+    Returns:
+        GDAL dataset (open for writing)
+    """
+    rasterFormat = rasterFormatFor(raster_fn, rasterFormat)
+    if rasterFormat == 'SAGA':
+        driver, options = gdal.GetDriverByName('SAGA'), []
+    elif rasterFormat == 'COG':
+        driver, options = gdal.GetDriverByName('GTiff'), ['TILED=YES',
+            'BIGTIFF=IF_SAFER']
+    else:
+        # floating-point predictor for float rasters, horizontal otherwise
+        isFloat = dataType in (gdal.GDT_Float32, gdal.GDT_Float64)
+        driver = gdal.GetDriverByName('GTiff')
+        options = rasterFormats['GTiff'] + ['PREDICTOR=' + ('3' if isFloat else '2')]
+    outDS = driver.Create(writePath(raster_fn, rasterFormat), width, height, 1,
+        dataType, options=options)
+    outDS.SetGeoTransform(geotransform)
+    outDS.SetProjection(projection)
+    if nodata is not None:
+        outDS.GetRasterBand(1).SetNoDataValue(nodata)
+    return outDS
+
+
+def createRasterLike(srcDS, raster_fn, dataType, nodata,
+    rasterFormat=defaultRasterFormat):
+    """
+    Creates a single-band raster with the same size, geotransform
+    and projection as an existing dataset (call finishRaster once it's
+    written and closed)
+
+    Args:
+        srcDS, GDAL dataset to copy the grid from
+        raster_fn, filename to use for output
+        dataType, GDAL data type of the output band
+        nodata, nodata value of the output band
+        rasterFormat, output format (see createRaster)
+    Returns:
+        GDAL dataset (open for writing)
+    """
+    return createRaster(raster_fn, srcDS.RasterXSize, srcDS.RasterYSize,
+        srcDS.GetGeoTransform(), srcDS.GetProjection(), dataType, nodata,
+        rasterFormat)
+
+
+def finishRaster(raster_fn, rasterFormat=defaultRasterFormat,
+    resampling='AVERAGE'):
+    """
+    Finishes an output raster once it's written and every reference to its
+    dataset is dropped: copies it to a COG, or adds internal overviews to
+    a GeoTIFF (SAGA grids need nothing)
+
+    Args:
+        raster_fn, output raster filename
+        rasterFormat, output format (see createRaster)
+        resampling, overview resampling method ('NEAREST' for classes and
+            codes, 'AVERAGE' for continuous values)
+    Returns:
+        None
+    """
+    rasterFormat = rasterFormatFor(raster_fn, rasterFormat)
+    if rasterFormat == 'COG':
+        tmp_fn = writePath(raster_fn, rasterFormat)
+        tmpDS = gdal.Open(tmp_fn)
+        gdal.GetDriverByName('COG').CreateCopy(raster_fn, tmpDS,
+            options=rasterFormats['COG'] + ['OVERVIEW_RESAMPLING=' + resampling])
+        tmpDS = None
+        gdal.GetDriverByName('GTiff').Delete(tmp_fn)
+    elif rasterFormat == 'GTiff':
+        outDS = gdal.Open(raster_fn, gdal.GA_Update)
+        levels = overviewLevels(outDS.RasterXSize, outDS.RasterYSize)
+        if levels:
+            outDS.BuildOverviews(resampling, levels)
+        outDS = None
+
+
+def writeRasterLike(srcDS, raster_fn, values, dataType, nodata,
+    rasterFormat=defaultRasterFormat, resampling='AVERAGE'):
+    """
+    Writes a whole array as a single-band raster on the same grid as an
+    existing dataset, and finishes it
+
+    Args:
+        srcDS, GDAL dataset to copy the grid from
+        raster_fn, filename to use for output
+        values, 2D array to write (already in the output data type)
+        dataType, GDAL data type of the output band
+        nodata, nodata value of the output band
+        rasterFormat, output format (see createRaster)
+        resampling, overview resampling method (see finishRaster)
+    Returns:
+        None
+    """
+    outDS = createRasterLike(srcDS, raster_fn, dataType, nodata, rasterFormat)
+    outDS.GetRasterBand(1).WriteArray(values)
+    outDS = None
+    finishRaster(raster_fn, rasterFormat, resampling)
+
+
+def driverForVectorFilename(vector_fn):
+    """
+    Picks the OGR driver for an output vector file from its file extension
+    (GeoPackage, FlatGeobuf, GeoJSON, or shapefile otherwise)
+    """
+    extension = os.path.splitext(vector_fn)[1].lower()
+    return ogr.GetDriverByName(vectorDrivers.get(extension, 'ESRI Shapefile'))
+
+
+def createVectorLayer(vector_fn, projection, geometryType, fields,
+    layerName=None, addLayer=False):
+    """
+    Creates a vector file holding one layer (replacing any existing file),
+    or adds a layer to an existing GeoPackage
+
+    Args:
+        vector_fn, filename to use for output
+        projection, WKT of the output coordinate reference system
+        geometryType, OGR geometry type of the layer
+        fields, list of (field name, OGR field type) tuples
+        layerName, layer name (default: the file's name)
+        addLayer, add the layer to vector_fn if it exists (replacing any
+            layer of the same name) instead of replacing the file
+    Returns:
+        (OGR data source, layer)--keep the data source referenced until
+        you're done writing
+    """
+    driver = driverForVectorFilename(vector_fn)
+    if layerName is None:
+        layerName = os.path.splitext(os.path.basename(vector_fn))[0]
+    if addLayer and os.path.exists(vector_fn):
+        outDS = ogr.Open(vector_fn, 1)
+        for i in range(outDS.GetLayerCount()):
+            if outDS.GetLayer(i).GetName() == layerName:
+                outDS.DeleteLayer(i)
+                break
+    else:
+        if os.path.exists(vector_fn):
+            driver.DeleteDataSource(vector_fn)
+        outDS = driver.CreateDataSource(vector_fn)
+    srs = None
+    if projection:
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(projection)
+    layer = outDS.CreateLayer(layerName, srs, geometryType,
+        options=vectorLayerOptions.get(driver.GetName(), []))
+    for name, fieldType in fields:
+        layer.CreateField(ogr.FieldDefn(name, fieldType))
+    return outDS, layer
+
+
+def buildSpatialIndex(ds, layer):
+    """
+    Builds a vector layer's spatial index once its features are written: an
+    R-tree for a GeoPackage layer, a .qix file for a shapefile (FlatGeobuf
+    writes its own as it's closed)
+    """
+    driverName = ds.GetDriver().GetName()
+    if driverName == 'GPKG':
+        result = ds.ExecuteSQL("SELECT CreateSpatialIndex('%s', '%s')"
+            % (layer.GetName(), layer.GetGeometryColumn()))
+        if result is not None:
+            ds.ReleaseResultSet(result)
+    elif driverName == 'ESRI Shapefile':
+        ds.ExecuteSQL('CREATE SPATIAL INDEX ON "%s"' % layer.GetName())
+
+
+class VectorSink:
+    """
+    Writes features to a new vector layer in large transactions (where the
+    format supports them), then builds the layer's spatial index in bulk.
+    Optionally, summary statistics of some fields are accumulated as the
+    features are written and saved beside the layer (see readVectorSummary),
+    so the layer can be styled without scanning it again.
+
+    Args:
+        vector_fn, projection, geometryType, fields, layerName, addLayer,
+            as for createVectorLayer
+        batchSize, features written per transaction
+        summaryFields, names of the fields to summarize: the minimum,
+            maximum, and total of each, and for integer fields the number
+            of features with each value
+    """
+
+    def __init__(self, vector_fn, projection, geometryType, fields,
+        layerName=None, addLayer=False, batchSize=defaultVectorBatch,
+        summaryFields=()):
+        self.ds, self.layer = createVectorLayer(vector_fn, projection,
+            geometryType, fields, layerName, addLayer)
+        self.defn = self.layer.GetLayerDefn()
+        self.batchSize = batchSize
+        self.transactions = bool(self.ds.TestCapability(ogr.ODsCTransactions))
+        self.pending = 0
+        if self.transactions:
+            self.ds.StartTransaction()
+
+        self.vector_fn = vector_fn
+        self.featureCount = 0
+        fieldTypes = dict(fields)
+        self.summaries = {name:{'integer':fieldTypes[name] == ogr.OFTInteger,
+            'minimum':None, 'maximum':None, 'total':0, 'counts':{}}
+            for name in summaryFields}
+
+    def newFeature(self):
+        """
+        Makes an empty feature with the layer's fields
+        """
+        return ogr.Feature(self.defn)
+
+    def add(self, feature):
+        """
+        Writes a feature, committing the transaction every batchSize features
+        """
+        self.layer.CreateFeature(feature)
+        self.pending += 1
+        if self.transactions and self.pending >= self.batchSize:
+            self.ds.CommitTransaction()
+            self.ds.StartTransaction()
+            self.pending = 0
+
+        self.featureCount += 1
+        for name, summary in self.summaries.items():
+            value = feature.GetField(name)
+            if value is None:
+                continue
+            if summary['minimum'] is None or value < summary['minimum']:
+                summary['minimum'] = value
+            if summary['maximum'] is None or value > summary['maximum']:
+                summary['maximum'] = value
+            summary['total'] += value
+            if summary['integer']:
+                summary['counts'][value] = summary['counts'].get(value, 0) + 1
+
+    def close(self):
+        """
+        Commits the last transaction, builds the spatial index, closes the
+        file, and saves the field summaries (if any)
+        """
+        if self.transactions:
+            self.ds.CommitTransaction()
+        buildSpatialIndex(self.ds, self.layer)
+        self.layer = self.defn = self.ds = None
+
+        if self.summaries:
+            fields = {}
+            for name, summary in self.summaries.items():
+                fields[name] = {'minimum':summary['minimum'],
+                    'maximum':summary['maximum'], 'total':summary['total']}
+                if summary['integer']:
+                    fields[name]['counts'] = summary['counts']
+            saveVectorSummary(self.vector_fn, {'featureCount':self.featureCount,
+                'fields':fields})
+
+
+def saveVectorSummary(vector_fn, summary):
+    """
+    Writes the field summaries of a vector output beside it (as read by
+    readVectorSummary)
+    """
+    fields = {}
+    for name, field in summary['fields'].items():
+        fields[name] = dict(field)
+        if 'counts' in field:
+            fields[name]['counts'] = {str(value):count for value, count
+                in sorted(field['counts'].items())}
+    summary_fn = vectorSummaryPath(vector_fn)
+    tmp_fn = summary_fn + '.tmp' # never write through a cached hard link
+    with open(tmp_fn, 'w') as f:
+        json.dump({'featureCount':summary['featureCount'], 'fields':fields},
+            f, indent=1)
+    os.replace(tmp_fn, summary_fn)
+
+
+def vectorSummaryPath(vector_fn):
+    """
+    Gets the filename of the field summaries saved beside a vector output
+    (a sidecar file, so it's cached and removed along with the layer)
+    """
+    return os.path.splitext(vector_fn)[0] + '.summary.json'
+
+
+def readVectorSummary(vector_fn):
+    """
+    Reads the field summaries saved by VectorSink beside a vector output
+
+    Returns:
+        dict with 'featureCount' and 'fields' (field name -> dict with
+        'minimum', 'maximum', 'total', and for integer fields 'counts', a
+        dict of value -> number of features), or None if there are none
+    """
+    summary_fn = vectorSummaryPath(vector_fn)
+    if not os.path.exists(summary_fn):
+        return None
+    with open(summary_fn) as f:
+        summary = json.load(f)
+    for field in summary['fields'].values():
+        if 'counts' in field:
+            field['counts'] = {int(value):count
+                for value, count in field['counts'].items()}
+    return summary
+
+
+def packageVectors(vector_fns, package_fn, layerNames=None,
+    batchSize=defaultVectorBatch):
+    """
+    Copies vector layers into one GeoPackage (replacing it), one layer per
+    file, each written in batched transactions and spatially indexed
+
+    Args:
+        vector_fns, vector files to copy (the first layer of each)
+        package_fn, GeoPackage filename to use for output
+        layerNames, optional layer names (default: each file's name)
+        batchSize, features written per transaction
+    Returns:
+        None
+    """
+    if os.path.exists(package_fn):
+        driverForVectorFilename(package_fn).DeleteDataSource(package_fn)
+    for i, vector_fn in enumerate(vector_fns):
+        srcDS = ogr.Open(vector_fn)
+        srcLayer = srcDS.GetLayer(0)
+        srcDefn = srcLayer.GetLayerDefn()
+        srs = srcLayer.GetSpatialRef()
+        fields = [(srcDefn.GetFieldDefn(j).GetName(),
+            srcDefn.GetFieldDefn(j).GetType())
+            for j in range(srcDefn.GetFieldCount())]
+        layerName = layerNames[i] if layerNames \
+            else os.path.splitext(os.path.basename(vector_fn))[0]
+        sink = VectorSink(package_fn, srs.ExportToWkt() if srs else None,
+            srcLayer.GetGeomType(), fields, layerName, addLayer=True,
+            batchSize=batchSize)
+        for srcFeature in srcLayer:
+            feature = sink.newFeature()
+            feature.SetFrom(srcFeature)
+            sink.add(feature)
+        sink.close()
+        srcDS = None
+
+
+# define the memory-mapped raster access layer
+
+# SAGA grid data formats and the NumPy and GDAL types (by name) they map to
+sagaDataFormats = {'BYTE_UNSIGNED':('u1', 'Byte'),
+    'SHORTINT_UNSIGNED':('u2', 'UInt16'),
+    'SHORTINT':('i2', 'Int16'),
+    'INTEGER_UNSIGNED':('u4', 'UInt32'),
+    'INTEGER':('i4', 'Int32'),
+    'FLOAT':('f4', 'Float32'),
+    'DOUBLE':('f8', 'Float64')}
+
+
+def readSagaHeader(raster_fn):
+    """
+    Reads the header (.sgrd) of a SAGA grid
+
+    Returns:
+        dict of header key -> value (as strings), or None if there's no header
+    """
+    header_fn = os.path.splitext(raster_fn)[0] + '.sgrd'
+    if not os.path.isfile(header_fn):
+        return None
+    header = {}
+    with open(header_fn) as f:
+        for line in f:
+            if '=' in line:
+                key, value = line.split('=', 1)
+                header[key.strip().upper()] = value.strip()
+    return header
+
+
+def mapRaster(raster_fn):
+    """
+    Memory-maps an uncompressed raster (a SAGA grid) as a read-only NumPy
+    array, oriented top row first; blocks sliced from it are views of the
+    OS page cache, with no decoding or copying
+
+    Args:
+        raster_fn, raster filename
+    Returns:
+        (array, nodata, GDAL data type), or None if the raster can't be
+        mapped (compressed, scaled, or not a SAGA grid)
+    """
+    if not raster_fn.lower().endswith('.sdat'):
+        return None
+    header = readSagaHeader(raster_fn)
+    if header is None or header.get('DATAFORMAT') not in sagaDataFormats:
+        return None
+    if float(header.get('Z_FACTOR', 1)) != 1:
+        return None # stored values are scaled
+
+    typeCode, typeName = sagaDataFormats[header['DATAFORMAT']]
+    byteOrder = '>' if header.get('BYTEORDER_BIG', 'FALSE').upper() == 'TRUE' else '<'
+    dtype = np.dtype(byteOrder + typeCode)
+    cols, rows = int(header['CELLCOUNT_X']), int(header['CELLCOUNT_Y'])
+    offset = int(header.get('DATAFILE_OFFSET', 0))
+    if os.path.getsize(raster_fn) < offset + rows * cols * dtype.itemsize:
+        return None
+
+    array = np.memmap(raster_fn, dtype=dtype, mode='r', offset=offset,
+        shape=(rows, cols))
+    if header.get('TOPTOBOTTOM', 'FALSE').upper() != 'TRUE':
+        array = array[::-1] # SAGA stores rows bottom to top by default
+    nodata = header.get('NODATA_VALUE')
+    return array, float(nodata) if nodata is not None else None, \
+        gdal.GetDataTypeByName(typeName)
+
+
+class MappedBand:
+    """
+    Read-only stand-in for a GDAL band backed by a memory-mapped raster
+    (see mapRaster): ReadAsArray hands out views instead of copies
+
+    Args:
+        array, mapped array (top row first)
+        nodata, nodata value
+        dataType, GDAL data type
+    """
+
+    def __init__(self, array, nodata, dataType):
+        self.array = array
+        self.nodata = nodata
+        self.DataType = dataType
+        self.YSize, self.XSize = array.shape
+
+    def GetNoDataValue(self):
+        return self.nodata
+
+    def ReadAsArray(self, col0=0, row0=0, cols=None, rows=None):
+        cols = self.XSize - col0 if cols is None else cols
+        rows = self.YSize - row0 if rows is None else rows
+        return self.array[row0:row0 + rows, col0:col0 + cols]
+
+    def ComputeRasterMinMax(self, approx=False):
+        minimum, maximum = np.inf, -np.inf
+        for row0 in range(0, self.YSize, defaultBlockRows):
+            block = self.array[row0:row0 + defaultBlockRows]
+            if self.nodata is not None:
+                block = block[block != self.nodata]
+            if block.size:
+                minimum = min(minimum, float(block.min()))
+                maximum = max(maximum, float(block.max()))
+        return minimum, maximum
+
+
+def openBand(raster_fn, srcDS=None):
+    """
+    Opens the band of a single-band raster for reading: memory-mapped when
+    the raster is uncompressed (SAGA grids, e.g. intermediates chained
+    between stages), so every block read is a view of the OS page cache;
+    otherwise the GDAL band
+
+    Args:
+        raster_fn, raster filename
+        srcDS, the raster's GDAL dataset, if already open
+    Returns:
+        MappedBand or GDAL band
+    """
+    mapped = mapRaster(raster_fn)
+    if mapped is not None:
+        return MappedBand(*mapped)
+    if srcDS is None:
+        srcDS = gdal.Open(raster_fn)
+    return srcDS.GetRasterBand(1)
+
+
+def readWindow(band, col0, row0, cols, rows, dtype=np.float64):
+    """
+    Reads a window of a band as float64 (or another float type), with
+    nodata cells set to NaN
+    """
+    block = band.ReadAsArray(col0, row0, cols, rows).astype(dtype)
+    nodata = band.GetNoDataValue()
+    if nodata is not None:
+        block[block == nodata] = np.nan
+    return block
+
+
+def iterHaloBlocks(band, blockRows=defaultBlockRows):
+    """
+    Reads a band in blocks of rows, each padded with a one-cell halo
+    (neighboring DEM cells where they exist, NaN past the raster edges)
+
+    Args:
+        band, GDAL raster band to read
+        blockRows, number of rows per block
+    Returns:
+        generator of (row0, row1, window), where window is a float64 array
+        of shape (row1 - row0 + 2, band width + 2) covering rows row0-1..row1
+        and with nodata cells set to NaN
+    """
+    width, height = band.XSize, band.YSize
+
+    for row0 in range(0, height, blockRows):
+        row1 = min(row0 + blockRows, height)
+        readRow0 = max(row0 - 1, 0)
+        readRow1 = min(row1 + 1, height)
+
+        window = np.full((row1 - row0 + 2, width + 2), np.nan)
+        block = readWindow(band, 0, readRow0, width, readRow1 - readRow0)
+
+        top = readRow0 - (row0 - 1) # 1 at the top edge of the raster, else 0
+        window[top:top + block.shape[0], 1:-1] = block
+        yield row0, row1, window
+
+
+# define functions for the terrain derivatives
+
+def hornGradient(window, ewres, nsres):
+    """
+    Computes the Horn (third-order finite difference) gradient
+    of the interior cells of a haloed window
+
+    Args:
+        window, 2D array with a one-cell halo on every side
+        ewres, east-west cell size (DEM horizontal units)
+        nsres, north-south cell size (DEM horizontal units)
+    Returns:
+        (x, y) arrays, two cells smaller than window in each dimension:
+        x is the west-minus-east rate of change and y the north-minus-south
+        rate of change (NaN wherever the 3x3 neighborhood touches nodata)
+    """
+    nw, n, ne = window[:-2, :-2], window[:-2, 1:-1], window[:-2, 2:]
+    w, e = window[1:-1, :-2], window[1:-1, 2:]
+    sw, s, se = window[2:, :-2], window[2:, 1:-1], window[2:, 2:]
+
+    x = ((nw + 2 * w + sw) - (ne + 2 * e + se)) / (8 * ewres)
+    y = ((nw + 2 * n + ne) - (sw + 2 * s + se)) / (8 * nsres)
+    return x, y
+
+
+def slopePercent(x, y):
+    """
+    Computes slope as percent from a Horn gradient (same as gdal:slope with
+    AS_PERCENT and SCALE=1)
+    """
+    return 100 * np.sqrt(x * x + y * y)
+
+
+def aspectDegrees(x, y):
+    """
+    Computes aspect (degrees clockwise from north, the direction the slope faces)
+    from a Horn gradient; flat cells are NaN
+    """
+    with np.errstate(invalid='ignore'):
+        aspect = np.mod(90 - np.degrees(np.arctan2(-y, x)), 360)
+        aspect[(x == 0) & (y == 0)] = np.nan
+    return aspect
+
+
+def hillshade(x, y, azimuth=315, altitude=45, zFactor=1):
+    """
+    Computes hillshade (1-255) from a Horn gradient, using the same
+    illumination model as gdal:hillshade
+
+    Args:
+        x, y, gradient arrays from hornGradient
+        azimuth, azimuth of the light (degrees)
+        altitude, altitude of the light (degrees)
+        zFactor, vertical exaggeration
+    Returns:
+        float array of shading values (NaN where the gradient is NaN)
+    """
+    az = np.radians(azimuth)
+    alt = np.radians(altitude)
+    xz = x * zFactor
+    yz = y * zFactor
+
+    cang = (np.sin(alt) - (yz * np.cos(az) - xz * np.sin(az)) * np.cos(alt)) \
+        / np.sqrt(1 + xz * xz + yz * yz)
+    with np.errstate(invalid='ignore'):
+        return np.where(cang <= 0, 1, 1 + 254 * cang)
+
+
+def multidirectionalHillshade(x, y, altitude=45, zFactor=1):
+    """
+    Computes multidirectional hillshade (1-255) from a Horn gradient: the
+    shading from lights at azimuths 225, 270, 315 and 360 degrees, weighted
+    by how closely each light lines up with the slope direction (the oblique
+    weighting of gdal:hillshade's multidirectional option)
+
+    Args:
+        x, y, gradient arrays from hornGradient
+        altitude, altitude of the lights (degrees)
+        zFactor, vertical exaggeration
+    Returns:
+        float array of shading values (NaN where the gradient is NaN)
+    """
+    alt = np.radians(altitude)
+    xz = x * zFactor
+    yz = y * zFactor
+    norm = np.sqrt(1 + xz * xz + yz * yz)
+
+    shade = np.zeros_like(xz)
+    weights = np.zeros_like(xz)
+    for azimuth in (225, 270, 315, 360):
+        az = np.radians(azimuth)
+        along = yz * np.cos(az) - xz * np.sin(az) # gradient along the light
+        with np.errstate(invalid='ignore'):
+            shade += along * along * np.maximum(np.sin(alt) - along * np.cos(alt), 0)
+        weights += along * along
+
+    # flat cells get the shading of a light straight overhead at that altitude
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cang = np.where(weights > 0, shade / weights, np.sin(alt)) / norm
+        return np.where(cang <= 0, 1, 1 + 254 * cang)
+
+
+def hillshadeVariant(x, y, illumination):
+    """
+    Computes one hillshade from a Horn gradient for an illumination config
+
+    Args:
+        x, y, gradient arrays from hornGradient
+        illumination, dict with 'azimuth', 'altitude', 'zFactor' and
+            'multidirectional' (see computeTerrainDerivatives)
+    Returns:
+        float array of shading values (NaN where the gradient is NaN)
+    """
+    if illumination['multidirectional']:
+        return multidirectionalHillshade(x, y, illumination['altitude'],
+            illumination['zFactor'])
+    return hillshade(x, y, illumination['azimuth'], illumination['altitude'],
+        illumination['zFactor'])
+
+
+def fillNodata(values, nodata, dtype):
+    """
+    Replaces NaN with a nodata value and casts to the output data type
+    """
+    if values.dtype == dtype:
+        return values
+    values = np.where(np.isnan(values), nodata, values)
+    if np.issubdtype(dtype, np.integer):
+        values = np.rint(values)
+    return values.astype(dtype)
+
+
+# define a histogram of band values accumulated while the band is written
+
+class BandHistogram:
+    """
+    Fixed-bin histogram of a band's values, accumulated block by block as
+    the band is written (values outside the range fall in the end bins),
+    along with the exact minimum, maximum, mean and standard deviation, so
+    statistics and percentile stretches need no extra pass over the raster
+
+    Args:
+        low, high, range of the bins
+        binCount, number of bins
+    """
+
+    def __init__(self, low, high, binCount):
+        self.low, self.high, self.binCount = low, high, binCount
+        self.counts = np.zeros(binCount, dtype=np.int64)
+        self.minimum, self.maximum = np.inf, -np.inf
+        self.total = self.sumSquares = 0.0
+
+    def add(self, values):
+        """
+        Adds a block of values (NaN = nodata) to the histogram
+        """
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        bins = ((values - self.low) * (self.binCount / (self.high - self.low))).astype(np.int64)
+        self.counts += np.bincount(np.clip(bins, 0, self.binCount - 1),
+            minlength=self.binCount)
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+        self.total += float(values.sum())
+        self.sumSquares += float(np.square(values).sum())
+
+    def percentile(self, percent):
+        """
+        Gets a percentile of the values (interpolated within its bin)
+        """
+        cumulative = np.cumsum(self.counts)
+        target = cumulative[-1] * percent / 100
+        i = int(np.searchsorted(cumulative, target))
+        below = cumulative[i - 1] if i > 0 else 0
+        fraction = (target - below) / self.counts[i] if self.counts[i] else 0
+        value = self.low + (i + fraction) * (self.high - self.low) / self.binCount
+        return float(np.clip(value, self.minimum, self.maximum))
+
+    def writeStatistics(self, band, percentiles=(2, 98)):
+        """
+        Stores the statistics in a band's metadata (STATISTICS_MINIMUM,
+        _MAXIMUM, _MEAN, _STDDEV, and _PERCENTILE_<p> for each percentile)
+        """
+        count = int(self.counts.sum())
+        if count == 0:
+            return
+        mean = self.total / count
+        stdDev = np.sqrt(max(self.sumSquares / count - mean ** 2, 0))
+        band.SetStatistics(self.minimum, self.maximum, mean, float(stdDev))
+        for percent in percentiles:
+            band.SetMetadataItem('STATISTICS_PERCENTILE_' + str(percent),
+                repr(self.percentile(percent)))
+
+
+def readBandStatistics(raster_fn):
+    """
+    Reads the statistics stored in a raster's metadata by BandHistogram
+
+    Returns:
+        dict of statistic (e.g. 'MINIMUM', 'PERCENTILE_98') -> value
+    """
+    band = gdal.Open(raster_fn).GetRasterBand(1)
+    return {key[len('STATISTICS_'):]:float(value)
+        for key, value in band.GetMetadata().items()
+        if key.startswith('STATISTICS_')}
+
+
+# define functions to classify values against breakpoint tables
+
+def slopeClassTable(upperBounds):
+    """
+    Builds a class table from ascending class upper bounds, e.g. the keys of
+    slopeClassDict ([5, 10, 15, 20, 30, inf] gives class 1 for 0-5, class 2
+    for >5-10, ... and class 6 for >30)
+
+    Args:
+        upperBounds, ascending upper bound (inclusive) of each class
+    Returns:
+        (edges, lookup, lower, side) table for classifyValues
+    """
+    edges = np.array(sorted(upperBounds), dtype=np.float64)
+    lookup = np.append(np.arange(1, len(edges) + 1), classNodata)
+    return edges, lookup.astype(np.uint8), 0, 'left'
+
+
+def compassClassTable(nDirections=8):
+    """
+    Builds a class table that bins aspect (degrees) into compass directions
+    centered on north, e.g. for 8 directions class 1 is N (>= 337.5 or < 22.5),
+    class 2 is NE (22.5-67.5), ... and class 8 is NW (292.5-337.5)
+
+    Args:
+        nDirections, number of compass directions
+    Returns:
+        (edges, lookup, lower, side) table for classifyValues
+    """
+    width = 360 / nDirections
+    edges = width / 2 + width * np.arange(nDirections)
+    lookup = np.append(np.arange(1, nDirections + 1), 1) # wrap back around to N
+    return edges, lookup.astype(np.uint8), 0, 'right'
+
+
+def classifyValues(values, classTable):
+    """
+    Classifies an array with one vectorized searchsorted lookup
+
+    Args:
+        values, float array to classify (NaN = nodata)
+        classTable, (edges, lookup, lower, side) from slopeClassTable
+            or compassClassTable
+    Returns:
+        uint8 array of classes (classNodata for NaN or values below lower)
+    """
+    edges, lookup, lower, side = classTable
+    classes = lookup[np.searchsorted(edges, values, side)]
+    with np.errstate(invalid='ignore'):
+        classes[~(values >= lower)] = classNodata
+    return classes
+
+
+# define function to compute every requested derivative in one pass
+
+def computeTerrainDerivatives(inDEM, slopeOut=None, aspectOut=None,
+    hillshadeOut=None, slopeClassOut=None, aspectClassOut=None,
+    slopeClasses=None, aspectClasses=None, azimuth=315, altitude=45,
+    zFactor=1, multidirectional=False, hillshades=None,
+    blockRows=defaultBlockRows, rasterFormat=defaultRasterFormat):
+    """
+    Computes slope (percent), aspect, hillshade and classified slope and aspect
+    from a DEM in one pass: each block of DEM rows is read once, the gradient
+    is computed once for all requested outputs, and the classes are binned
+    while slope and aspect are still in memory. Edge cells (and cells next to
+    nodata) are set to nodata, as with the GDAL tools' COMPUTE_EDGES=False.
+    Any number of hillshades (different lights, vertical exaggerations, or
+    multidirectional) come from the same gradient as well.
+    Slope, aspect and hillshade statistics (including the 2nd and 98th
+    percentiles) are accumulated as the blocks are written and stored in
+    the rasters' metadata (see readBandStatistics).
+
+    Args:
+        inDEM, DEM filename to use for input
+        slopeOut, filename for slope as percent (Float32), or None to skip
+        aspectOut, filename for aspect in degrees (Float32), or None to skip
+        hillshadeOut, filename for hillshade (Byte), or None to skip
+        slopeClassOut, filename for classified slope (Byte), or None to skip
+        aspectClassOut, filename for classified aspect (Byte), or None to skip
+        slopeClasses, class table for slope (from slopeClassTable)
+        aspectClasses, class table for aspect (defaults to 8 compass directions)
+        azimuth, azimuth of the light for the hillshade
+        altitude, altitude of the light for the hillshade
+        zFactor, vertical exaggeration for the hillshade
+        multidirectional, shade the hillshade with the multidirectional
+            model instead of a single light (azimuth is then ignored)
+        hillshades, list of extra hillshades, each a dict with 'out' (the
+            filename) and any of 'azimuth', 'altitude', 'zFactor' and
+            'multidirectional' (missing ones default to the values above)
+        blockRows, number of DEM rows to process per block
+        rasterFormat, output format (see createRaster)
+    Returns:
+        None
+    """
+    if slopeClassOut is not None and slopeClasses is None:
+        raise ValueError('slopeClasses is required to classify slope')
+    if aspectClasses is None:
+        aspectClasses = compassClassTable()
+
+    srcDS = gdal.Open(inDEM)
+    srcBand = openBand(inDEM, srcDS)
+    gt = srcDS.GetGeoTransform()
+    ewres, nsres = abs(gt[1]), abs(gt[5])
+
+    # (block key, output filename, illumination) of every hillshade
+    defaults = {'azimuth':azimuth, 'altitude':altitude, 'zFactor':zFactor,
+        'multidirectional':multidirectional}
+    shades = [('hillshade', hillshadeOut, defaults)]
+    for i, variant in enumerate(hillshades or []):
+        illumination = dict(defaults)
+        illumination.update((key, value) for key, value in variant.items()
+            if key != 'out')
+        shades.append(('hillshade_' + str(i), variant['out'], illumination))
+    shades = [shade for shade in shades if shade[1] is not None]
+
+    # (block key, output filename, GDAL type, NumPy type, nodata, overview
+    # resampling, histogram range and bins for the statistics)
+    products = [('slope', slopeOut, gdal.GDT_Float32, np.float32, slopeNodata,
+            'AVERAGE', (0, 1000, 10000)),
+        ('aspect', aspectOut, gdal.GDT_Float32, np.float32, aspectNodata,
+            'NEAREST', (0, 360, 3600))]
+    products += [(key, raster_fn, gdal.GDT_Byte, np.uint8, hillshadeNodata,
+        'AVERAGE', (0, 256, 256)) for key, raster_fn, illumination in shades]
+    products += [('slopeClass', slopeClassOut, gdal.GDT_Byte, np.uint8,
+            classNodata, 'NEAREST', None),
+        ('aspectClass', aspectClassOut, gdal.GDT_Byte, np.uint8, classNodata,
+            'NEAREST', None)]
+    products = [product for product in products if product[1] is not None]
+
+    outputs = []
+    for key, raster_fn, gdalType, npType, nodata, resampling, bins in products:
+        outDS = createRasterLike(srcDS, raster_fn, gdalType, nodata, rasterFormat)
+        histogram = BandHistogram(*bins) if bins is not None else None
+        outputs.append((key, outDS, npType, nodata, histogram))
+
+    needSlope = slopeOut is not None or slopeClassOut is not None
+    needAspect = aspectOut is not None or aspectClassOut is not None
+
+    for row0, row1, window in iterHaloBlocks(srcBand, blockRows):
+        x, y = hornGradient(window, ewres, nsres)
+
+        block = {}
+        if needSlope:
+            block['slope'] = slopePercent(x, y)
+        if needAspect:
+            block['aspect'] = aspectDegrees(x, y)
+        for key, raster_fn, illumination in shades:
+            block[key] = hillshadeVariant(x, y, illumination)
+        if slopeClassOut is not None:
+            block['slopeClass'] = classifyValues(block['slope'], slopeClasses)
+        if aspectClassOut is not None:
+            block['aspectClass'] = classifyValues(block['aspect'], aspectClasses)
+
+        for key, outDS, npType, nodata, histogram in outputs:
+            if histogram is not None:
+                histogram.add(block[key])
+            values = fillNodata(block[key], nodata, npType)
+            outDS.GetRasterBand(1).WriteArray(values, 0, row0)
+
+    # store the statistics (min/max/mean/std. dev. and the 2nd and 98th
+    # percentiles) of slope, aspect and hillshade with the rasters
+    for key, outDS, npType, nodata, histogram in outputs:
+        if histogram is not None:
+            histogram.writeStatistics(outDS.GetRasterBand(1))
+
+    outDS = outputs = None # close the outputs
+    for key, raster_fn, gdalType, npType, nodata, resampling, bins in products:
+        finishRaster(raster_fn, rasterFormat, resampling)
+
+
+# define functions to mosaic and resample DEM tiles in one streaming pass
+
+def kernelWeights(positions, resampling):
+    """
+    Computes separable interpolation weights
+
+    Args:
+        positions, fractional source indices of the output cell centers
+            (source cell centers are at whole numbers)
+        resampling, 'nearest', 'bilinear' or 'bspline' (cubic B-spline)
+    Returns:
+        (indices, weights), arrays of shape (taps, len(positions))
+    """
+    if resampling == 'nearest':
+        return np.rint(positions)[None, :].astype(np.int64), \
+            np.ones((1, len(positions)))
+
+    base = np.floor(positions)
+    f = positions - base
+    base = base.astype(np.int64)
+
+    if resampling == 'bilinear':
+        return np.stack([base, base + 1]), np.stack([1 - f, f])
+    if resampling == 'bspline':
+        weights = np.stack([(1 - f) ** 3 / 6,
+            (3 * f ** 3 - 6 * f ** 2 + 4) / 6,
+            (-3 * f ** 3 + 3 * f ** 2 + 3 * f + 1) / 6,
+            f ** 3 / 6])
+        return np.stack([base - 1, base, base + 1, base + 2]), weights
+    raise ValueError('unknown resampling method: ' + str(resampling))
+
+
+def interpolateGrid(src, colPositions, rowPositions, resampling):
+    """
+    Interpolates a source array at a regular grid of output cell centers.
+    Kernel weights are renormalized over the valid source cells, so tile
+    edges and nodata holes don't pull values toward zero; output cells
+    whose nearest source cell is outside src or nodata are NaN.
+
+    Args:
+        src, 2D float array (NaN = nodata)
+        colPositions, fractional source column of each output column
+        rowPositions, fractional source row of each output row
+        resampling, 'nearest', 'bilinear' or 'bspline'
+    Returns:
+        2D float array of shape (len(rowPositions), len(colPositions))
+    """
+    srcRows, srcCols = src.shape
+    valid = ~np.isnan(src)
+    values = np.where(valid, src, 0)
+
+    colIndex, colWeights = kernelWeights(colPositions, resampling)
+    rowIndex, rowWeights = kernelWeights(rowPositions, resampling)
+    colWeights = np.where((colIndex >= 0) & (colIndex < srcCols), colWeights, 0)
+    rowWeights = np.where((rowIndex >= 0) & (rowIndex < srcRows), rowWeights, 0)
+    colIndex = np.clip(colIndex, 0, srcCols - 1)
+    rowIndex = np.clip(rowIndex, 0, srcRows - 1)
+
+    # interpolate along rows first, then along columns
+    colSum = np.zeros((srcRows, len(colPositions)))
+    colWeightSum = np.zeros((srcRows, len(colPositions)))
+    for index, weights in zip(colIndex, colWeights):
+        colSum += weights * values[:, index]
+        colWeightSum += weights * valid[:, index]
+
+    total = np.zeros((len(rowPositions), len(colPositions)))
+    weightSum = np.zeros_like(total)
+    for index, weights in zip(rowIndex, rowWeights):
+        total += weights[:, None] * colSum[index, :]
+        weightSum += weights[:, None] * colWeightSum[index, :]
+
+    # require the nearest source cell to be valid
+    nearestCol = np.rint(colPositions).astype(np.int64)
+    nearestRow = np.rint(rowPositions).astype(np.int64)
+    colInside = (nearestCol >= 0) & (nearestCol < srcCols)
+    rowInside = (nearestRow >= 0) & (nearestRow < srcRows)
+    nearestValid = valid[np.clip(nearestRow, 0, srcRows - 1)][:,
+        np.clip(nearestCol, 0, srcCols - 1)]
+    nearestValid &= rowInside[:, None] & colInside[None, :]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = total / weightSum
+    result[~nearestValid | (weightSum <= 1e-12)] = np.nan
+    return result
+
+
+def readTileInfo(DEM_fn):
+    """
+    Reads the footprint and grid of a DEM tile
+
+    Args:
+        DEM_fn, DEM filename
+    Returns:
+        dict with the tile's filename, bounds (xmin, ymin, xmax, ymax),
+        geotransform, resolution, size (width, height) and projection (WKT),
+        or None if GDAL can't read the file as a raster
+    """
+    ds = gdal.Open(DEM_fn)
+    if ds is None or ds.RasterCount == 0:
+        return None
+    gt = ds.GetGeoTransform()
+    width, height = ds.RasterXSize, ds.RasterYSize
+    return {'fn':DEM_fn,
+        'bounds':(gt[0], gt[3] + gt[5] * height, gt[0] + gt[1] * width, gt[3]),
+        'geotransform':tuple(gt),
+        'resolution':(gt[1], -gt[5]),
+        'size':(width, height),
+        'projection':ds.GetProjection()}
+
+
+# define functions for the DEM tile index
+
+def updateTileIndex(DEM_folder, index_fn):
+    """
+    Builds or incrementally updates a tile index of a DEM folder, saved as a
+    JSON sidecar file. Only files that are new or whose size or modification
+    time changed are reopened; removed files are dropped from the index.
+
+    Args:
+        DEM_folder, folder holding the raw DEM tiles
+        index_fn, filename of the tile index (JSON)
+    Returns:
+        tile index (dict of file name -> tile entry)
+    """
+    index = {}
+    if os.path.isfile(index_fn):
+        with open(index_fn) as f:
+            index = json.load(f)
+
+    updated = {}
+    changed = False
+    for name in sorted(os.listdir(DEM_folder)):
+        DEM_fn = os.path.join(DEM_folder, name)
+        if not os.path.isfile(DEM_fn) or '.DS_Store' in name:
+            continue
+        stat = os.stat(DEM_fn)
+        entry = index.get(name)
+        if entry is None or entry['mtime'] != stat.st_mtime_ns \
+            or entry['fileSize'] != stat.st_size:
+            entry = {'mtime':stat.st_mtime_ns, 'fileSize':stat.st_size,
+                'tile':readTileInfo(DEM_fn)}
+            changed = True
+        updated[name] = entry
+
+    if changed or set(updated) != set(index):
+        tmp_fn = index_fn + '.tmp'
+        with open(tmp_fn, 'w') as f:
+            json.dump(updated, f)
+        os.replace(tmp_fn, index_fn)
+    return updated
+
+
+def aoiExtent(aoi):
+    """
+    Gets the bounding box (xmin, ymin, xmax, ymax) of an area of interest
+    given as a bounding box or as polygon WKT
+    """
+    if isinstance(aoi, str):
+        xmin, xmax, ymin, ymax = ogr.CreateGeometryFromWkt(aoi).GetEnvelope()
+        return (xmin, ymin, xmax, ymax)
+    return tuple(aoi)
+
+
+def queryTileIndex(index, DEM_folder, aoi=None):
+    """
+    Finds the tiles in a tile index that intersect an area of interest
+
+    Args:
+        index, tile index from updateTileIndex
+        DEM_folder, folder holding the raw DEM tiles
+        aoi, None for every tile, a bounding box (xmin, ymin, xmax, ymax)
+            or polygon WKT (in the DEMs' CRS)
+    Returns:
+        list of tile dicts (as from readTileInfo), sorted by file name
+    """
+    tiles = []
+    for name in sorted(index):
+        tile = index[name]['tile']
+        if tile is not None:
+            tile = dict(tile, fn=os.path.join(DEM_folder, name))
+            tile['bounds'] = tuple(tile['bounds'])
+            tile['geotransform'] = tuple(tile['geotransform'])
+            tiles.append(tile)
+    if aoi is None or not tiles:
+        return tiles
+
+    # quick bounding-box test on all tiles at once
+    bounds = np.array([tile['bounds'] for tile in tiles])
+    xmin, ymin, xmax, ymax = aoiExtent(aoi)
+    hits = (bounds[:, 0] < xmax) & (bounds[:, 2] > xmin) \
+        & (bounds[:, 1] < ymax) & (bounds[:, 3] > ymin)
+    tiles = [tile for tile, hit in zip(tiles, hits) if hit]
+
+    # exact test against a polygon AOI
+    if isinstance(aoi, str):
+        aoiGeom = ogr.CreateGeometryFromWkt(aoi)
+        tiles = [tile for tile in tiles
+            if aoiGeom.Intersects(boundsPolygon(tile['bounds']))]
+    return tiles
+
+
+def boundsPolygon(bounds):
+    """
+    Makes an OGR polygon from a bounding box (xmin, ymin, xmax, ymax)
+    """
+    xmin, ymin, xmax, ymax = bounds
+    return ogr.CreateGeometryFromWkt('POLYGON ((%r %r, %r %r, %r %r, %r %r, %r %r))'
+        % (xmin, ymin, xmax, ymin, xmax, ymax, xmin, ymax, xmin, ymin))
+
+
+def mosaicWindow(tiles, x0, y0, cellSize, col0, col1, row0, row1,
+    overlap, blendDist):
+    """
+    Mosaics the DEM tiles onto a window of a regular grid (bilinear sampling
+    of each tile, mean or blended overlaps)
+
+    Args:
+        tiles, tile dicts from readTileInfo
+        x0, y0, upper-left corner of the grid
+        cellSize, grid cell size
+        col0, col1, row0, row1, window of the grid to fill
+        overlap, 'mean' (average of all tiles) or 'blend' (weights rise from
+            0 at a tile's edge to 1 at blendDist inside it)
+        blendDist, blend distance (map units) for 'blend'
+    Returns:
+        2D float array (NaN where no tile has data)
+    """
+    xs = x0 + (np.arange(col0, col1) + 0.5) * cellSize
+    ys = y0 - (np.arange(row0, row1) + 0.5) * cellSize
+    total = np.zeros((len(ys), len(xs)))
+    weightSum = np.zeros_like(total)
+
+    for tile in tiles:
+        txmin, tymin, txmax, tymax = tile['bounds']
+        if txmin >= xs[-1] + cellSize or txmax <= xs[0] - cellSize \
+            or tymin >= ys[0] + cellSize or tymax <= ys[-1] - cellSize:
+            continue
+
+        gt = tile['geotransform']
+        width, height = tile['size']
+        colPositions = (xs - gt[0]) / gt[1] - 0.5
+        rowPositions = (ys - gt[3]) / gt[5] - 0.5
+
+        # read only the part of the tile the window needs
+        readCol0 = int(np.clip(np.floor(colPositions.min()) - 1, 0, width))
+        readCol1 = int(np.clip(np.floor(colPositions.max()) + 3, 0, width))
+        readRow0 = int(np.clip(np.floor(rowPositions.min()) - 1, 0, height))
+        readRow1 = int(np.clip(np.floor(rowPositions.max()) + 3, 0, height))
+        if readCol1 <= readCol0 or readRow1 <= readRow0:
+            continue
+
+        band = gdal.Open(tile['fn']).GetRasterBand(1)
+        src = readWindow(band, readCol0, readRow0, readCol1 - readCol0,
+            readRow1 - readRow0)
+        sample = interpolateGrid(src, colPositions - readCol0,
+            rowPositions - readRow0, 'bilinear')
+
+        if overlap == 'blend':
+            edgeDist = np.minimum.outer(np.minimum(ys - tymin, tymax - ys),
+                np.minimum(xs - txmin, txmax - xs))
+            weight = np.clip(edgeDist / blendDist, 1e-6, 1) if blendDist > 0 \
+                else np.ones_like(sample)
+        elif overlap == 'mean':
+            weight = np.ones_like(sample)
+        else:
+            raise ValueError('unknown overlap method: ' + str(overlap))
+
+        hasData = ~np.isnan(sample)
+        total[hasData] += (weight * sample)[hasData]
+        weightSum[hasData] += weight[hasData]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(weightSum > 0, total / weightSum, np.nan)
+
+
+def mosaicGrid(tiles, cellSize, extent=None):
+    """
+    Works out the output grid of a mosaic: fit to cells of the union of the
+    tile footprints, snapped outward to the output grain if an extent is
+    given (so any extent lines up with the cells of the full mosaic)
+
+    Args:
+        tiles, tile dicts from readTileInfo
+        cellSize, output grain (map units)
+        extent, optional output extent (xmin, ymin, xmax, ymax)
+    Returns:
+        (xmin, ymax, width, height) of the grid
+    """
+    uxmin = min(t['bounds'][0] for t in tiles)
+    uymax = max(t['bounds'][3] for t in tiles)
+    if extent is None:
+        xmin, ymax = uxmin, uymax
+        xmax = max(t['bounds'][2] for t in tiles)
+        ymin = min(t['bounds'][1] for t in tiles)
+    else:
+        xmin = uxmin + np.floor((extent[0] - uxmin) / cellSize) * cellSize
+        xmax = uxmin + np.ceil((extent[2] - uxmin) / cellSize) * cellSize
+        ymin = uymax - np.ceil((uymax - extent[1]) / cellSize) * cellSize
+        ymax = uymax - np.floor((uymax - extent[3]) / cellSize) * cellSize
+
+    xmin, xmax, ymin, ymax = float(xmin), float(xmax), float(ymin), float(ymax)
+    width = int(np.ceil((xmax - xmin) / cellSize - 1e-6))
+    height = int(np.ceil((ymax - ymin) / cellSize - 1e-6))
+    return xmin, ymax, width, height
+
+
+def mosaicResample(DEM_fns, outDEM, cellSize, mosaicGrain=None,
+    overlap='mean', blendDist=8, resampling='bspline', maxMemoryMB=512,
+    extent=None, rasterFormat=defaultRasterFormat):
+    """
+    Mosaics DEM tiles and resamples the mosaic in one streaming pass. The
+    output grid is walked in windows of rows; for each window only the
+    overlapping tiles are read, mosaicked at the raw grain (as SAGA's Mosaic
+    Raster Layers does) and resampled on the fly to the output grain, so no
+    full-size intermediate mosaic is written and memory stays under the
+    given ceiling.
+
+    Args:
+        DEM_fns, list of DEM tile filenames (same CRS), or tile dicts
+            from queryTileIndex
+        outDEM, filename to use for output
+        cellSize, output grain (map units)
+        mosaicGrain, grain to mosaic the tiles at before resampling
+            (defaults to the first tile's grain)
+        overlap, 'mean' or 'blend' (see mosaicWindow)
+        blendDist, blend distance (map units) for 'blend'
+        resampling, 'nearest', 'bilinear' or 'bspline'
+        maxMemoryMB, approximate memory ceiling for the working windows
+        extent, optional output extent (xmin, ymin, xmax, ymax); defaults
+            to the union of the tiles
+        rasterFormat, output format (see createRaster)
+    Returns:
+        None
+    """
+    tiles = [DEM_fn if isinstance(DEM_fn, dict) else readTileInfo(DEM_fn)
+        for DEM_fn in DEM_fns]
+    if mosaicGrain is None:
+        mosaicGrain = abs(tiles[0]['geotransform'][1])
+
+    xmin, ymax, width, height = mosaicGrid(tiles, cellSize, extent)
+    xmax, ymin = xmin + width * cellSize, ymax - height * cellSize
+    mosaicWidth = int(np.ceil((xmax - xmin) / mosaicGrain - 1e-6))
+    mosaicHeight = int(np.ceil((ymax - ymin) / mosaicGrain - 1e-6))
+
+    # rows per window: mosaic rows and output rows, ~4 float64 arrays each
+    ratio = cellSize / mosaicGrain
+    bytesPerRow = 8 * 4 * (mosaicWidth * max(ratio, 1) + width) \
+        + 8 * 2 * ratio * max(t['size'][0] for t in tiles)
+    windowRows = max(1, int(maxMemoryMB * 2 ** 20 // bytesPerRow))
+
+    outDS = createRaster(outDEM, width, height,
+        (xmin, cellSize, 0, ymax, 0, -cellSize), tiles[0]['projection'],
+        gdal.GDT_Float32, demNodata, rasterFormat)
+    outBand = outDS.GetRasterBand(1)
+
+    colPositions = (np.arange(width) + 0.5) * ratio - 0.5
+    taps = 2 if resampling != 'nearest' else 1
+
+    for row0 in range(0, height, windowRows):
+        row1 = min(row0 + windowRows, height)
+        rowPositions = (np.arange(row0, row1) + 0.5) * ratio - 0.5
+
+        if mosaicGrain == cellSize:
+            values = mosaicWindow(tiles, xmin, ymax, cellSize, 0, width,
+                row0, row1, overlap, blendDist)
+        else:
+            # mosaic the raw-grain rows under this window (plus the
+            # interpolation kernel's reach), then resample them
+            mRow0 = int(np.clip(np.floor(rowPositions[0]) - taps, 0, mosaicHeight))
+            mRow1 = int(np.clip(np.floor(rowPositions[-1]) + taps + 1, 0, mosaicHeight))
+            mosaic = mosaicWindow(tiles, xmin, ymax, mosaicGrain, 0, mosaicWidth,
+                mRow0, mRow1, overlap, blendDist)
+            values = interpolateGrid(mosaic, colPositions, rowPositions - mRow0,
+                resampling)
+
+        outBand.WriteArray(fillNodata(values, demNodata, np.float32), 0, row0)
+
+    outBand = outDS = None
+    finishRaster(outDEM, rasterFormat)
+
+
+# define functions to extract contours for several intervals in one pass
+
+def contourLevels(minimum, maximum, interval, offset=0):
+    """
+    Lists the contour levels of an interval that fall within a value range
+    """
+    first = int(np.ceil((minimum - offset) / interval))
+    last = int(np.floor((maximum - offset) / interval))
+    return [offset + k * interval for k in range(first, last + 1)]
+
+
+def levelKey(level):
+    """
+    Rounds a contour level so levels computed for different intervals
+    (e.g. 3 * 2.5 and 15 * 0.5) compare equal
+    """
+    return round(level, 6)
+
+
+def isMultiple(level, interval, offset=0):
+    """
+    Checks whether a contour level is a multiple of an interval
+    """
+    steps = (level - offset) / interval
+    return abs(steps - round(steps)) < 1e-6
+
+
+def lineParts(geometry):
+    """
+    Splits a (multi)line geometry into its line strings (other geometry
+    types, such as points left by clipping, give none)
+    """
+    geometryType = ogr.GT_Flatten(geometry.GetGeometryType())
+    if geometryType == ogr.wkbLineString:
+        return [geometry]
+    if geometryType in (ogr.wkbMultiLineString, ogr.wkbGeometryCollection):
+        return [part for i in range(geometry.GetGeometryCount())
+            for part in lineParts(geometry.GetGeometryRef(i))]
+    return []
+
+
+def joinSeamLines(lines, seamY, tolerance):
+    """
+    Joins lines that end at the same point of a seam (the horizontal line
+    y = seamY), e.g. the pieces of one contour from the strips either side
+    of it; lines whose ends meet on the seam at both ends become rings
+
+    Args:
+        lines, list of lines, each a list of (x, y) points
+        seamY, y coordinate of the seam
+        tolerance, distance within which two ends are the same point
+    Returns:
+        list of lines, each a list of (x, y) points
+    """
+    # pair up the ends on the seam, in order along it
+    ends = sorted((line[end][0], i, end) for i, line in enumerate(lines)
+        for end in (0, -1) if abs(line[end][1] - seamY) <= tolerance)
+    links = {}
+    k = 0
+    while k + 1 < len(ends):
+        (x, i, end), (nextX, j, nextEnd) = ends[k], ends[k + 1]
+        if nextX - x <= tolerance and (i, end) != (j, nextEnd):
+            links[i, end] = (j, nextEnd)
+            links[j, nextEnd] = (i, end)
+            k += 2
+        else:
+            k += 1
+    return [points for points, _ in joinLinkedLines(lines, links)]
+
+
+def joinLinkedLines(lines, links):
+    """
+    Joins chains of lines whose ends are linked; a chain that links back to
+    its first line becomes a ring
+
+    Args:
+        lines, list of lines, each a list of (x, y) points
+        links, dict of (line index, end) -> (line index, end) it joins, both
+            ways (end = 0 for the first point, -1 for the last)
+    Returns:
+        list of (points, indices of the lines joined into them)
+    """
+    # walk each chain of linked lines from a free end (or, for a ring, from
+    # any of its lines)
+    joined = []
+    visited = [False] * len(lines)
+    starts = [(i, end) for end in (0, -1) for i in range(len(lines))
+        if (i, end) not in links] + [(i, 0) for i in range(len(lines))]
+    for i, end in starts:
+        if visited[i]:
+            continue
+        points, members = [], []
+        while True:
+            visited[i] = True
+            members.append(i)
+            piece = lines[i] if end == 0 else lines[i][::-1]
+            points.extend(piece[1:] if points else piece)
+            link = links.get((i, -1 if end == 0 else 0))
+            if link is None:
+                break
+            if visited[link[0]]:
+                points[-1] = points[0] # back where it started: a ring
+                break
+            i, end = link
+        joined.append((points, members))
+    return joined
+
+
+def writeContour(sinks, counts, outputs, points, fieldName, level,
+    indexInterval=None, offset=0):
+    """
+    Writes a contour line to each of its outputs
+
+    Args:
+        sinks, list of VectorSink, one per output
+        counts, list of the features written to each output so far (updated)
+        outputs, indices of the outputs the contour's level belongs to
+        points, list of the line's (x, y) points
+        fieldName, name of the elevation attribute
+        level, elevation of the contour (contour units)
+        indexInterval, optional index contour interval (see extractContourSweep)
+        offset, offset from 0 relative to which to interpret indexInterval
+    Returns:
+        None
+    """
+    line = ogr.Geometry(ogr.wkbLineString)
+    for x, y in points:
+        line.AddPoint_2D(x, y)
+    for i in outputs:
+        counts[i] += 1
+        outFeature = sinks[i].newFeature()
+        outFeature.SetField('ID', counts[i])
+        outFeature.SetField(fieldName, level)
+        if indexInterval is not None:
+            outFeature.SetField('INDEX',
+                int(isMultiple(level, indexInterval, offset)))
+        outFeature.SetGeometry(line)
+        sinks[i].add(outFeature)
+
+
+def extractContourSweep(inDEM, intervals, contourOuts, offset=0,
+    fieldName='ELEV', indexInterval=None, zScale=1, blockRows=defaultContourRows):
+    """
+    Extracts contours for several intervals from one contouring pass over
+    a DEM: the levels of every interval are traced together (each shared
+    level once) and each contour is written to the output of every interval
+    it belongs to. The DEM is contoured in strips of rows that share their
+    edge rows, and each strip's contours are written out before the next
+    strip is read, so memory use doesn't grow with the DEM; contours are
+    clipped at the middle of the shared rows, so lines end (and the next
+    strip's lines start) at the same points along each seam, and the pieces
+    are joined there (see joinSeamLines)--only the lines crossing a seam are
+    held until the next strip is read. Intervals may
+    be in other vertical units than the DEM's (e.g. feet for a DEM in
+    meters): the levels are converted to the DEM's units with zScale, so
+    the DEM itself is never rescaled.
+
+    Args:
+        inDEM, DEM filename to use for input
+        intervals, list of intervals between contours (contour units)
+        contourOuts, list of filenames to use for output, one per interval
+        offset, offset from 0 relative to which to interpret intervals
+        fieldName, name of the elevation attribute (contour units)
+        indexInterval, optional index contour interval: every output gets
+            an INDEX attribute (1 for levels that are multiples of it, else 0)
+        zScale, contour units per DEM unit (e.g. feetPerMeter)
+        blockRows, number of DEM rows contoured per strip
+    Returns:
+        None
+    """
+    srcDS = gdal.Open(inDEM)
+    band = openBand(inDEM, srcDS)
+    width, height = band.XSize, band.YSize
+    x0, xres, _, y0, _, yres = srcDS.GetGeoTransform()
+    nodata = band.GetNoDataValue()
+    minimum, maximum = sorted(zScale * value
+        for value in band.ComputeRasterMinMax(False))
+
+    # levels (in contour units) and the outputs each belongs to, keyed on
+    # the level in DEM units
+    levels = {}
+    levelOutputs = {}
+    for i, interval in enumerate(intervals):
+        for level in contourLevels(minimum, maximum, interval, offset):
+            key = levelKey(level / zScale)
+            levels[key] = float(level)
+            levelOutputs.setdefault(key, []).append(i)
+    options = ['ID_FIELD=0', 'ELEV_FIELD=1',
+        'FIXED_LEVELS=' + ','.join(repr(level / zScale)
+        for level in sorted(levels.values()))]
+    if nodata is not None:
+        options.append('NODATA=' + repr(nodata))
+
+    fields = [('ID', ogr.OFTInteger), (fieldName, ogr.OFTReal)]
+    if indexInterval is not None:
+        fields.append(('INDEX', ogr.OFTInteger))
+    sinks = [VectorSink(contour_fn, srcDS.GetProjection(), ogr.wkbLineString,
+        fields) for contour_fn in contourOuts]
+    counts = [0] * len(sinks)
+    if len(levelOutputs) == 0:
+        for sink in sinks:
+            sink.close()
+        return
+
+    memDriver = gdal.GetDriverByName('MEM')
+    xmin, xmax = sorted([x0 - xres, x0 + (width + 1) * xres])
+    rowCenter = lambda row: y0 + (row + 0.5) * yres
+    tolerance = 1e-3 * min(abs(xres), abs(yres)) # ends closer than this meet
+    openLines = {} # level key -> lines ending on the last strip's bottom seam
+
+    for row0 in range(0, max(height - 1, 1), blockRows):
+        row1 = min(row0 + blockRows, height - 1) # last row, shared with the next strip
+
+        # contour the strip (with the DEM's own values, nodata included)
+        stripDS = memDriver.Create('', width, row1 - row0 + 1, 1, band.DataType)
+        stripDS.SetGeoTransform((x0, xres, 0, y0 + row0 * yres, 0, yres))
+        stripBand = stripDS.GetRasterBand(1)
+        stripBand.WriteArray(band.ReadAsArray(0, row0, width, row1 - row0 + 1))
+        if nodata is not None:
+            stripBand.SetNoDataValue(nodata)
+        memDS = ogr.GetDriverByName('Memory').CreateDataSource('')
+        memLayer = memDS.CreateLayer('contours', None, ogr.wkbLineString)
+        memLayer.CreateField(ogr.FieldDefn('ID', ogr.OFTInteger))
+        memLayer.CreateField(ogr.FieldDefn(fieldName, ogr.OFTReal))
+        gdal.ContourGenerateEx(stripBand, memLayer, options=options)
+
+        # the strip owns the band between the middles of its first and last
+        # rows (out to the DEM's edge on the first and last strips)
+        top = y0 - yres if row0 == 0 else rowCenter(row0)
+        bottom = y0 + (height + 1) * yres if row1 == height - 1 else rowCenter(row1)
+        ymin, ymax = sorted([top, bottom])
+        clip = boundsPolygon((xmin, ymin, xmax, ymax))
+
+        # join the strip's lines to the pieces left open at its top seam;
+        # lines that end on its bottom seam are held open for the next strip
+        stripLines = {}
+        for feature in memLayer:
+            key = levelKey(feature.GetField(1))
+            geometry = feature.GetGeometryRef()
+            envelope = geometry.GetEnvelope() # (xmin, xmax, ymin, ymax)
+            if envelope[2] < ymin or envelope[3] > ymax:
+                geometry = geometry.Intersection(clip)
+            stripLines.setdefault(key, []).extend([point[:2]
+                for point in line.GetPoints()] for line in lineParts(geometry))
+        memDS = None
+        stripDS = None
+
+        held = {}
+        for key in sorted(set(stripLines) | set(openLines)):
+            lines = openLines.get(key, []) + stripLines.get(key, [])
+            if row0 > 0:
+                lines = joinSeamLines(lines, top, tolerance)
+            for points in lines:
+                if row1 < height - 1 and (abs(points[0][1] - bottom) <= tolerance
+                    or abs(points[-1][1] - bottom) <= tolerance):
+                    held.setdefault(key, []).append(points)
+                else:
+                    writeContour(sinks, counts, levelOutputs[key], points,
+                        fieldName, levels[key], indexInterval, offset)
+        openLines = held
+
+    for sink in sinks:
+        sink.close()
@@ -0,0 +1,723 @@
+"""
+Headless hydrology engine used by terrainanalysis.py.
+
+Depression filling: a priority-flood implementation of the Wang & Liu fill
+(the same algorithm as SAGA's Fill Sinks XXL), with the same minimum-slope
+semantics: filled cells are raised so every cell keeps a downhill path of at
+least MINSLOPE degrees to the DEM's edge. Each cell is raised to the lowest
+level that keeps it such a path. Those levels don't depend on the order
+cells are visited in, so the flood runs as whole-array NumPy operations,
+from the lowest cells reached so far in batches, rather than popping one
+cell at a time off a heap (in pure Python, a heap flood is about eight times
+slower). For the same reason a tiled mode can fill DEMs larger than memory
+with the same result: each tile is flooded from its outlets and from the
+levels its neighbors left along their borders, and re-flooded whenever
+those levels drop, until no border level changes. DEMs too large to fill
+in memory are tiled automatically. Each batch spans a bounded range of
+levels, so no cell is relaxed more than floodBucketRises + 1 times.
+
+Drainage: D8 flow directions are computed with whole-array NumPy operations,
+and flow accumulation and Strahler order are computed together by visiting
+the flow graph from the headwaters down in rounds (a topological sort), each
+round a handful of vectorized scatter operations. Only the requested rasters
+are built. Channel networks are traced from the order raster, so networks
+for different thresholds reuse the same drainage rasters.
+"""
+import time
+from collections import deque
+
+import numpy as np
+try:
+    from osgeo import gdal, ogr
+except ImportError:
+    gdal = ogr = None
+
+from terrainengine import VectorSink, classNodata, createRasterLike, \
+    defaultRasterFormat, demNodata, fillNodata, finishRaster, openBand, \
+    readWindow, writeRasterLike
+
+# default tile size (cells) for the tiled fill, and the largest DEM (cells)
+# filled in memory when no tile size is given (the in-memory fill needs
+# about 30 bytes per cell)
+defaultFillTileSize = 4096
+maxInMemoryFillCells = 8192 * 8192
+
+# share of the cells the flood has reached (but at least a minimum number)
+# that it floods from at once, and the most minimum rises their levels may
+# span (which bounds how often a cell is relaxed again when its level drops)
+floodBucketFraction = 0.1
+floodBucketCells = 1024
+floodBucketRises = 256
+
+# D8 neighbor offsets (row, column) and their ESRI flow direction codes
+d8Offsets = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+d8Codes = [32, 64, 128, 16, 1, 8, 4, 2]
+directionNodata = 255
+
+
+# define functions for the priority-flood fill
+
+def neighborSteps(width, cellSize, minSlope):
+    """
+    Gets the flat-index offsets of the 8 neighbors of a cell in a padded
+    array of the given width, and the minimum rise toward each of them
+
+    Args:
+        width, width of the padded array
+        cellSize, cell size (DEM horizontal units)
+        minSlope, minimum slope (degrees) to keep across filled areas
+    Returns:
+        list of (offset, minimum rise) tuples
+    """
+    rise = np.tan(np.radians(minSlope)) * cellSize
+    diagonal = rise * np.sqrt(2)
+    return [(-width - 1, diagonal), (-width, rise), (-width + 1, diagonal),
+        (-1, rise), (1, rise),
+        (width - 1, diagonal), (width, rise), (width + 1, diagonal)]
+
+
+def padded(dem):
+    """
+    Pads a DEM array with a one-cell NaN border, so that every valid cell has
+    8 neighbors in the flat index space (a float32 DEM stays float32)
+    """
+    out = np.full((dem.shape[0] + 2, dem.shape[1] + 2), np.nan,
+        dtype=np.promote_types(dem.dtype, np.float32))
+    out[1:-1, 1:-1] = dem
+    return out
+
+
+def edgeCells(valid):
+    """
+    Finds the valid cells of a padded array that touch an invalid cell
+    (the raster edge or nodata)--the outlets of the flood
+
+    Returns:
+        flat indices into the padded array
+    """
+    touches = np.zeros_like(valid)
+    touches[1:-1, 1:-1] = ~(valid[:-2, :-2] & valid[:-2, 1:-1] & valid[:-2, 2:]
+        & valid[1:-1, :-2] & valid[1:-1, 2:]
+        & valid[2:, :-2] & valid[2:, 1:-1] & valid[2:, 2:])
+    return np.flatnonzero(valid & touches)
+
+
+def relaxNeighbors(z, level, frontier, offsets, rises):
+    """
+    Lowers the levels of the neighbors of a set of cells wherever a path
+    through one of those cells is lower
+
+    Args:
+        z, flat float array of elevations (NaN = nodata)
+        level, flat float array of levels (modified in place)
+        frontier, flat indices of the cells to relax from
+        offsets, rises, neighbor offsets and minimum rises (arrays)
+    Returns:
+        flat indices of the cells whose levels dropped (sorted, unique)
+    """
+    cells = (frontier[:, None] + offsets).ravel()
+    levels = np.maximum(z[cells], (level[frontier][:, None] + rises).ravel())
+    lower = levels < level[cells] # (never true for nodata: NaN compares false)
+    cells, levels = cells[lower], levels[lower]
+    if not cells.size:
+        return cells
+
+    # keep the lowest level offered to each cell
+    order = np.argsort(cells)
+    cells, levels = cells[order], levels[order]
+    starts = np.flatnonzero(np.concatenate([[True], cells[1:] != cells[:-1]]))
+    cells = cells[starts]
+    level[cells] = np.minimum.reduceat(levels, starts)
+    return cells
+
+
+def priorityFlood(z, seeds, seedLevels, steps):
+    """
+    Runs a priority flood (with an epsilon rise) from seed cells: each cell
+    ends at the lowest level, no lower than its elevation, from which a path
+    runs down to a seed falling at least the minimum rise at every step.
+    That level is the same whatever order cells are visited in (so a tile
+    flooded from its neighbors' levels gets the levels the whole DEM flooded
+    at once would), which lets the flood run vectorized: the lowest tenth
+    or so of the cells the flood has reached are taken together, and
+    relaxed as a whole-array frontier, round after round, until no level
+    below theirs drops. A batch spans at most floodBucketRises minimum
+    rises, and every step of a path raises its level by at least one, so
+    with a minimum slope above 0 a cell is relaxed at most
+    floodBucketRises + 1 times (and all but a few just once).
+
+    Args:
+        z, flat float array of elevations (NaN = nodata, never flooded)
+        seeds, flat indices of the seed cells: outlets, seeded at their
+            elevations, or nodata cells seeded with fixed levels
+        seedLevels, levels of the seed cells
+        steps, neighbor offsets and rises from neighborSteps
+    Returns:
+        flat float64 array of levels (inf where no path reaches a seed)
+    """
+    offsets = np.array([step[0] for step in steps])
+    rises = np.array([step[1] for step in steps])
+    # (with no minimum slope, batches are bounded only by their share)
+    bucketSpan = floodBucketRises * rises.min() if rises.min() > 0 else np.inf
+    level = np.full(z.shape, np.inf)
+    level[seeds] = seedLevels
+
+    queued = np.zeros(z.shape, dtype=bool)
+    pending = np.unique(seeds)
+    queued[pending] = True
+    while pending.size:
+        # take the lowest of the cells reached so far
+        pendingLevels = level[pending]
+        k = min(pending.size - 1, max(floodBucketCells,
+            int(pending.size * floodBucketFraction)))
+        top = min(np.partition(pendingLevels, k)[k],
+            pendingLevels.min() + bucketSpan)
+        frontier = pending[pendingLevels <= top]
+        later = [pending[pendingLevels > top]]
+        queued[frontier] = False
+
+        # flood from them until no level up to theirs drops; cells raised
+        # above them wait their turn
+        while frontier.size:
+            cells = relaxNeighbors(z, level, frontier, offsets, rises)
+            below = level[cells] <= top
+            frontier = cells[below]
+            cells = cells[~below]
+            cells = cells[~queued[cells]]
+            queued[cells] = True
+            later.append(cells)
+        pending = np.concatenate(later)
+    return level
+
+
+def fillArray(dem, cellSize, minSlope=0.01):
+    """
+    Fills the depressions of a DEM array in memory
+
+    Args:
+        dem, 2D float array (NaN = nodata)
+        cellSize, cell size (DEM horizontal units)
+        minSlope, minimum slope (degrees) to keep across filled areas
+    Returns:
+        filled 2D float64 array
+    """
+    work = padded(dem)
+    seeds = edgeCells(~np.isnan(work))
+    level = priorityFlood(work.ravel(), seeds, work.flat[seeds],
+        neighborSteps(work.shape[1], cellSize, minSlope))
+    del work
+
+    # (nodata cells are never reached)
+    filled = level.reshape(dem.shape[0] + 2, dem.shape[1] + 2)[1:-1, 1:-1]
+    filled[np.isinf(filled)] = np.nan
+    return filled
+
+
+# define functions for the tiled fill
+
+def tileWindows(width, height, tileSize):
+    """
+    Splits a raster into square tiles
+
+    Returns:
+        list of (col0, row0, cols, rows) windows, row by row
+    """
+    return [(col0, row0, min(tileSize, width - col0), min(tileSize, height - row0))
+        for row0 in range(0, height, tileSize) for col0 in range(0, width, tileSize)]
+
+
+def readHaloTile(band, window):
+    """
+    Reads a tile with a one-cell halo (NaN past the raster's edges)
+
+    Returns:
+        2D float array of shape (rows + 2, cols + 2)
+    """
+    col0, row0, cols, rows = window
+    readCol0, readRow0 = max(col0 - 1, 0), max(row0 - 1, 0)
+    readCol1 = min(col0 + cols + 1, band.XSize)
+    readRow1 = min(row0 + rows + 1, band.YSize)
+    block = readWindow(band, readCol0, readRow0, readCol1 - readCol0,
+        readRow1 - readRow0)
+    tile = np.full((rows + 2, cols + 2), np.nan)
+    top, left = readRow0 - (row0 - 1), readCol0 - (col0 - 1)
+    tile[top:top + block.shape[0], left:left + block.shape[1]] = block
+    return tile
+
+
+class SeamLevels:
+    """
+    Levels of the cells along every tile border (full raster rows and
+    columns), as left by the latest flood of the tile each cell lies in;
+    inf where a cell hasn't been reached yet (or is nodata)
+    """
+
+    def __init__(self, windows, width, height):
+        self.width, self.height = width, height
+        self.rows, self.cols = {}, {}
+        for col0, row0, cols, rows in windows:
+            for row in (row0, row0 + rows - 1):
+                self.rows.setdefault(row, np.full(width, np.inf))
+            for col in (col0, col0 + cols - 1):
+                self.cols.setdefault(col, np.full(height, np.inf))
+
+    def halo(self, window):
+        """
+        Gets the levels of the one-cell halo around a tile--border cells of
+        its neighbors--as an array shaped like readHaloTile's (inf inside
+        the tile, past the raster's edges, and where unknown)
+        """
+        col0, row0, cols, rows = window
+        halo = np.full((rows + 2, cols + 2), np.inf)
+        c0, c1 = max(col0 - 1, 0), min(col0 + cols + 1, self.width)
+        r0, r1 = max(row0 - 1, 0), min(row0 + rows + 1, self.height)
+        left, top = c0 - (col0 - 1), r0 - (row0 - 1)
+        if row0 > 0:
+            halo[0, left:left + c1 - c0] = self.rows[row0 - 1][c0:c1]
+        if row0 + rows < self.height:
+            halo[-1, left:left + c1 - c0] = self.rows[row0 + rows][c0:c1]
+        if col0 > 0:
+            halo[top:top + r1 - r0, 0] = self.cols[col0 - 1][r0:r1]
+        if col0 + cols < self.width:
+            halo[top:top + r1 - r0, -1] = self.cols[col0 + cols][r0:r1]
+        return halo
+
+    def update(self, window, filled):
+        """
+        Records the levels of a tile's border cells
+
+        Args:
+            window, the tile's window
+            filled, the tile's levels (inf where unknown or nodata)
+        Returns:
+            True if any of them changed
+        """
+        col0, row0, cols, rows = window
+        changed = False
+        for row, values in ((row0, filled[0]), (row0 + rows - 1, filled[-1])):
+            seam = self.rows[row][col0:col0 + cols]
+            changed = changed or not np.array_equal(seam, values)
+            seam[:] = values
+        for col, values in ((col0, filled[:, 0]), (col0 + cols - 1, filled[:, -1])):
+            seam = self.cols[col][row0:row0 + rows]
+            changed = changed or not np.array_equal(seam, values)
+            seam[:] = values
+        return changed
+
+
+def floodTile(tile, halo, cellSize, minSlope):
+    """
+    Floods a tile from its outlets (cells touching the DEM's edge or nodata)
+    and from the halo cells whose levels are known
+
+    Args:
+        tile, haloed tile array from readHaloTile
+        halo, halo levels from SeamLevels.halo
+        cellSize, cell size (DEM horizontal units)
+        minSlope, minimum slope (degrees) to keep across filled areas
+    Returns:
+        2D float64 array of the tile's levels (inf where unknown or nodata)
+    """
+    ring = np.ones(tile.shape, dtype=bool)
+    ring[1:-1, 1:-1] = False
+    isSeed = ring & np.isfinite(halo)
+    isSeed.flat[edgeCells(~np.isnan(tile))] = True
+
+    # the halo belongs to the neighboring tiles, so it's only flooded from,
+    # and it's padded once more so its cells have 8 neighbors too
+    work = padded(np.where(ring, np.nan, tile))
+    seeds = np.flatnonzero(np.pad(isSeed, 1))
+    seedLevels = padded(np.where(ring, halo, tile)).flat[seeds]
+    level = priorityFlood(work.ravel(), seeds, seedLevels,
+        neighborSteps(work.shape[1], cellSize, minSlope))
+    return level.reshape(work.shape)[2:-2, 2:-2]
+
+
+def fillTiled(band, outBand, cellSize, minSlope, tileSize):
+    """
+    Fills the depressions of a DEM band tile by tile, holding one tile in
+    memory at a time. Each tile is flooded from its outlets and from the
+    levels its neighbors left along their borders, and re-flooded whenever
+    those levels drop, until no border level changes; the levels are then
+    the same as the in-memory fill's, minimum slope included.
+
+    Args:
+        band, input DEM band
+        outBand, output band (same grid)
+        cellSize, cell size (DEM horizontal units)
+        minSlope, minimum slope (degrees) to keep across filled areas
+        tileSize, tile size (cells)
+    Returns:
+        None
+    """
+    windows = tileWindows(band.XSize, band.YSize, tileSize)
+    tilesPerRow = -(-band.XSize // tileSize)
+    tilesPerColumn = -(-band.YSize // tileSize)
+    seams = SeamLevels(windows, band.XSize, band.YSize)
+
+    halos = [None] * len(windows)
+    pending = deque(range(len(windows)))
+    queued = set(pending)
+    while pending:
+        t = pending.popleft()
+        queued.discard(t)
+        window = windows[t]
+        halo = seams.halo(window)
+        if halos[t] is not None and np.array_equal(halo, halos[t]):
+            continue
+        halos[t] = halo
+
+        tile = readHaloTile(band, window)
+        level = floodTile(tile, halo, cellSize, minSlope)
+        # (a tile no outlet or border level has reached yet is written later)
+        if np.isfinite(level).any() or np.isnan(tile[1:-1, 1:-1]).all():
+            filled = np.where(np.isinf(level), np.nan, level)
+            outBand.WriteArray(fillNodata(filled, demNodata, np.float32),
+                window[0], window[1])
+        if not seams.update(window, level):
+            continue
+
+        # the tile's borders dropped: its neighbors re-flood from them
+        tx, ty = t % tilesPerRow, t // tilesPerRow
+        for nx in range(max(tx - 1, 0), min(tx + 2, tilesPerRow)):
+            for ny in range(max(ty - 1, 0), min(ty + 2, tilesPerColumn)):
+                n = ny * tilesPerRow + nx
+                if n != t and n not in queued:
+                    pending.append(n)
+                    queued.add(n)
+
+
+# define function to fill sinks in a DEM
+
+def fillSinks(inDEM, outDEM, minSlope=0.01, tileSize=None,
+    rasterFormat=defaultRasterFormat):
+    """
+    Fills sinks in a DEM with a priority-flood Wang & Liu fill, keeping a
+    minimum slope across filled areas (same as SAGA's Fill Sinks XXL MINSLOPE)
+
+    Args:
+        inDEM, DEM filename to use for input
+        outDEM, filename to use for output
+        minSlope, minimum slope (degrees)
+        tileSize, tile size (cells) for the tiled fill, for DEMs larger
+            than memory (its output is the same as the in-memory fill's);
+            None (or 0) to fill in memory, unless the DEM has more than
+            maxInMemoryFillCells cells (then it's tiled at
+            defaultFillTileSize)
+        rasterFormat, output format (see terrainengine.createRaster)
+    Returns:
+        None
+    """
+    srcDS = gdal.Open(inDEM)
+    band = openBand(inDEM, srcDS)
+    cellSize = abs(srcDS.GetGeoTransform()[1])
+    outDS = createRasterLike(srcDS, outDEM, gdal.GDT_Float32, demNodata,
+        rasterFormat)
+    outBand = outDS.GetRasterBand(1)
+
+    if not tileSize and band.XSize * band.YSize > maxInMemoryFillCells:
+        tileSize = defaultFillTileSize
+    if tileSize and (band.XSize > tileSize or band.YSize > tileSize):
+        fillTiled(band, outBand, cellSize, minSlope, tileSize)
+    else:
+        filled = fillArray(readWindow(band, 0, 0, band.XSize, band.YSize),
+            cellSize, minSlope)
+        outBand.WriteArray(fillNodata(filled, demNodata, np.float32))
+    outBand = outDS = None
+    finishRaster(outDEM, rasterFormat)
+
+
+# define function to benchmark the fill against another implementation
+
+def benchmarkFill(inDEM, out_folder, otherFill=None, minSlope=0.01,
+    tileSize=defaultFillTileSize):
+    """
+    Times the in-memory and tiled fills (and, optionally, another fill such
+    as the SAGA tool) on the same DEM and compares their outputs
+
+    Args:
+        inDEM, DEM filename to use for input
+        out_folder, folder for the filled DEMs (must end in "/")
+        otherFill, optional function (inDEM, outDEM) to compare against
+        minSlope, minimum slope (degrees)
+        tileSize, tile size (cells) for the tiled fill
+    Returns:
+        dict of fill name -> {'seconds', 'maxDifference', 'meanDifference'},
+        with differences relative to the in-memory fill
+    """
+    runs = [('inMemory', lambda i, o: fillSinks(i, o, minSlope)),
+        ('tiled', lambda i, o: fillSinks(i, o, minSlope, tileSize))]
+    if otherFill is not None:
+        runs.append(('other', otherFill))
+
+    results = {}
+    reference = None
+    for name, fill in runs:
+        out_fn = out_folder + 'benchmarkFill_' + name + '.tif'
+        start = time.perf_counter()
+        fill(inDEM, out_fn)
+        seconds = time.perf_counter() - start
+
+        band = gdal.Open(out_fn).GetRasterBand(1)
+        filled = readWindow(band, 0, 0, band.XSize, band.YSize)
+        if reference is None:
+            reference = filled
+        difference = np.abs(filled - reference)
+        results[name] = {'seconds':seconds,
+            'maxDifference':float(np.nanmax(difference)),
+            'meanDifference':float(np.nanmean(difference))}
+    return results
+
+
+# define functions for D8 flow routing and Strahler ordering
+
+def flowDirections(dem, cellSize):
+    """
+    Computes D8 flow directions (steepest descent to one of the 8 neighbors)
+
+    Args:
+        dem, 2D float array of a filled DEM (NaN = nodata)
+        cellSize, cell size (DEM horizontal units)
+    Returns:
+        2D uint8 array of ESRI direction codes (1 = E, 2 = SE, 4 = S, 8 = SW,
+        16 = W, 32 = NW, 64 = N, 128 = NE; 0 = no lower neighbor)
+    """
+    rows, cols = dem.shape
+    work = padded(dem)
+    steepest = np.zeros(dem.shape, dtype=work.dtype)
+    directions = np.zeros(dem.shape, dtype=np.uint8)
+    for (drow, dcol), code in zip(d8Offsets, d8Codes):
+        neighbor = work[1 + drow:1 + drow + rows, 1 + dcol:1 + dcol + cols]
+        drop = (dem - neighbor) / (cellSize * np.hypot(drow, dcol))
+        steeper = drop > steepest # False where either cell is nodata
+        steepest[steeper] = drop[steeper]
+        directions[steeper] = code
+    return directions
+
+
+def receivers(directions, valid):
+    """
+    Gets the flat index of the cell each cell drains to
+
+    Returns:
+        1D int64 array (-1 for cells that don't drain to another cell)
+    """
+    rows, cols = directions.shape
+    rowStep = np.zeros(256, dtype=np.int64)
+    colStep = np.zeros(256, dtype=np.int64)
+    for (drow, dcol), code in zip(d8Offsets, d8Codes):
+        rowStep[code], colStep[code] = drow, dcol
+    codes = directions.ravel()
+    index = np.arange(codes.size)
+    downstream = index + rowStep[codes] * cols + colStep[codes]
+    downstream[(codes == 0) | ~valid.ravel()] = -1
+    return downstream
+
+
+def routeFlow(downstream, accumulation=True, order=True):
+    """
+    Visits the cells from the headwaters down (a topological sort of the
+    flow graph, processed in rounds of cells whose upstream cells are all
+    done) to accumulate flow and/or compute Strahler order
+
+    Args:
+        downstream, flat receiver indices from receivers
+        accumulation, whether to compute flow accumulation
+        order, whether to compute Strahler order
+    Returns:
+        (accumulation, order) flat arrays (None for products not computed);
+        accumulation counts each cell and all the cells upstream of it
+    """
+    size = downstream.size
+    drains = downstream >= 0
+    donors = np.bincount(downstream[drains], minlength=size)
+    acc = np.ones(size, dtype=np.uint32) if accumulation else None
+    if order:
+        strahler = np.ones(size, dtype=np.uint8)
+        highest = np.zeros(size, dtype=np.uint8) # highest donor order
+        highestCount = np.zeros(size, dtype=np.int64) # donors with that order
+        roundHighest = np.zeros(size, dtype=np.uint8)
+    else:
+        strahler = None
+
+    frontier = np.flatnonzero(donors == 0)
+    while frontier.size:
+        frontier = frontier[drains[frontier]]
+        target = downstream[frontier]
+        if accumulation:
+            np.add.at(acc, target, acc[frontier])
+        if order:
+            # highest donor order (and how many donors have it) this round,
+            # merged with earlier rounds
+            donorOrder = strahler[frontier]
+            roundHighest[target] = 0
+            np.maximum.at(roundHighest, target, donorOrder)
+            isHighest = donorOrder == roundHighest[target]
+            counts = np.bincount(target[isHighest])
+            targets = np.unique(target)
+            roundOrder = roundHighest[targets]
+            roundCount = counts[targets]
+            higher = roundOrder > highest[targets]
+            same = roundOrder == highest[targets]
+            highestCount[targets[higher]] = roundCount[higher]
+            highestCount[targets[same]] += roundCount[same]
+            highest[targets[higher]] = roundOrder[higher]
+
+        np.subtract.at(donors, target, 1)
+        frontier = np.unique(target[donors[target] == 0])
+        if order:
+            strahler[frontier] = np.maximum(highest[frontier], 1) \
+                + (highestCount[frontier] >= 2)
+
+    return acc, strahler
+
+
+# define function to compute drainage rasters from a filled DEM
+
+def computeDrainage(inDEM, directionOut=None, accumulationOut=None,
+    orderOut=None, rasterFormat=defaultRasterFormat):
+    """
+    Computes D8 flow direction, flow accumulation, and Strahler order rasters
+    from a filled DEM (the DEM is held in memory, as float32, only until
+    the flow directions are known). Only the requested products are
+    computed and written.
+
+    Args:
+        inDEM, filled DEM filename to use for input
+        directionOut, filename to use for flow direction (Byte, ESRI codes)
+        accumulationOut, filename to use for flow accumulation (UInt32,
+            number of cells draining through each cell)
+        orderOut, filename to use for Strahler order (Byte)
+        rasterFormat, output format (see terrainengine.createRaster)
+    Returns:
+        None
+    """
+    srcDS = gdal.Open(inDEM)
+    band = openBand(inDEM, srcDS)
+    dem = readWindow(band, 0, 0, band.XSize, band.YSize, np.float32)
+    valid = ~np.isnan(dem)
+    directions = flowDirections(dem, abs(srcDS.GetGeoTransform()[1]))
+    dem = None # the routing that follows needs only the directions
+
+    if directionOut is not None:
+        directions[~valid] = directionNodata
+        writeRasterLike(srcDS, directionOut, directions, gdal.GDT_Byte,
+            directionNodata, rasterFormat, 'NEAREST')
+
+    if accumulationOut is None and orderOut is None:
+        return
+    acc, strahler = routeFlow(receivers(directions, valid),
+        accumulationOut is not None, orderOut is not None)
+
+    for raster_fn, values, dataType in [(accumulationOut, acc, gdal.GDT_UInt32),
+        (orderOut, strahler, gdal.GDT_Byte)]:
+        if raster_fn is None:
+            continue
+        values = values.reshape(valid.shape)
+        values[~valid] = classNodata
+        writeRasterLike(srcDS, raster_fn, values, dataType, classNodata,
+            rasterFormat, 'NEAREST')
+
+
+# define functions to compute vector channel networks from the order raster
+
+def traceChannels(strahler, downstream, threshold, geotransform, projection,
+    channelsOut):
+    """
+    Traces the channel network of one threshold: channels are the cells of
+    order threshold or higher, split into segments at junctions
+
+    Args:
+        strahler, 2D Strahler order array
+        downstream, flat receiver indices of every cell (from receivers)
+        threshold, minimum Strahler order of channel cells
+        geotransform, projection, grid of the order raster
+        channelsOut, filename to use for output
+    Returns:
+        None
+    """
+    cols = strahler.shape[1]
+    strahler = strahler.ravel()
+    channel = strahler >= threshold
+    downstream = np.where(channel, downstream, -1)
+    donors = np.bincount(downstream[downstream >= 0], minlength=channel.size)
+
+    # segments start at channel heads and junctions (cells with other than
+    # exactly one upstream channel cell) and run down to the next junction
+    heads = np.flatnonzero(channel & (donors != 1))
+    startsSegment = np.zeros(channel.size, dtype=bool)
+    startsSegment[heads] = True
+
+    x0, xres, _, y0, _, yres = geotransform
+    sink = VectorSink(channelsOut, projection, ogr.wkbLineString,
+        [('SEGMENT_ID', ogr.OFTInteger), ('ORDER', ogr.OFTInteger),
+        ('LENGTH', ogr.OFTReal)], summaryFields=('ORDER', 'LENGTH'))
+    downstream = downstream.tolist()
+
+    for segmentID, head in enumerate(heads.tolist(), start=1):
+        cells = [head]
+        while downstream[cells[-1]] >= 0:
+            cells.append(downstream[cells[-1]])
+            if startsSegment[cells[-1]]:
+                break
+        if len(cells) < 2:
+            continue
+        cells = np.array(cells)
+        line = ogr.Geometry(ogr.wkbLineString)
+        for x, y in zip(x0 + (cells % cols + 0.5) * xres,
+            y0 + (cells // cols + 0.5) * yres):
+            line.AddPoint_2D(float(x), float(y))
+        feature = sink.newFeature()
+        feature.SetField('SEGMENT_ID', segmentID)
+        feature.SetField('ORDER', int(strahler[head]) - threshold + 1)
+        feature.SetField('LENGTH', line.Length())
+        feature.SetGeometry(line)
+        sink.add(feature)
+    sink.close()
+
+
+def extractChannelSweep(orderRaster, directionRaster, thresholds,
+    channelsOuts):
+    """
+    Traces vector channel networks for several thresholds from Strahler
+    order and flow direction rasters (from computeDrainage), reading the
+    rasters and decoding the flow directions once
+
+    Args:
+        orderRaster, Strahler order filename
+        directionRaster, flow direction filename
+        thresholds, list of minimum Strahler orders of channel cells
+        channelsOuts, list of filenames to use for output, one per
+            threshold, each with fields SEGMENT_ID, ORDER (Strahler order
+            renumbered so the threshold order is 1), and LENGTH (the
+            summaries of ORDER and LENGTH, e.g. the highest order and the
+            number of segments of each, are saved beside each output; see
+            readVectorSummary)
+    Returns:
+        None
+    """
+    orderDS = gdal.Open(orderRaster)
+    strahler = openBand(orderRaster, orderDS).ReadAsArray()
+    directions = openBand(directionRaster).ReadAsArray()
+    downstream = receivers(directions, strahler != classNodata)
+
+    for threshold, channelsOut in zip(thresholds, channelsOuts):
+        traceChannels(strahler, downstream, threshold,
+            orderDS.GetGeoTransform(), orderDS.GetProjection(), channelsOut)
+
+
+def extractChannels(orderRaster, directionRaster, threshold, channelsOut):
+    """
+    Traces a vector channel network from Strahler order and flow direction
+    rasters (see extractChannelSweep)
+
+    Args:
+        orderRaster, Strahler order filename
+        directionRaster, flow direction filename
+        threshold, minimum Strahler order of channel cells
+        channelsOut, filename to use for output
+    Returns:
+        None
+    """
+    extractChannelSweep(orderRaster, directionRaster, [threshold],
+        [channelsOut])
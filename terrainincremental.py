@@ -0,0 +1,746 @@
+"""
+Incremental recomputation for the terrain analysis pipeline.
+
+After each run, a manifest records every raw DEM tile's modification time,
+size, checksum and footprint, along with the job's settings and output grid.
+On the next run, tiles whose checksum changed (re-delivered, added or
+removed tiles; a tile that was only touched keeps its checksum) mark the
+parts of the output grid that can change. When the settings and grid are
+the same, only those windows are recomputed, each with the halo its
+operator needs, and patched into the existing outputs:
+
+    -mosaic/resample: the windows under the changed tiles, plus the reach
+        of the resampling kernel
+    -hillshade, slope, aspect and their classes: those windows plus the
+        one-cell Horn neighborhood
+    -contours: the features crossing those windows are cut back to the
+        parts outside them, and the contours inside are regenerated and
+        joined to those parts where they meet
+    -vectorized classes: the polygons meeting those windows are replaced
+        whole by polygons re-extracted from a cut of the patched classes
+        around them; since a class region (and the minimum-area sieve
+        around it) isn't bounded by any tile, the cut grows until the new
+        polygons cover exactly the old ones (see patchPolygons)
+
+The other stages then run as usual and see the patched rasters as changed
+inputs. The filled DEM, drainage and channels are rebuilt in full, since a
+change anywhere can move the spill level of a depression upstream of it
+and the flow accumulation and Strahler order of every cell downstream of
+it.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+try:
+    from osgeo import gdal, ogr
+except ImportError:
+    gdal = ogr = None
+
+from terrainengine import aoiExtent, boundsPolygon, buildSpatialIndex, \
+    defaultRasterFormat, joinLinkedLines, lineParts, mosaicGrid, \
+    readVectorSummary, saveVectorSummary
+from terrainpipeline import companionFiles, hashChunkSize, neededStages
+from terraintiles import cutTile, haloWindow, replacePaths, resolveFunction, \
+    runTiled, stitchTiles
+
+# filename of the manifest (in the outputs folder)
+manifestName = 'incremental.json'
+
+# cells of halo for the mosaic's resampling kernel and the Horn neighborhood
+mosaicHalo = 4
+neighborhoodHalo = 1
+
+# settings that don't change the outputs (so don't force a full run)
+runSettings = ['use_cache', 'cache_sizeLimitGB', 'worker_count', 'tile_size',
+    'tile_workers', 'tile_queueFolder', 'incremental', 'run_report',
+    'profile_stages', 'fill_tileSize']
+
+# above this fraction of the grid, patching costs more than a full run
+maxPatchFraction = 0.5
+
+# cells of margin around the polygons re-extracted from a classes raster
+# with a sieve, in widths of a square of the minimum area (the merges of
+# small regions can hinge on regions that far off); and the rounds of
+# growing the re-extracted area before the layer is rebuilt instead
+sieveReach = 4
+maxPolygonRounds = 8
+
+
+# define functions for the manifest of the last run
+
+def fileChecksum(data_fn):
+    """
+    Hashes a file's contents
+    """
+    digest = hashlib.blake2b()
+    with open(data_fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(hashChunkSize), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tileEntries(DEM_tiles, previous):
+    """
+    Gets the manifest entry (modification time, size, checksum and bounds)
+    of each tile; files whose modification time and size match the previous
+    manifest keep their checksum without being read
+
+    Args:
+        DEM_tiles, tile dicts from queryTileIndex
+        previous, tile entries of the previous manifest
+    Returns:
+        dict of file name -> entry
+    """
+    entries = {}
+    for tile in DEM_tiles:
+        name = os.path.basename(tile['fn'])
+        stat = os.stat(tile['fn'])
+        entry = previous.get(name)
+        if entry is None or entry['mtime'] != stat.st_mtime_ns \
+            or entry['fileSize'] != stat.st_size:
+            entry = {'mtime':stat.st_mtime_ns, 'fileSize':stat.st_size,
+                'checksum':fileChecksum(tile['fn'])}
+        entries[name] = dict(entry, bounds=list(tile['bounds']))
+    return entries
+
+
+def outputSettings(config):
+    """
+    Gets the settings of a job that determine its outputs
+    """
+    return json.loads(json.dumps({key: value for key, value in config.items()
+        if key not in runSettings}, sort_keys=True, default=repr))
+
+
+def readManifest(manifest_fn):
+    """
+    Reads the manifest of the last run, or None if there isn't one
+    """
+    if not os.path.isfile(manifest_fn):
+        return None
+    with open(manifest_fn) as f:
+        return json.load(f)
+
+
+def saveManifest(manifest_fn, config, entries, grid):
+    """
+    Writes the manifest of a completed run (atomically)
+
+    Args:
+        manifest_fn, manifest filename
+        config, complete job config
+        entries, tile entries (from tileEntries)
+        grid, (xmin, ymax, width, height) of the output grid
+    Returns:
+        None
+    """
+    tmp_fn = manifest_fn + '.tmp'
+    with open(tmp_fn, 'w') as f:
+        json.dump({'settings':outputSettings(config), 'tiles':entries,
+            'grid':list(grid)}, f)
+    os.replace(tmp_fn, manifest_fn)
+
+
+# define functions to find the windows of the grid to recompute
+
+def changedBounds(previous, entries):
+    """
+    Lists the footprints of the tiles that changed since the last run
+    (both old and new footprints, so removed tiles are cleared too)
+    """
+    bounds = []
+    for name in set(previous) | set(entries):
+        old, new = previous.get(name), entries.get(name)
+        if old is not None and new is not None \
+            and old['checksum'] == new['checksum'] and old['bounds'] == new['bounds']:
+            continue
+        bounds += [entry['bounds'] for entry in (old, new) if entry is not None]
+    return bounds
+
+
+def boundsWindow(bounds, grid, cellSize):
+    """
+    Gets the window of grid cells that a footprint overlaps
+
+    Returns:
+        (col0, row0, cols, rows) window, or None if it's off the grid
+    """
+    xmin, ymax, width, height = grid
+    col0 = max(int(np.floor((bounds[0] - xmin) / cellSize)), 0)
+    col1 = min(int(np.ceil((bounds[2] - xmin) / cellSize)), width)
+    row0 = max(int(np.floor((ymax - bounds[3]) / cellSize)), 0)
+    row1 = min(int(np.ceil((ymax - bounds[1]) / cellSize)), height)
+    if col1 <= col0 or row1 <= row0:
+        return None
+    return col0, row0, col1 - col0, row1 - row0
+
+
+def mergeWindows(windows):
+    """
+    Merges overlapping or touching windows into their bounding windows
+    """
+    windows = list(windows)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(windows)):
+            for j in range(i + 1, len(windows)):
+                a, b = windows[i], windows[j]
+                if a[0] <= b[0] + b[2] and b[0] <= a[0] + a[2] \
+                    and a[1] <= b[1] + b[3] and b[1] <= a[1] + a[3]:
+                    col0, row0 = min(a[0], b[0]), min(a[1], b[1])
+                    col1 = max(a[0] + a[2], b[0] + b[2])
+                    row1 = max(a[1] + a[3], b[1] + b[3])
+                    windows[i] = (col0, row0, col1 - col0, row1 - row0)
+                    del windows[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return windows
+
+
+def growWindows(windows, halo, grid):
+    """
+    Grows windows by a halo (clipped to the grid) and merges any that meet
+    """
+    return mergeWindows(haloWindow(window, halo, grid[2], grid[3])
+        for window in windows)
+
+
+def windowBounds(window, grid, cellSize):
+    """
+    Gets the footprint (xmin, ymin, xmax, ymax) of a window of grid cells
+    """
+    col0, row0, cols, rows = window
+    xmin, ymax = grid[0] + col0 * cellSize, grid[1] - row0 * cellSize
+    return xmin, ymax - rows * cellSize, xmin + cols * cellSize, ymax
+
+
+# define functions to recompute windows of a stage and patch its outputs
+
+def stageCall(stage):
+    """
+    Gets the operator, arguments and keyword arguments of a stage (looking
+    through tiledStage's wrapper)
+    """
+    if stage.func is runTiled:
+        funcName, args, kwargs = stage.args[:3]
+        return resolveFunction(funcName), args, kwargs
+    return stage.func, stage.args, stage.kwargs
+
+
+def runWindows(stage, windows, halo, work_folder):
+    """
+    Runs a stage whose input is the output grid's DEM on windows of it (each
+    cut with a halo), writing every output for each window to work_folder
+
+    Returns:
+        dict of output filename -> list of (window, halo window, filename)
+    """
+    func, args, kwargs = stageCall(stage)
+    grid_fn = stage.inputs[0]
+    gridDS = gdal.Open(grid_fn)
+    width, height = gridDS.RasterXSize, gridDS.RasterYSize
+    pieces = {data_fn: [] for data_fn in stage.outputs}
+    for i, window in enumerate(windows):
+        haloWin = haloWindow(window, halo, width, height)
+        piece_folder = os.path.join(work_folder, stage.name, str(i))
+        os.makedirs(piece_folder)
+        paths = {grid_fn:os.path.join(piece_folder, 'in.tif')}
+        cutTile(grid_fn, paths[grid_fn], haloWin)
+        for data_fn in stage.outputs:
+            name = os.path.basename(data_fn)
+            if name.lower().endswith('.sdat'):
+                name = os.path.splitext(name)[0] + '.tif'
+            paths[data_fn] = os.path.join(piece_folder, name)
+            pieces[data_fn].append((window, haloWin, paths[data_fn]))
+
+        pieceKwargs = replacePaths(kwargs, paths)
+        if 'rasterFormat' in kwargs:
+            pieceKwargs['rasterFormat'] = 'GTiff'
+        func(*replacePaths(args, paths), **pieceKwargs)
+    return pieces
+
+
+def unshareDataset(data_fn):
+    """
+    Gives a dataset's files their own copies before it's edited in place
+    (restored outputs are hard links into the stage cache)
+    """
+    for fn in companionFiles(data_fn):
+        shutil.copy2(fn, fn + '.copy')
+        os.replace(fn + '.copy', fn)
+
+
+def boundaryLinks(lines, groups, bounds, tolerance):
+    """
+    Pairs up the ends of lines that meet on the boundary of a region (e.g.
+    a feature cut back to outside the region and the patch line continuing
+    it inside), for joinLinkedLines; only lines of the same group are joined
+
+    Args:
+        lines, list of lines, each a list of (x, y) points
+        groups, list of each line's group (e.g. its attribute values)
+        bounds, (xmin, ymin, xmax, ymax) of the region
+        tolerance, distance within which two ends are the same point
+    Returns:
+        dict of (line index, end) -> (line index, end), both ways
+    """
+    xmin, ymin, xmax, ymax = bounds
+    ends = {}
+    for i, line in enumerate(lines):
+        for end in (0, -1):
+            x, y = line[end]
+            if (min(abs(x - xmin), abs(x - xmax)) <= tolerance
+                and ymin - tolerance <= y <= ymax + tolerance) \
+                or (min(abs(y - ymin), abs(y - ymax)) <= tolerance
+                and xmin - tolerance <= x <= xmax + tolerance):
+                ends.setdefault(groups[i], []).append((x, y, i, end))
+
+    links = {}
+    for groupEnds in ends.values():
+        for k, (x, y, i, end) in enumerate(groupEnds):
+            if (i, end) in links:
+                continue
+            for otherX, otherY, j, otherEnd in groupEnds[k + 1:]:
+                if (j, otherEnd) not in links and abs(otherX - x) <= tolerance \
+                    and abs(otherY - y) <= tolerance:
+                    links[i, end] = (j, otherEnd)
+                    links[j, otherEnd] = (i, end)
+                    break
+    return links
+
+
+def editLayer(vector_fn):
+    """
+    Opens the first layer of a dataset for editing in place (in a
+    transaction, where the format supports them)
+
+    Returns:
+        (dataset, layer, whether a transaction was started)
+    """
+    unshareDataset(vector_fn)
+    ds = ogr.Open(vector_fn, 1)
+    transactions = bool(ds.TestCapability(ogr.ODsCTransactions))
+    if transactions:
+        ds.StartTransaction()
+    return ds, ds.GetLayer(0), transactions
+
+
+def finishEdits(ds, layer, transactions):
+    """
+    Commits the edits of editLayer (packing a shapefile's deleted records
+    and rebuilding its spatial index)
+    """
+    if transactions:
+        ds.CommitTransaction()
+    if ds.GetDriver().GetName() == 'ESRI Shapefile':
+        ds.ExecuteSQL('REPACK ' + layer.GetName())
+        buildSpatialIndex(ds, layer)
+
+
+def replaceFeatures(vector_fn, patch_fn, bounds, tolerance):
+    """
+    Replaces the line features of a layer inside a region with those of a
+    patch layer: features crossing the region are cut back to their parts
+    outside it, and the patch features are clipped to it. Pieces with the
+    same attributes that meet on the region's boundary are joined back into
+    one line, so patching doesn't break features up at the region's edges.
+    A renumbered ID field (if any) keeps IDs unique.
+
+    Args:
+        vector_fn, layer to update
+        patch_fn, layer holding the new features
+        bounds, (xmin, ymin, xmax, ymax) of the region
+        tolerance, distance within which two ends are the same point
+    Returns:
+        None
+    """
+    ds, layer, transactions = editLayer(vector_fn)
+    defn = layer.GetLayerDefn()
+    fieldCount = defn.GetFieldCount()
+    fieldNames = [defn.GetFieldDefn(i).GetName() for i in range(fieldCount)]
+    idField = fieldNames.index('ID') if 'ID' in fieldNames else None
+
+    nextId = 1
+    if idField is not None:
+        for feature in layer:
+            nextId = max(nextId, (feature.GetField(idField) or 0) + 1)
+        layer.ResetReading()
+
+    # the parts of the features crossing the region that lie outside it
+    # (keeping their features' IDs), and the patch's parts inside it
+    region = boundsPolygon(bounds)
+    lines, values, ids = [], [], []
+    layer.SetSpatialFilter(region)
+    crossing = [(feature.GetFID(), feature.GetGeometryRef().Difference(region),
+        [feature.GetField(i) for i in range(fieldCount)]) for feature in layer]
+    layer.SetSpatialFilter(None)
+    for fid, outside, featureValues in crossing:
+        layer.DeleteFeature(fid)
+        for line in lineParts(outside):
+            lines.append([point[:2] for point in line.GetPoints()])
+            values.append(featureValues)
+            ids.append(featureValues[idField] if idField is not None else None)
+    patchDS = ogr.Open(patch_fn)
+    for feature in patchDS.GetLayer(0):
+        featureValues = [feature.GetField(i) for i in range(fieldCount)]
+        for line in lineParts(feature.GetGeometryRef().Intersection(region)):
+            lines.append([point[:2] for point in line.GetPoints()])
+            values.append(featureValues)
+            ids.append(None)
+    patchDS = None
+
+    groups = [tuple(value for i, value in enumerate(featureValues) if i != idField)
+        for featureValues in values]
+    usedIds = set()
+    for points, members in joinLinkedLines(lines,
+        boundaryLinks(lines, groups, bounds, tolerance)):
+        feature = ogr.Feature(defn)
+        for i, value in enumerate(values[members[0]]):
+            if value is not None:
+                feature.SetField(i, value)
+        if idField is not None:
+            # a joined line keeps the ID of the first feature it continues
+            keptIds = [ids[i] for i in members
+                if ids[i] is not None and ids[i] not in usedIds]
+            if keptIds:
+                newId = keptIds[0]
+            else:
+                newId, nextId = nextId, nextId + 1
+            usedIds.add(newId)
+            feature.SetField(idField, newId)
+        line = ogr.Geometry(ogr.wkbLineString)
+        for x, y in points:
+            line.AddPoint_2D(x, y)
+        feature.SetGeometry(line)
+        layer.CreateFeature(feature)
+
+    finishEdits(ds, layer, transactions)
+    layer = ds = None
+
+
+def regionFeatures(vector_fn, region):
+    """
+    Gets the features of a layer that meet a region
+
+    Returns:
+        list of (FID, geometry, field values)
+    """
+    ds = ogr.Open(vector_fn)
+    layer = ds.GetLayer(0)
+    fieldCount = layer.GetLayerDefn().GetFieldCount()
+    layer.SetSpatialFilter(region)
+    features = [(feature.GetFID(), feature.GetGeometryRef().Clone(),
+        [feature.GetField(i) for i in range(fieldCount)]) for feature in layer
+        if feature.GetGeometryRef().Intersects(region)]
+    layer = ds = None
+    return features
+
+
+def dissolvePolygons(geometries):
+    """
+    Dissolves (multi)polygons into one geometry (empty if there are none)
+    """
+    collection = ogr.Geometry(ogr.wkbMultiPolygon)
+    for geometry in geometries:
+        if ogr.GT_Flatten(geometry.GetGeometryType()) == ogr.wkbMultiPolygon:
+            for i in range(geometry.GetGeometryCount()):
+                collection.AddGeometry(geometry.GetGeometryRef(i))
+        else:
+            collection.AddGeometry(geometry)
+    if collection.GetGeometryCount() == 0:
+        return collection
+    return collection.UnionCascaded()
+
+
+def geometryWindow(geometry, grid, cellSize):
+    """
+    Gets the window of grid cells that a geometry's envelope overlaps
+    """
+    xmin, xmax, ymin, ymax = geometry.GetEnvelope()
+    return boundsWindow((xmin, ymin, xmax, ymax), grid, cellSize)
+
+
+def boundingWindow(windows):
+    """
+    Gets the window that bounds several windows
+    """
+    col0 = min(window[0] for window in windows)
+    row0 = min(window[1] for window in windows)
+    col1 = max(window[0] + window[2] for window in windows)
+    row1 = max(window[1] + window[3] for window in windows)
+    return col0, row0, col1 - col0, row1 - row0
+
+
+def replacePolygons(vector_fn, old, new, fieldName):
+    """
+    Replaces polygon features of a layer with new ones, and updates the
+    summary of its class field saved beside it (see readVectorSummary)
+
+    Args:
+        vector_fn, layer to update
+        old, list of (FID, geometry, field values) of the features to remove
+        new, list of (FID, geometry, field values) of the features to add
+            (read from a layer with the same fields)
+        fieldName, name of the class field
+    Returns:
+        None
+    """
+    ds, layer, transactions = editLayer(vector_fn)
+    defn = layer.GetLayerDefn()
+    classField = defn.GetFieldIndex(fieldName)
+    for fid, _, _ in old:
+        layer.DeleteFeature(fid)
+    for _, geometry, values in new:
+        feature = ogr.Feature(defn)
+        for i, value in enumerate(values):
+            if value is not None:
+                feature.SetField(i, value)
+        feature.SetGeometry(geometry)
+        layer.CreateFeature(feature)
+    finishEdits(ds, layer, transactions)
+    layer = ds = None
+
+    summary = readVectorSummary(vector_fn)
+    if summary is None or fieldName not in summary['fields']:
+        return
+    counts = summary['fields'][fieldName]['counts']
+    for features, change in ((old, -1), (new, 1)):
+        for _, _, values in features:
+            if values[classField] is not None:
+                counts[values[classField]] = counts.get(values[classField], 0) + change
+    counts = {value:count for value, count in counts.items() if count > 0}
+    summary['fields'][fieldName] = {'minimum':min(counts, default=None),
+        'maximum':max(counts, default=None),
+        'total':sum(value * count for value, count in counts.items()),
+        'counts':counts}
+    summary['featureCount'] += len(new) - len(old)
+    saveVectorSummary(vector_fn, summary)
+
+
+def patchPolygons(stage, window, grid, cellSize, work_folder):
+    """
+    Re-extracts the polygons of a vectorized classes layer around a window
+    of its classes raster: the polygons meeting the window (grown by the
+    reach of the boundary simplification) are replaced, whole, by those
+    vectorized with the same settings from a cut of the raster around them.
+    A polygon can depend on more than the cells around it (the sieve merges
+    small regions into their largest neighbor, wherever it lies), so the
+    area is grown until the new polygons cover exactly the area of the old
+    ones and none of them is cut short by the edge of the cut.
+
+    Args:
+        stage, the vectorizing stage
+        window, (col0, row0, cols, rows) window of the grid that changed
+        grid, (xmin, ymax, width, height) of the output grid
+        cellSize, cell size of the grid
+        work_folder, folder for the cuts and their polygons
+    Returns:
+        True if patched, False if the area outgrew maxPatchFraction of the
+        grid or maxPolygonRounds rounds (the layer should be rebuilt)
+    """
+    func, args, kwargs = stageCall(stage)
+    classes_fn, vector_fn = stage.inputs[0], stage.outputs[0]
+    width, height = grid[2], grid[3]
+    reach = int(np.ceil(kwargs.get('simplifyTolerance', 0) / cellSize)) + 2
+    margin = reach + int(np.ceil(sieveReach * np.sqrt(kwargs.get('minArea', 0)) / cellSize))
+
+    area = haloWindow(window, reach, width, height)
+    for i in range(maxPolygonRounds):
+        region = boundsPolygon(windowBounds(area, grid, cellSize))
+        old = regionFeatures(vector_fn, region)
+        oldArea = dissolvePolygons([geometry for _, geometry, _ in old])
+        cut = area
+        if old:
+            cut = boundingWindow([area, geometryWindow(oldArea, grid, cellSize)])
+        cut = haloWindow(cut, margin, width, height)
+        if cut[2] * cut[3] > maxPatchFraction * width * height:
+            return False
+
+        round_folder = os.path.join(work_folder, str(i))
+        os.makedirs(round_folder)
+        paths = {classes_fn:os.path.join(round_folder, 'in.tif'),
+            vector_fn:os.path.join(round_folder, os.path.basename(vector_fn))}
+        cutTile(classes_fn, paths[classes_fn], cut)
+        func(*replacePaths(args, paths), **replacePaths(kwargs, paths))
+        new = regionFeatures(paths[vector_fn], region)
+
+        # grow the area over where the new polygons differ from the old ones,
+        # and over the new polygons that reach the edge of the cut (unless
+        # it's the edge of the grid)
+        grown = []
+        difference = oldArea.SymDifference(dissolvePolygons(
+            [geometry for _, geometry, _ in new]))
+        if not difference.IsEmpty() and difference.GetArea() > 1e-6 * cellSize ** 2:
+            grown.append(geometryWindow(difference, grid, cellSize))
+        xmin, ymin, xmax, ymax = windowBounds(cut, grid, cellSize)
+        edge = cellSize / 2
+        for _, geometry, _ in new:
+            minX, maxX, minY, maxY = geometry.GetEnvelope()
+            if (cut[0] > 0 and minX < xmin + edge) \
+                or (cut[1] > 0 and maxY > ymax - edge) \
+                or (cut[0] + cut[2] < width and maxX > xmax - edge) \
+                or (cut[1] + cut[3] < height and minY < ymin + edge):
+                grown.append(geometryWindow(geometry, grid, cellSize))
+        if not grown:
+            replacePolygons(vector_fn, old, new, kwargs.get('fieldName', 'class'))
+            return True
+        area = boundingWindow([area] + grown)
+    return False
+
+
+def patchRasters(stage, pieces, resampling):
+    """
+    Patches the recomputed windows of a stage's raster outputs into them
+    (in the format given by the stage's rasterFormat argument)
+    """
+    rasterFormat = stageCall(stage)[2].get('rasterFormat', defaultRasterFormat)
+    for data_fn, outputPieces in pieces.items():
+        # the grid goes in an in-memory dataset, so no handle on the output
+        # is left open when it's replaced
+        srcDS = gdal.Open(data_fn)
+        gridDS = gdal.GetDriverByName('MEM').Create('', srcDS.RasterXSize,
+            srcDS.RasterYSize, 0, gdal.GDT_Byte)
+        gridDS.SetGeoTransform(srcDS.GetGeoTransform())
+        gridDS.SetProjection(srcDS.GetProjection())
+        srcDS = None
+        stitchTiles(outputPieces, data_fn, gridDS, rasterFormat,
+            resampling.get(data_fn, 'NEAREST'), base_fn=data_fn)
+
+
+# define function to update a job's outputs incrementally
+
+def updateIncrementally(config, paths, stages, DEM_tiles, cache=None):
+    """
+    Patches the outputs of the mosaic, derivative and contour stages for the
+    raw DEM tiles that changed since the last run, when the job's settings
+    and output grid are unchanged and its outputs exist
+
+    Args:
+        config, complete job config
+        paths, output filepaths (from jobPaths)
+        stages, the job's stages (from jobStages)
+        DEM_tiles, raw DEM tiles (from queryTileIndex)
+        cache, optional ArtifactCache; the patched stages' outputs are stored
+            under their new keys
+    Returns:
+        (names of the patched stages, which the caller should skip,
+        manifest to save once the run completes)
+    """
+    manifest_fn = os.path.join(config['analysis_folder'], manifestName)
+    previous = readManifest(manifest_fn)
+    entries = tileEntries(DEM_tiles, previous['tiles'] if previous else {})
+
+    cellSize = config['desired_grain']
+    AOI = config['AOI']
+    grid = mosaicGrid(DEM_tiles, cellSize,
+        aoiExtent(AOI) if AOI is not None else None)
+    manifest = (manifest_fn, config, entries, grid)
+
+    byName = {stage.name: stage for stage in neededStages(stages)}
+    mosaicStage = byName.get('mosaicResample')
+    if previous is None or mosaicStage is None \
+        or previous['settings'] != outputSettings(config) \
+        or previous['grid'] != list(grid):
+        return set(), manifest
+
+    # the raw tiles must line up with the output cells (whole-number ratio)
+    ratio = cellSize / config['DEM_grain']
+    if abs(ratio - round(ratio)) > 1e-9:
+        return set(), manifest
+
+    windows = [boundsWindow(bounds, grid, cellSize)
+        for bounds in changedBounds(previous['tiles'], entries)]
+    windows = mergeWindows(window for window in windows if window is not None)
+    if not windows:
+        return set(), manifest # nothing changed (the cache covers this)
+
+    # windows of cells that can change: the mosaic's, then one cell more for
+    # anything computed from a cell's neighborhood
+    mosaicWindows = growWindows(windows, mosaicHalo, grid)
+    neighborWindows = growWindows(mosaicWindows, neighborhoodHalo, grid)
+    if sum(w[2] * w[3] for w in neighborWindows) > maxPatchFraction * grid[2] * grid[3]:
+        return set(), manifest
+
+    # (the vector layers are edited in place, which FlatGeobuf files can't
+    # be; and the vectorized classes are patched from patched classes)
+    patching = {name: byName[name] for name in ('terrainDerivatives', 'contours',
+        'vectorSlope', 'vectorAspect') if name in byName}
+    for name in ('contours', 'vectorSlope', 'vectorAspect'):
+        if name in patching and any(fn.lower().endswith('.fgb')
+            for fn in patching[name].outputs):
+            del patching[name]
+    if 'terrainDerivatives' not in patching:
+        patching.pop('vectorSlope', None)
+        patching.pop('vectorAspect', None)
+    patchStages = [mosaicStage] + list(patching.values())
+    for stage in patchStages:
+        if not all(os.path.exists(data_fn) for data_fn in stage.outputs):
+            return set(), manifest
+
+    work_folder = os.path.join(config['analysis_folder'], 'incremental')
+    shutil.rmtree(work_folder, ignore_errors=True)
+    try:
+        # mosaic: rerun on the windows' extents (grown by the kernel's reach,
+        # so every cell kept sees the same tiles and kernel as a full run)
+        rmDEM_fn = paths['rmDEM']
+        pieces = {rmDEM_fn: []}
+        for i, window in enumerate(mosaicWindows):
+            haloWin = haloWindow(window, mosaicHalo, grid[2], grid[3])
+            bounds = windowBounds(haloWin, grid, cellSize)
+            inset = cellSize / 4 # snaps outward to exactly the halo window
+            piece_fn = os.path.join(work_folder, 'mosaic', str(i) + '.tif')
+            os.makedirs(os.path.dirname(piece_fn))
+            kwargs = dict(mosaicStage.kwargs, rasterFormat='GTiff',
+                extent=(bounds[0] + inset, bounds[1] + inset,
+                    bounds[2] - inset, bounds[3] - inset))
+            mosaicStage.func(mosaicStage.args[0], piece_fn,
+                *mosaicStage.args[2:], **kwargs)
+            pieces[rmDEM_fn].append((window, haloWin, piece_fn))
+        patchRasters(mosaicStage, pieces, {rmDEM_fn:'AVERAGE'})
+
+        # hillshade, slope, aspect, and classes
+        patched = {'mosaicResample'}
+        if 'terrainDerivatives' in patching:
+            stage = patching['terrainDerivatives']
+            resampling = {paths['slope']:'AVERAGE', paths['hillshade']:'AVERAGE'}
+            resampling.update((fn, 'AVERAGE') for fn in paths['hillshadeVariants'])
+            pieces = runWindows(stage, neighborWindows, neighborhoodHalo,
+                work_folder)
+            patchRasters(stage, pieces, resampling)
+            patched.add(stage.name)
+
+        # contours: replace the features inside the windows (joined to the
+        # parts outside them where they meet; see extractContourSweep)
+        if 'contours' in patching:
+            stage = patching['contours']
+            pieces = runWindows(stage, neighborWindows, neighborhoodHalo,
+                work_folder)
+            for contour_fn, contourPieces in pieces.items():
+                for window, haloWin, piece_fn in contourPieces:
+                    replaceFeatures(contour_fn, piece_fn,
+                        windowBounds(window, grid, cellSize), 1e-3 * cellSize)
+            patched.add(stage.name)
+
+        # vectorized classes: re-extract the polygons around the windows (or,
+        # if that reaches too far, leave the stage to rebuild the layer)
+        for name in ('vectorSlope', 'vectorAspect'):
+            if name in patching and all(patchPolygons(patching[name], window,
+                grid, cellSize, os.path.join(work_folder, name, str(i)))
+                for i, window in enumerate(neighborWindows)):
+                patched.add(name)
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    if cache is not None:
+        for stage in patchStages:
+            if stage.name not in patched:
+                continue
+            cache.store(cache.stageKey(stage.name, stage.inputs, stage.outputs,
+                [stage.args, stage.kwargs]), stage.name, stage.outputs)
+    return patched, manifest
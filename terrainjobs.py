@@ -0,0 +1,534 @@
+"""
+Headless entry point for the terrain analysis pipeline.
+
+runTerrainAnalysis runs the whole pipeline (mosaic/resample, hillshade,
+slope, aspect, contours, vectorized classes, fill, drainage and channels)
+for one job described by a config dict, with no QGIS or iface needed; map
+display is left to the caller (terrainanalysis.py passes its display
+functions as per-stage callbacks). runJobs runs a list of jobs, e.g. one
+per project area, on one shared pool of worker processes, so the workers
+(and the NumPy/GDAL imports they've already paid for) stay warm from one
+job to the next. A job can also clip its DEM and derivatives from a shared
+run over a larger area instead of computing them (shared_folder; see
+terrainbatch.py, which runs many overlapping project areas that way).
+
+Command line:
+    python terrainjobs.py jobs.json [more_jobs.json ...] [--workers N]
+
+where each file holds one job config or a list of them (see defaultConfig;
+keys left out keep their defaults).
+"""
+import argparse
+import json
+import os
+import sys
+
+from terrainengine import aoiExtent, compassClassTable, \
+    computeTerrainDerivatives, extractContourSweep, feetPerMeter, \
+    mosaicGrid, mosaicResample, packageVectors, queryTileIndex, \
+    slopeClassTable, updateTileIndex
+from terrainhydrology import computeDrainage, extractChannelSweep, \
+    fillSinks, maxInMemoryFillCells
+from terrainincremental import saveManifest, updateIncrementally
+from terrainpolygons import polygonizeClasses
+from terrainpipeline import ArtifactCache, RunReport, Stage, \
+    createWorkerPool, measureCall, runStageGraph
+from terraintiles import clipRasters, tiledStage
+
+# job settings and their defaults (the same settings, with the same names,
+# as the variables at the top of terrainanalysis.py)
+defaultConfig = {
+    'data_folder':None, # folder holding DTM-RAW and Script-Outputs
+    'DEM_folder':None, # raw DEM folder (default: data_folder/DTM-RAW)
+    'analysis_folder':None, # outputs folder (default: data_folder/Script-Outputs)
+    'produce_hillshade':1, # 1 = produce; 0 = do not produce
+    'produce_baseContours':1,
+    'produce_indexContours':1,
+    'produce_rasterSlope':1,
+    'produce_vectorSlope':1,
+    'produce_rasterAspect':1,
+    'produce_vectorAspect':1,
+    'produce_channels':1,
+    'DEM_grain':1, # grain (meters) of the raw DEMs
+    'desired_grain':2, # grain (meters) to resample the DEMs to
+    'baseContourInt':2, # base contour interval (feet)
+    'indexContourInt':10, # index contour interval (feet)
+    'channel_threshold':5, # min. Strahler order of the channel network
+    'slope_classBounds':[5, 10, 15, 20, 30], # slope class upper bounds (percent)
+    'mosaic_memoryMB':512, # memory ceiling for mosaicking and resampling
+    'AOI':None, # area of interest: bounding box or polygon WKT
+    'use_cache':1, # reuse outputs of unchanged stages
+    'cache_sizeLimitGB':20, # size limit of the stage output cache
+    'worker_count':0, # worker processes (0 = one per CPU core)
+    'channel_thresholdSweep':[], # extra channel thresholds
+    'contour_intervalSweep':[], # extra contour intervals (feet)
+    'vector_minArea':100, # minimum polygon area (square meters, 0 = keep all)
+    'vector_simplifyTolerance':2, # boundary simplification (meters, 0 = none)
+    'raster_format':'COG', # 'COG', 'GTiff' or 'SAGA'
+    'intermediate_format':None, # format of the intermediates (None = raster_format)
+    'hillshade_variants':[], # extra hillshades (see computeTerrainDerivatives)
+    'fill_tileSize':0, # tile size for filling sinks (0 = in memory if it fits)
+    'tile_size':0, # tile size for tiled stages (0 = run untiled)
+    'tile_workers':0, # local worker processes for tiles (0 = one per CPU core)
+    'tile_queueFolder':None, # shared job queue folder (default: outputs/queue)
+    'incremental':1, # patch only the areas of changed DEM tiles into the outputs
+    'vector_format':'GPKG', # 'GPKG', 'FlatGeobuf' or 'ESRI Shapefile'
+    'vector_package':0, # also combine the vector outputs in terrainVectors.gpkg
+    'run_report':1, # save per-stage time, memory and I/O (runreport.json/runhistory.csv)
+    'profile_stages':[], # stages to run under cProfile (saved to outputs/profiles)
+    'shared_folder':None, # outputs folder of a larger shared run to clip the
+        # DEM and derivatives from (see terrainbatch.py), instead of computing them
+}
+
+# file extensions of the vector formats
+vectorExtensions = {'GPKG':'.gpkg', 'FlatGeobuf':'.fgb', 'ESRI Shapefile':'.shp'}
+
+# stages that can run tiled (local raster operators) and the halo (cells of
+# overlap) each needs around a tile
+tileHalos = {'terrainDerivatives':1}
+
+
+# define functions to resolve a job's settings and output paths
+
+def jobConfig(config):
+    """
+    Fills in a job config's missing settings with their defaults
+
+    Args:
+        config, dict of settings (see defaultConfig)
+    Returns:
+        complete config dict
+    """
+    unknown = set(config) - set(defaultConfig)
+    if unknown:
+        raise ValueError('unknown settings: ' + ', '.join(sorted(unknown)))
+    config = dict(defaultConfig, **config)
+    if config['vector_format'] not in vectorExtensions:
+        raise ValueError('vector_format must be one of: '
+            + ', '.join(sorted(vectorExtensions)))
+    if config['shared_folder'] is not None and config['AOI'] is None:
+        raise ValueError('an AOI is required to clip from shared_folder')
+    if config['produce_baseContours'] == 1 and config['produce_indexContours'] == 1 \
+        and config['baseContourInt'] == config['indexContourInt']:
+        # (both would be written to, and displayed from, the same file)
+        raise ValueError('baseContourInt and indexContourInt must differ')
+
+    if config['DEM_folder'] is None or config['analysis_folder'] is None:
+        if config['data_folder'] is None:
+            raise ValueError('data_folder (or DEM_folder and analysis_folder) '
+                'is required')
+    if config['DEM_folder'] is None:
+        config['DEM_folder'] = os.path.join(config['data_folder'], 'DTM-RAW')
+    if config['analysis_folder'] is None:
+        config['analysis_folder'] = os.path.join(config['data_folder'],
+            'Script-Outputs')
+    return config
+
+
+def jobPaths(config):
+    """
+    Works out the filepath of every output of a job
+
+    Args:
+        config, complete config dict (from jobConfig)
+    Returns:
+        dict of output name -> filepath (contours and channels are dicts of
+        interval/threshold -> filepath, hillshadeVariants a list)
+    """
+    folder = config['analysis_folder']
+    grain = str(config['desired_grain'])
+    raster_ext = '.sdat' if config['raster_format'] == 'SAGA' else '.tif'
+
+    # rasters that mostly feed later stages (classes, filled DEM, drainage)
+    # can be written as SAGA grids, which those stages memory-map
+    intermediateFormat = config['intermediate_format'] or config['raster_format']
+    inter_ext = '.sdat' if intermediateFormat == 'SAGA' else '.tif'
+    vector_ext = vectorExtensions[config['vector_format']]
+
+    paths = {'tileIndex':os.path.join(folder, 'tileindex.json'),
+        'rmDEM':os.path.join(folder, 'dtm_Vm_' + grain + 'm' + raster_ext),
+        'hillshade':os.path.join(folder, 'hillshade_' + grain + 'm' + raster_ext),
+        'slope':os.path.join(folder, 'slope' + raster_ext),
+        'classedSlope':os.path.join(folder, 'classedSlope' + inter_ext),
+        'vectorSlope':os.path.join(folder, 'vectorSlope' + vector_ext),
+        'aspect':os.path.join(folder, 'aspect' + raster_ext),
+        'classedAspect':os.path.join(folder, 'classedAspect' + inter_ext),
+        'vectorAspect':os.path.join(folder, 'vectorAspect' + vector_ext),
+        'baseContours':os.path.join(folder, str(config['baseContourInt']) + 'ft' + vector_ext),
+        'indexContours':os.path.join(folder, str(config['indexContourInt']) + 'ft' + vector_ext),
+        'filledDEM':os.path.join(folder, 'filledDEM' + inter_ext),
+        'flowDirection':os.path.join(folder, 'flowDirection' + inter_ext),
+        'strahlerOrder':os.path.join(folder, 'strahlerOrder' + inter_ext),
+        'channels':os.path.join(folder, 'vectorChannels' + vector_ext),
+        'vectorPackage':os.path.join(folder, 'terrainVectors.gpkg'),
+        'cache':os.path.join(folder, 'cache'),
+        'runReport':os.path.join(folder, 'runreport.json'),
+        'runHistory':os.path.join(folder, 'runhistory.csv'),
+        'profiles':os.path.join(folder, 'profiles')}
+
+    # extra hillshades, named for their settings (e.g. hillshade_1m_az270_alt30)
+    paths['hillshadeVariants'] = []
+    for variant in config['hillshade_variants']:
+        settings = [('multi' if variant.get('multidirectional') else
+                'az' + str(variant.get('azimuth', 315))),
+            'alt' + str(variant.get('altitude', 45))]
+        if variant.get('zFactor', 1) != 1:
+            settings.append('z' + str(variant['zFactor']))
+        paths['hillshadeVariants'].append(os.path.join(folder, 'hillshade_'
+            + grain + 'm_' + '_'.join(settings) + raster_ext))
+
+    # contour intervals to extract and the filepath to save each set of contours
+    # (base, index, and any extra intervals)
+    paths['contours'] = {}
+    if config['produce_baseContours'] == 1:
+        paths['contours'][config['baseContourInt']] = paths['baseContours']
+    if config['produce_indexContours'] == 1:
+        paths['contours'][config['indexContourInt']] = paths['indexContours']
+    for contourInt in config['contour_intervalSweep']:
+        paths['contours'].setdefault(contourInt,
+            os.path.join(folder, str(contourInt) + 'ft' + vector_ext))
+
+    # channel thresholds to extract and the filepath to save each network
+    # (the default threshold's, and any extra thresholds)
+    paths['channelNetworks'] = {}
+    if config['produce_channels'] == 1:
+        paths['channelNetworks'][config['channel_threshold']] = paths['channels']
+    for threshold in config['channel_thresholdSweep']:
+        paths['channelNetworks'].setdefault(threshold,
+            os.path.join(folder, 'vectorChannels_' + str(threshold) + vector_ext))
+    return paths
+
+
+# define function to declare a job's pipeline stages
+
+def jobStages(config, paths, DEM_tiles):
+    """
+    Declares the pipeline stages of a job
+
+    Args:
+        config, complete config dict (from jobConfig)
+        paths, output filepaths (from jobPaths); paths['rmDEM'] is replaced
+            by the raw DEM itself when no mosaicking or resampling is needed
+        DEM_tiles, raw DEM tiles to use (from queryTileIndex)
+    Returns:
+        list of Stage
+    """
+    DEM_fns = [tile['fn'] for tile in DEM_tiles]
+    AOI = config['AOI']
+    stages = []
+
+    # overview resampling of the continuous rasters (the rest use NEAREST)
+    resampling = {paths['rmDEM']:'AVERAGE', paths['slope']:'AVERAGE',
+        paths['hillshade']:'AVERAGE'}
+    resampling.update((fn, 'AVERAGE') for fn in paths['hillshadeVariants'])
+
+    # with a shared run over a larger area, the DEM and derivatives are clipped
+    # from its outputs (same names, in the shared folder) instead
+    shared_folder = config['shared_folder']
+    if shared_folder is not None:
+        sharedPath = lambda data_fn: os.path.join(shared_folder,
+            os.path.basename(data_fn))
+
+    # mosaic and resample DEMs, if necessary--done in one streaming pass over
+    # windows of the output grid, so no full-size intermediate mosaic is written
+
+    if shared_folder is not None:
+        stages.append(Stage('clipDEM', clipRasters,
+            args = ([sharedPath(paths['rmDEM'])], # shared DEM
+                [paths['rmDEM']], # where to save output
+                aoiExtent(AOI)), # extent to clip to
+            kwargs = {'rasterFormat':config['raster_format'], # output format
+                'resampling':resampling}, # overview resampling
+            inputs = [sharedPath(paths['rmDEM'])], outputs = [paths['rmDEM']]))
+
+    elif len(DEM_fns) != 1 or config['DEM_grain'] != config['desired_grain'] \
+        or AOI is not None:
+
+        stages.append(Stage('mosaicResample', mosaicResample,
+            args = (DEM_tiles, # input grids (from the tile index)
+                paths['rmDEM'], # where to save output
+                config['desired_grain']), # new grain size
+            kwargs = {'mosaicGrain':config['DEM_grain'], # raw DEM grain size
+                'overlap':'mean', # overlapping areas: mean
+                'blendDist':8, # blend distance: 8m (used only for overlap = 'blend')
+                'resampling':'bspline', # B-spline interpolation
+                'maxMemoryMB':config['mosaic_memoryMB'], # memory ceiling
+                'extent':aoiExtent(AOI) if AOI is not None else None, # output extent
+                'rasterFormat':config['raster_format']}, # output format
+            inputs = DEM_fns, outputs = [paths['rmDEM']]))
+
+    else:
+        # if we have only 1 DEM at the desired grain, leave as is and use it in
+        # place of the mosaicked and resampled one
+        paths['rmDEM'] = DEM_fns[0]
+
+    rmDEM_fn = paths['rmDEM']
+
+    # compute hillshade (and any extra hillshades), slope, aspect, and classified
+    # slope and aspect in one pass over the DEM
+
+    products = [('slope', 'produce_rasterSlope'), ('aspect', 'produce_rasterAspect'),
+        ('hillshade', 'produce_hillshade'), ('classedSlope', 'produce_vectorSlope'),
+        ('classedAspect', 'produce_vectorAspect')]
+    wanted = {name: paths[name] if config[produce] == 1 else None
+        for name, produce in products}
+    derivatives_fns = [fn for fn in wanted.values() if fn is not None]
+    derivatives_fns += paths['hillshadeVariants']
+
+    slopeBounds = list(config['slope_classBounds'])
+    if slopeBounds[-1] != float('inf'):
+        slopeBounds.append(float('inf'))
+
+    if shared_folder is not None:
+        shared_fns = [sharedPath(fn) for fn in derivatives_fns]
+        stages.append(Stage('clipDerivatives', clipRasters,
+            args = (shared_fns, # shared derivatives
+                derivatives_fns, # where to save each output
+                aoiExtent(AOI)), # extent to clip to
+            kwargs = {'rasterFormat':config['raster_format'], # output format
+                'resampling':resampling}, # overview resampling
+            inputs = shared_fns, outputs = derivatives_fns,
+            enabled = len(derivatives_fns) > 0))
+
+    else:
+        stages.append(Stage('terrainDerivatives', computeTerrainDerivatives,
+            args = (rmDEM_fn,), # input DEM
+            kwargs = {'slopeOut':wanted['slope'], # slope as percent
+                'aspectOut':wanted['aspect'], # aspect (degrees from north)
+                'hillshadeOut':wanted['hillshade'], # hillshade
+                'slopeClassOut':wanted['classedSlope'], # classified slope
+                'aspectClassOut':wanted['classedAspect'], # classified aspect
+                'slopeClasses':slopeClassTable(slopeBounds), # slope class upper bounds
+                'aspectClasses':compassClassTable(8), # N, NE, E, SE, S, SW, W, NW
+                'azimuth':315, # azimuth of the light
+                'altitude':45, # altitude of the light
+                'zFactor':1, # Z factor (vertical exaggeration)
+                'multidirectional':False, # shade with lights from several directions
+                'hillshades':[dict(variant, out=fn) for variant, fn in
+                    zip(config['hillshade_variants'], paths['hillshadeVariants'])],
+                'rasterFormat':config['raster_format']}, # output format
+            inputs = [rmDEM_fn], outputs = derivatives_fns,
+            enabled = len(derivatives_fns) > 0))
+
+    # extract base and index contours (and any extra intervals) in one
+    # contouring pass--the intervals are in feet, so the contour levels are
+    # converted to the DEM's meters
+
+    contour_fns = paths['contours']
+    stages.append(Stage('contours', extractContourSweep,
+        args = (rmDEM_fn, # input DEM (meters)
+            list(contour_fns), # intervals between contours (feet)
+            list(contour_fns.values())), # where to save each set of contours
+        kwargs = {'offset':0, # offset from 0 relative to which to interpret intervals
+            'fieldName':'ELEV', # attribute name
+            'indexInterval':config['indexContourInt'], # flag index contours
+            'zScale':feetPerMeter}, # contour units (feet) per DEM unit (meter)
+        inputs = [rmDEM_fn], outputs = list(contour_fns.values()),
+        enabled = len(contour_fns) > 0))
+
+    # vectorize classed slope and aspect
+
+    vectorize_kwargs = {'minArea':config['vector_minArea'], # minimum mapping unit
+        'simplifyTolerance':config['vector_simplifyTolerance'], # simplification
+        'fieldName':'class'} # field to create
+
+    stages.append(Stage('vectorSlope', polygonizeClasses,
+        args = (paths['classedSlope'], paths['vectorSlope']),
+        kwargs = vectorize_kwargs,
+        inputs = [paths['classedSlope']], outputs = [paths['vectorSlope']],
+        enabled = config['produce_vectorSlope'] == 1))
+
+    stages.append(Stage('vectorAspect', polygonizeClasses,
+        args = (paths['classedAspect'], paths['vectorAspect']),
+        kwargs = vectorize_kwargs,
+        inputs = [paths['classedAspect']], outputs = [paths['vectorAspect']],
+        enabled = config['produce_vectorAspect'] == 1))
+
+    # fill sinks in DEM, then compute drainage and the channel network (vector)--
+    # the fill tiles DEMs too large for memory, but drainage is computed in
+    # memory, so a DEM that large is turned down here rather than running
+    # out of memory in a worker after the fill
+
+    channelsWanted = config['produce_channels'] == 1 \
+        or len(config['channel_thresholdSweep']) > 0
+    if channelsWanted and DEM_tiles:
+        width, height = mosaicGrid(DEM_tiles, config['desired_grain'],
+            aoiExtent(AOI) if AOI is not None else None)[2:]
+        if width * height > maxInMemoryFillCells:
+            raise ValueError('the DEM (%d x %d cells) is too large to compute '
+                'drainage in memory (at most %d cells); use a smaller AOI or a '
+                'coarser desired_grain, or turn off channels' % (width, height,
+                maxInMemoryFillCells))
+
+    stages.append(Stage('fillSinks', fillSinks,
+        args = (rmDEM_fn, # input DEM
+            paths['filledDEM']), # where to save output
+        kwargs = {'minSlope':0.01, # minimum slope (degrees)
+            'tileSize':config['fill_tileSize'], # tile size (0 = in memory if it fits)
+            'rasterFormat':config['raster_format']}, # output format
+        inputs = [rmDEM_fn], outputs = [paths['filledDEM']],
+        enabled = False))
+
+    stages.append(Stage('drainage', computeDrainage,
+        args = (paths['filledDEM'],), # input (filled) DEM
+        kwargs = {'directionOut':paths['flowDirection'], # D8 flow direction
+            'orderOut':paths['strahlerOrder'], # Strahler order
+            'rasterFormat':config['raster_format']}, # output format
+        inputs = [paths['filledDEM']],
+        outputs = [paths['flowDirection'], paths['strahlerOrder']],
+        enabled = False))
+
+    channel_fns = paths['channelNetworks']
+    stages.append(Stage('channels', extractChannelSweep,
+        args = (paths['strahlerOrder'], # Strahler order
+            paths['flowDirection'], # flow direction
+            list(channel_fns), # thresholds (min. Strahler order)
+            list(channel_fns.values())), # where to save each channel network
+        inputs = [paths['strahlerOrder'], paths['flowDirection']],
+        outputs = list(channel_fns.values()),
+        enabled = channelsWanted))
+
+    # optionally, copy every vector output that's produced into one GeoPackage
+    # (one spatially indexed layer each), for quick loading in QGIS
+
+    vector_fns = [fn for stage in stages if stage.enabled and stage.name in
+        ('contours', 'vectorSlope', 'vectorAspect', 'channels') for fn in stage.outputs]
+    stages.append(Stage('vectorPackage', packageVectors,
+        args = (vector_fns, # layers to copy
+            paths['vectorPackage']), # where to save the package
+        inputs = vector_fns, outputs = [paths['vectorPackage']],
+        enabled = config['vector_package'] == 1 and len(vector_fns) > 0))
+
+    # optionally, run the local raster operators tiled on a job queue--the
+    # tiles' interiors are stitched seamlessly, and workers on other machines
+    # sharing the queue folder can help (see terraintiles.py)
+    if config['tile_size'] > 0:
+        queue_folder = config['tile_queueFolder'] or os.path.join(
+            config['analysis_folder'], 'queue')
+        stages = [tiledStage(stage, tileHalos[stage.name], config['tile_size'],
+                queue_folder, config['tile_workers'], resampling=resampling)
+            if stage.name in tileHalos else stage for stage in stages]
+
+    return stages
+
+
+# define functions to run jobs
+
+def runTerrainAnalysis(config, onComplete=None, pool=None, stageNames=None):
+    """
+    Runs the terrain analysis pipeline for one job, without QGIS
+
+    Args:
+        config, dict of settings (see defaultConfig; missing ones default)
+        onComplete, optional dict of stage name (e.g. 'terrainDerivatives',
+            'contours', 'channels') -> function called with the job's paths
+            once that stage's outputs exist, e.g. to display them
+        pool, optional worker pool (from createWorkerPool) to share across
+            jobs; by default each job starts and stops its own
+        stageNames, optional names of the only stages to run (e.g.
+            ['mosaicResample', 'terrainDerivatives'] for a shared run that
+            other jobs clip from; see terrainbatch.py)
+    Returns:
+        dict of output name -> filepath (as from jobPaths, with 'rmDEM' the
+        DEM the derivatives were computed from)
+    """
+    config = jobConfig(config)
+    paths = jobPaths(config)
+
+    # index the raw DEMs (only new or changed files are read) and keep only
+    # the ones that intersect the AOI
+    tileIndex = updateTileIndex(config['DEM_folder'], paths['tileIndex'])
+    DEM_tiles = queryTileIndex(tileIndex, config['DEM_folder'], config['AOI'])
+    if len(DEM_tiles) == 0:
+        raise ValueError('No DEMs in ' + config['DEM_folder']
+            + ' intersect the AOI')
+
+    stages = jobStages(config, paths, DEM_tiles)
+    if stageNames is not None:
+        stages = [stage for stage in stages if stage.name in stageNames]
+    for stage in stages:
+        if onComplete is not None and stage.name in onComplete:
+            stage.onComplete = lambda callback=onComplete[stage.name]: \
+                callback(paths)
+
+    cache = ArtifactCache(paths['cache'], config['cache_sizeLimitGB']) \
+        if config['use_cache'] == 1 else None
+    report = RunReport(config['profile_stages'], paths['profiles']) \
+        if config['run_report'] == 1 else None
+
+    # patch the areas of changed DEM tiles into the last run's outputs where
+    # possible; the patched stages are done (and the rest see changed inputs)
+    patched, manifest = set(), None
+    if config['incremental'] == 1:
+        (patched, manifest), metrics = measureCall(updateIncrementally,
+            (config, paths, stages, DEM_tiles, cache), {})
+        patchedStages = [stage for stage in stages if stage.name in patched]
+        if report is not None and patchedStages:
+            report.addStage('incrementalUpdate', True, metrics,
+                [tile['fn'] for tile in DEM_tiles],
+                [fn for stage in patchedStages for fn in stage.outputs])
+        for stage in patchedStages:
+            if stage.onComplete is not None:
+                stage.onComplete()
+        stages = [stage for stage in stages if stage.name not in patched]
+
+    # the report is saved even if a stage fails, to show how far it got
+    try:
+        runStageGraph(stages, config['worker_count'], cache, pool, report)
+    finally:
+        if report is not None:
+            report.save(paths['runReport'], paths['runHistory'])
+    if manifest is not None:
+        saveManifest(*manifest)
+    return paths
+
+
+def runJobs(configs, workers=None):
+    """
+    Runs a list of jobs one after another on one shared pool of worker
+    processes (each job's independent stages still run side by side)
+
+    Args:
+        configs, list of config dicts
+        workers, number of worker processes (None or 0 = one per CPU)
+    Returns:
+        list of each job's paths (as from runTerrainAnalysis)
+    """
+    pool = createWorkerPool(workers)
+    try:
+        return [runTerrainAnalysis(config, pool=pool) for config in configs]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def readJobs(job_fns):
+    """
+    Reads job configs from JSON files, each holding one config or a list
+    """
+    configs = []
+    for job_fn in job_fns:
+        with open(job_fn) as f:
+            jobs = json.load(f)
+        configs += jobs if isinstance(jobs, list) else [jobs]
+    return configs
+
+
+def main(argv=None):
+    """
+    Runs the jobs in the JSON files named on the command line
+    """
+    parser = argparse.ArgumentParser(description='Run terrain analysis jobs '
+        'without QGIS.')
+    parser.add_argument('jobs', nargs='+', help='JSON file(s) holding a job '
+        'config or a list of them')
+    parser.add_argument('--workers', type=int, default=0, help='worker '
+        'processes shared by the jobs (0 = one per CPU core)')
+    args = parser.parse_args(argv)
+
+    for paths in runJobs(readJobs(args.jobs), args.workers):
+        print('done:', os.path.dirname(paths['tileIndex']))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
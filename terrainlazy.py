@@ -0,0 +1,284 @@
+"""
+Lazy, on-demand terrain derivatives for interactive display.
+
+Instead of waiting for full-size hillshade, slope, and aspect rasters, a
+DerivativeTileSource computes them from the DEM for just the tiles the map
+view covers, at a resolution matched to the zoom level: each level is the
+DEM read at a power-of-two decimation (GDAL serves the reads from the DEM's
+overviews, which finishRaster builds for every GeoTIFF output), and the
+Horn gradient uses that level's cell size, so zoomed-out views cost about
+as much as zoomed-in ones. Computed tiles are kept in an LRU cache bounded
+by their total size in bytes, so panning back over an area is free and a
+statewide DEM can be browsed in bounded memory.
+
+The derivatives are the same functions the batch outputs use (see
+computeTerrainDerivatives), so at full resolution a tile matches the
+batch output cell for cell.
+"""
+from collections import OrderedDict
+
+import numpy as np
+try:
+    from osgeo import gdal
+except ImportError:
+    gdal = None
+
+from terrainengine import (aspectDegrees, aspectNodata, fillNodata,
+    hillshadeNodata, hillshadeVariant, hornGradient, slopeNodata, slopePercent)
+
+# lazy tile settings
+defaultTileSize = 256 # cells per side of a tile
+defaultCacheMB = 256 # megabytes of computed tiles to keep
+
+# (GDAL type name, NumPy type, nodata) of the rendered view of each product
+lazyProducts = {'hillshade':('Byte', np.uint8, hillshadeNodata),
+    'slope':('Float32', np.float32, slopeNodata),
+    'aspect':('Float32', np.float32, aspectNodata)}
+
+
+# define class to cache computed tiles
+
+class LRUTileCache:
+    """
+    Keeps the most recently used tiles, evicting the least recently used
+    ones once their total size passes a limit
+    """
+
+    def __init__(self, maxBytes):
+        """
+        Args:
+            maxBytes, total size (bytes) of the tiles to keep
+        """
+        self.maxBytes = maxBytes
+        self.tiles = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Gets a cached tile (marking it as the most recently used), or None
+        """
+        tile = self.tiles.get(key)
+        if tile is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.tiles.move_to_end(key)
+        return tile
+
+    def put(self, key, tile):
+        """
+        Caches a tile, evicting the least recently used tiles (but never the
+        new one) until the cache fits its size limit
+        """
+        if key in self.tiles:
+            self.bytes -= self.tiles.pop(key).nbytes
+        self.tiles[key] = tile
+        self.bytes += tile.nbytes
+        while self.bytes > self.maxBytes and len(self.tiles) > 1:
+            oldKey, oldTile = self.tiles.popitem(last=False)
+            self.bytes -= oldTile.nbytes
+
+    def clear(self):
+        """
+        Drops every cached tile
+        """
+        self.tiles.clear()
+        self.bytes = 0
+
+
+# define class to compute derivative tiles on demand
+
+class DerivativeTileSource:
+    """
+    Computes hillshade, slope, or aspect tiles from a DEM on demand, at the
+    level of detail of the view they're displayed in
+    """
+
+    def __init__(self, dem_fn, product, tileSize=defaultTileSize,
+        cacheMB=defaultCacheMB, azimuth=315, altitude=45, zFactor=1,
+        multidirectional=False):
+        """
+        Args:
+            dem_fn, DEM filename (ideally with overviews)
+            product, 'hillshade', 'slope', or 'aspect'
+            tileSize, cells per side of a tile
+            cacheMB, megabytes of computed tiles to keep
+            azimuth, altitude, zFactor, multidirectional, illumination of
+                the hillshade (see computeTerrainDerivatives)
+        """
+        if product not in lazyProducts:
+            raise ValueError('unknown lazy product: ' + str(product)
+                + ' (expected one of ' + ', '.join(lazyProducts) + ')')
+        self.dem_fn = dem_fn
+        self.product = product
+        self.tileSize = tileSize
+        self.illumination = {'azimuth':azimuth, 'altitude':altitude,
+            'zFactor':zFactor, 'multidirectional':multidirectional}
+        self.cache = LRUTileCache(cacheMB * 1024 * 1024)
+
+        self.ds = gdal.Open(dem_fn)
+        self.band = self.ds.GetRasterBand(1)
+        self.nodata = self.band.GetNoDataValue()
+        self.geotransform = self.ds.GetGeoTransform()
+        self.projection = self.ds.GetProjection()
+        self.width, self.height = self.ds.RasterXSize, self.ds.RasterYSize
+
+        # level i reads the DEM at a decimation of 2**i, down to the first
+        # level that fits in one tile
+        self.levels = 1
+        while max(self.width, self.height) > tileSize << (self.levels - 1):
+            self.levels += 1
+
+    def levelSize(self, level):
+        """
+        Gets the size (columns, rows) of the DEM at a level--partial cells
+        at the right and bottom edges are dropped
+        """
+        factor = 1 << level
+        return max(self.width // factor, 1), max(self.height // factor, 1)
+
+    def levelFor(self, unitsPerPixel):
+        """
+        Picks the coarsest level whose cells are no bigger than a display
+        pixel (map units per pixel), so the view is never blurrier than the DEM
+        """
+        cellSize = max(abs(self.geotransform[1]), abs(self.geotransform[5]))
+        level = 0
+        while level + 1 < self.levels and cellSize * (2 << level) <= unitsPerPixel:
+            level += 1
+        return level
+
+    def readLevel(self, level, col0, row0, cols, rows):
+        """
+        Reads a window of the DEM at a level (level cells, averaged from
+        the DEM or its overviews) as float64, with nodata cells set to NaN
+        """
+        factor = 1 << level
+        kwargs = {}
+        if factor > 1:
+            kwargs = {'buf_xsize':cols, 'buf_ysize':rows,
+                'resample_alg':gdal.GRIORA_Average}
+        block = self.band.ReadAsArray(col0 * factor, row0 * factor,
+            cols * factor, rows * factor, **kwargs).astype(np.float64)
+        if self.nodata is not None:
+            block[block == self.nodata] = np.nan
+        return block
+
+    def computeTile(self, level, tx, ty):
+        """
+        Computes a tile of the product at a level: the tile's DEM cells are
+        read with a one-cell halo (NaN past the raster edges, so edge cells
+        are nodata as in the batch outputs) and the Horn gradient is taken
+        with the level's cell size
+
+        Args:
+            level, level of detail (0 = full resolution)
+            tx, ty, tile column and row
+        Returns:
+            array of the product's values, in its output type and with its
+            nodata value (see lazyProducts)
+        """
+        levelCols, levelRows = self.levelSize(level)
+        col0, row0 = tx * self.tileSize, ty * self.tileSize
+        col1 = min(col0 + self.tileSize, levelCols)
+        row1 = min(row0 + self.tileSize, levelRows)
+
+        readCol0, readRow0 = max(col0 - 1, 0), max(row0 - 1, 0)
+        readCol1, readRow1 = min(col1 + 1, levelCols), min(row1 + 1, levelRows)
+        window = np.full((row1 - row0 + 2, col1 - col0 + 2), np.nan)
+        block = self.readLevel(level, readCol0, readRow0, readCol1 - readCol0,
+            readRow1 - readRow0)
+        top, left = readRow0 - (row0 - 1), readCol0 - (col0 - 1)
+        window[top:top + block.shape[0], left:left + block.shape[1]] = block
+
+        factor = 1 << level
+        x, y = hornGradient(window, abs(self.geotransform[1]) * factor,
+            abs(self.geotransform[5]) * factor)
+        if self.product == 'slope':
+            values = slopePercent(x, y)
+        elif self.product == 'aspect':
+            values = aspectDegrees(x, y)
+        else:
+            values = hillshadeVariant(x, y, self.illumination)
+        typeName, npType, nodata = lazyProducts[self.product]
+        return fillNodata(values, nodata, npType)
+
+    def tile(self, level, tx, ty):
+        """
+        Gets a tile of the product at a level, from the cache if it's there
+        (see computeTile)
+        """
+        key = (level, tx, ty)
+        tile = self.cache.get(key)
+        if tile is None:
+            tile = self.computeTile(level, tx, ty)
+            self.cache.put(key, tile)
+        return tile
+
+    def renderView(self, extent, width, height):
+        """
+        Renders the product for a map view: computes (or reuses) the tiles
+        the view covers at the level matching its scale and samples them
+        at the view's pixel centers
+
+        Args:
+            extent, (xmin, ymin, xmax, ymax) of the view, in the DEM's
+                coordinate reference system
+            width, height, view size (pixels)
+        Returns:
+            (values, geotransform), where values is a height x width array
+            of the product (with its nodata value outside the DEM) and
+            geotransform is the view's GDAL geotransform
+        """
+        xmin, ymin, xmax, ymax = extent
+        xres, yres = (xmax - xmin) / width, (ymax - ymin) / height
+        level = self.levelFor(max(xres, yres))
+        levelCols, levelRows = self.levelSize(level)
+        typeName, npType, nodata = lazyProducts[self.product]
+
+        # level cell of each pixel column and row
+        factor = 1 << level
+        originX, cellX, _, originY, _, cellY = self.geotransform
+        xs = xmin + (np.arange(width) + 0.5) * xres
+        ys = ymax - (np.arange(height) + 0.5) * yres
+        cols = np.floor((xs - originX) / (cellX * factor)).astype(np.int64)
+        rows = np.floor((ys - originY) / (cellY * factor)).astype(np.int64)
+
+        values = np.full((height, width), nodata, dtype=npType)
+        inCols = np.flatnonzero((cols >= 0) & (cols < levelCols))
+        inRows = np.flatnonzero((rows >= 0) & (rows < levelRows))
+        for ty in np.unique(rows[inRows] // self.tileSize):
+            tileRows = inRows[rows[inRows] // self.tileSize == ty]
+            for tx in np.unique(cols[inCols] // self.tileSize):
+                tileCols = inCols[cols[inCols] // self.tileSize == tx]
+                tile = self.tile(level, int(tx), int(ty))
+                values[np.ix_(tileRows, tileCols)] = tile[np.ix_(
+                    rows[tileRows] - ty * self.tileSize,
+                    cols[tileCols] - tx * self.tileSize)]
+
+        geotransform = (xmin, xres, 0, ymax, 0, -yres)
+        return values, geotransform
+
+    def writeView(self, view_fn, extent, width, height):
+        """
+        Renders the product for a map view (see renderView) to a GeoTIFF,
+        e.g. in /vsimem/ for a map layer to display
+
+        Args:
+            view_fn, filename to use for output
+            extent, width, height, the map view (see renderView)
+        Returns:
+            None
+        """
+        values, geotransform = self.renderView(extent, width, height)
+        typeName, npType, nodata = lazyProducts[self.product]
+        outDS = gdal.GetDriverByName('GTiff').Create(view_fn, width, height,
+            1, gdal.GetDataTypeByName(typeName))
+        outDS.SetGeoTransform(geotransform)
+        outDS.SetProjection(self.projection)
+        outBand = outDS.GetRasterBand(1)
+        outBand.SetNoDataValue(nodata)
+        outBand.WriteArray(values)
+        outDS = None
@@ -0,0 +1,697 @@
+"""
+Pipeline plumbing used by terrainanalysis.py.
+
+Content-addressed artifact cache: every pipeline stage is keyed on a hash
+of its input files' contents, its parameters and its output names. When a
+stage's key matches an earlier run, its outputs are restored from the cache
+store (hard links, so restoring costs no copying) instead of being
+recomputed; the store is evicted least-recently-used first once it grows
+past a size limit.
+
+Stage scheduler: the pipeline is declared as a list of stages whose
+dependencies follow from the files they read and write. Independent stages
+run side by side on a process pool; stages that need QGIS (processing
+algorithms) run in the calling process, as does every map-display callback,
+once the stage it belongs to completes.
+
+Run report: each completed stage can be recorded with its wall and CPU
+time, peak memory and bytes read/written (measured in the process that ran
+it), and the sizes and raster dimensions of its inputs and outputs; chosen
+stages can be run under cProfile.
+"""
+import cProfile
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import pstats
+import shutil
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+try:
+    from osgeo import gdal
+except ImportError:
+    gdal = None
+
+try:
+    import resource
+except ImportError: # not on Windows
+    resource = None
+
+# bytes read at a time when hashing files
+hashChunkSize = 2 ** 20
+
+# functions listed in the text summary of a stage's profile
+profileTopFunctions = 40
+
+# columns of the CSV run history (see RunReport)
+reportColumns = ['run', 'stage', 'ran', 'mainProcess', 'finished',
+    'wallSeconds', 'cpuSeconds', 'peakMemoryBytes', 'bytesRead',
+    'bytesWritten', 'inputBytes', 'outputBytes', 'width', 'height', 'pid']
+
+
+# define functions to find the files that make up a dataset
+
+def companionFiles(data_fn):
+    """
+    Lists a dataset's file and its sidecar files (e.g. .shx/.dbf/.prj for a
+    shapefile, .sgrd for a SAGA grid, .aux.xml for a GeoTIFF)
+
+    Args:
+        data_fn, dataset filename
+    Returns:
+        sorted list of existing filenames
+    """
+    folder, name = os.path.split(os.path.abspath(data_fn))
+    stem = os.path.splitext(name)[0]
+    if not os.path.isdir(folder):
+        return []
+    return sorted(os.path.join(folder, f) for f in os.listdir(folder)
+        if (f == name or f.startswith(stem + '.'))
+        and os.path.isfile(os.path.join(folder, f)))
+
+
+def removeDataset(data_fn):
+    """
+    Deletes a dataset's file and its sidecar files (so that regenerating
+    it never writes through a hard link into the cache store)
+    """
+    for fn in companionFiles(data_fn):
+        os.remove(fn)
+
+
+def linkOrCopy(src_fn, dst_fn):
+    """
+    Hard-links a file, falling back to a copy across file systems
+    """
+    try:
+        os.link(src_fn, dst_fn)
+    except OSError:
+        shutil.copy2(src_fn, dst_fn)
+
+
+# define the artifact cache
+
+class ArtifactCache:
+    """
+    Content-addressed cache of pipeline stage outputs
+
+    Args:
+        cache_folder, folder for the cache store and its manifest
+        maxSizeGB, size limit of the store; least-recently-used entries
+            are evicted past it
+    """
+
+    def __init__(self, cache_folder, maxSizeGB=20):
+        self.cache_folder = cache_folder
+        self.maxSizeBytes = maxSizeGB * 2 ** 30
+        self.manifest_fn = os.path.join(cache_folder, 'manifest.json')
+        os.makedirs(cache_folder, exist_ok=True)
+
+        self.manifest = {'fingerprints':{}, 'entries':{}}
+        if os.path.isfile(self.manifest_fn):
+            with open(self.manifest_fn) as f:
+                self.manifest = json.load(f)
+
+    def saveManifest(self):
+        """
+        Writes the manifest (atomically, so an interrupted run can't corrupt it)
+        """
+        tmp_fn = self.manifest_fn + '.tmp'
+        with open(tmp_fn, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_fn, self.manifest_fn)
+
+    def fileHash(self, data_fn):
+        """
+        Hashes a file's contents; the hash is remembered by path, size,
+        modification time and inode, so each file version is read only once
+        """
+        stat = os.stat(data_fn)
+        fingerprint = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        known = self.manifest['fingerprints'].get(os.path.abspath(data_fn))
+        if known is not None and known[:3] == fingerprint:
+            return known[3]
+
+        digest = hashlib.blake2b()
+        with open(data_fn, 'rb') as f:
+            for chunk in iter(lambda: f.read(hashChunkSize), b''):
+                digest.update(chunk)
+        contentHash = digest.hexdigest()
+        self.manifest['fingerprints'][os.path.abspath(data_fn)] = \
+            fingerprint + [contentHash]
+        return contentHash
+
+    def stageKey(self, stage, inputs, outputs, params):
+        """
+        Computes a stage's cache key
+
+        Args:
+            stage, stage name
+            inputs, list of input dataset filenames (sidecars are included)
+            outputs, list of output dataset filenames (only names count)
+            params, stage parameters (JSON-serializable, or with a stable repr)
+        Returns:
+            hex digest
+        """
+        inputHashes = [[os.path.basename(fn), self.fileHash(fn)]
+            for data_fn in inputs for fn in companionFiles(data_fn)]
+        paths = set(inputs) | set(outputs)
+        keyData = json.dumps({'stage':stage,
+            'params':normalizePaths(params, paths),
+            'inputs':inputHashes,
+            'outputs':[os.path.basename(fn) for fn in outputs]},
+            sort_keys=True, default=repr)
+        return hashlib.blake2b(keyData.encode()).hexdigest()[:32]
+
+    def restore(self, key, outputs):
+        """
+        Restores a stage's outputs from the store, if the key is cached
+
+        Returns:
+            True if the outputs were restored
+        """
+        entry = self.manifest['entries'].get(key)
+        if entry is None:
+            return False
+        entry_folder = os.path.join(self.cache_folder, key)
+        if not all(os.path.isfile(os.path.join(entry_folder, name))
+            for name in entry['files']):
+            self.evict(key)
+            return False
+
+        for data_fn in outputs:
+            removeDataset(data_fn)
+        for out_folder, names in entry['folders'].items():
+            for name in names:
+                linkOrCopy(os.path.join(entry_folder, name),
+                    os.path.join(out_folder, name))
+
+        entry['lastUsed'] = time.time()
+        self.saveManifest()
+        return True
+
+    def store(self, key, stage, outputs):
+        """
+        Adds a stage's outputs (and their sidecar files) to the store,
+        then evicts old entries past the size limit
+        """
+        entry_folder = os.path.join(self.cache_folder, key)
+        if os.path.isdir(entry_folder):
+            shutil.rmtree(entry_folder)
+        os.makedirs(entry_folder)
+
+        files, folders, size = [], {}, 0
+        for data_fn in outputs:
+            for fn in companionFiles(data_fn):
+                out_folder, name = os.path.split(fn)
+                linkOrCopy(fn, os.path.join(entry_folder, name))
+                files.append(name)
+                folders.setdefault(out_folder, []).append(name)
+                size += os.path.getsize(fn)
+
+        self.manifest['entries'][key] = {'stage':stage, 'files':files,
+            'folders':folders, 'size':size, 'lastUsed':time.time()}
+        self.evictToLimit(keep=key)
+        self.saveManifest()
+
+    def evict(self, key):
+        """
+        Removes an entry from the store
+        """
+        shutil.rmtree(os.path.join(self.cache_folder, key), ignore_errors=True)
+        self.manifest['entries'].pop(key, None)
+
+    def evictToLimit(self, keep=None):
+        """
+        Evicts least-recently-used entries until the store fits the size limit
+        """
+        entries = self.manifest['entries']
+        total = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['lastUsed']):
+            if total <= self.maxSizeBytes:
+                break
+            if key != keep:
+                total -= entries[key]['size']
+                self.evict(key)
+
+        # forget fingerprints of files that no longer exist
+        fingerprints = self.manifest['fingerprints']
+        for data_fn in [fn for fn in fingerprints if not os.path.isfile(fn)]:
+            del fingerprints[data_fn]
+
+    def run(self, stage, inputs, outputs, func, *args, **kwargs):
+        """
+        Runs a pipeline stage unless its outputs are already cached; the
+        stage's arguments are part of its key
+
+        Args:
+            stage, stage name
+            inputs, list of input dataset filenames
+            outputs, list of dataset filenames the stage writes
+            func, function that runs the stage (called with *args, **kwargs)
+        Returns:
+            True if the stage ran, False if its outputs were restored
+        """
+        key = self.stageKey(stage, inputs, outputs, [args, kwargs])
+        if self.restore(key, outputs):
+            return False
+
+        prepareOutputs(outputs)
+        func(*args, **kwargs)
+        self.store(key, stage, outputs)
+        return True
+
+
+def prepareOutputs(outputs):
+    """
+    Removes a stage's old outputs before it runs
+    """
+    for data_fn in outputs:
+        removeDataset(data_fn)
+
+
+def normalizePaths(value, paths):
+    """
+    Replaces input/output paths inside stage parameters with their base
+    names, so moving a project folder doesn't invalidate its cache
+    """
+    if isinstance(value, str):
+        return os.path.basename(value) if value in paths else value
+    if isinstance(value, dict):
+        return {k: normalizePaths(v, paths) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalizePaths(v, paths) for v in value]
+    return value
+
+
+# define functions to measure stages
+
+def readProcessIO():
+    """
+    Gets the bytes this process has read and written so far (Linux only;
+    includes reads served from the page cache)
+
+    Returns:
+        (bytes read, bytes written), or (None, None) where unavailable
+    """
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(':') for line in f if ':' in line)
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def resetPeakMemory():
+    """
+    Resets this process's peak resident set size, so it can be read per
+    stage (Linux only; elsewhere the peak is the process's lifetime peak)
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def readPeakMemory():
+    """
+    Gets this process's peak resident set size (bytes), or None where
+    unavailable
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxRSS if sys.platform == 'darwin' else maxRSS * 1024
+
+
+def measureCall(func, args, kwargs, profile_fn=None):
+    """
+    Runs a function and measures it: wall and CPU time, peak memory, and the
+    bytes the process read and wrote while it ran
+
+    Args:
+        func, function (called with *args, **kwargs)
+        profile_fn, optional filename to save a cProfile of the call to
+            (with a text summary of the top functions next to it)
+    Returns:
+        (func's result, dict of measurements)
+    """
+    resetPeakMemory()
+    readBefore, writtenBefore = readProcessIO()
+    wallStart, cpuStart = time.perf_counter(), time.process_time()
+
+    if profile_fn is None:
+        result = func(*args, **kwargs)
+    else:
+        profiler = cProfile.Profile()
+        result = profiler.runcall(func, *args, **kwargs)
+        os.makedirs(os.path.dirname(profile_fn), exist_ok=True)
+        profiler.dump_stats(profile_fn)
+        with open(os.path.splitext(profile_fn)[0] + '.txt', 'w') as f:
+            pstats.Stats(profiler, stream=f).sort_stats('cumulative') \
+                .print_stats(profileTopFunctions)
+
+    metrics = {'wallSeconds':time.perf_counter() - wallStart,
+        'cpuSeconds':time.process_time() - cpuStart,
+        'peakMemoryBytes':readPeakMemory(), 'pid':os.getpid()}
+    readAfter, writtenAfter = readProcessIO()
+    metrics['bytesRead'] = None if readBefore is None else readAfter - readBefore
+    metrics['bytesWritten'] = None if writtenBefore is None \
+        else writtenAfter - writtenBefore
+    return result, metrics
+
+
+def datasetInfo(data_fn):
+    """
+    Gets a dataset's size on disk and, for a raster, its dimensions
+
+    Returns:
+        dict with the filename, bytes, and (rasters only) width, height, and
+        number of bands
+    """
+    info = {'fn':data_fn, 'bytes':sum(os.path.getsize(fn)
+        for fn in companionFiles(data_fn))}
+    if info['bytes'] == 0:
+        return info
+    gdal.PushErrorHandler('CPLQuietErrorHandler')
+    try:
+        ds = gdal.OpenEx(data_fn, gdal.OF_RASTER)
+    except RuntimeError:
+        ds = None
+    finally:
+        gdal.PopErrorHandler()
+    if ds is not None:
+        info.update(width=ds.RasterXSize, height=ds.RasterYSize,
+            bands=ds.RasterCount)
+    return info
+
+
+class RunReport:
+    """
+    Collects a record of each stage a run completes--wall and CPU time,
+    peak memory and bytes read/written by the process that ran it, and the
+    sizes (and raster dimensions) of its inputs and outputs--and saves them
+    as JSON and CSV
+
+    Args:
+        profileStages, names of stages to run under cProfile
+        profile_folder, folder for the profiles (<stage>.prof, and a
+            summary of the top functions in <stage>.txt)
+    """
+
+    def __init__(self, profileStages=(), profile_folder=None):
+        self.profileStages = set(profileStages)
+        self.profile_folder = profile_folder
+        self.started = time.time()
+        self.records = []
+
+    def profilePath(self, stage):
+        """
+        Gets the filename of a stage's profile, or None if it isn't profiled
+        """
+        if stage.name not in self.profileStages or self.profile_folder is None:
+            return None
+        return os.path.join(self.profile_folder, stage.name + '.prof')
+
+    def addStage(self, name, ran, metrics, inputs=(), outputs=(), mainProcess=True):
+        """
+        Records a completed stage
+
+        Args:
+            name, stage name
+            ran, True if the stage ran, False if its outputs were restored
+            metrics, measurements (see measureCall)
+            inputs, outputs, dataset filenames the stage read and wrote
+            mainProcess, whether it ran in the calling process
+        Returns:
+            None
+        """
+        record = {'stage':name, 'ran':ran, 'mainProcess':mainProcess,
+            'finished':time.time() - self.started}
+        record.update(metrics)
+        record['inputs'] = [datasetInfo(data_fn) for data_fn in inputs]
+        record['outputs'] = [datasetInfo(data_fn) for data_fn in outputs]
+        self.records.append(record)
+
+    def save(self, report_fn, history_fn=None):
+        """
+        Saves the report as JSON, and optionally appends one row per stage to
+        a CSV history of runs (for spotting regressions across runs)
+
+        Args:
+            report_fn, JSON filename (overwritten)
+            history_fn, optional CSV filename (appended to)
+        Returns:
+            None
+        """
+        with open(report_fn, 'w') as f:
+            json.dump({'started':self.started, 'wallSeconds':time.time()
+                - self.started, 'stages':self.records}, f, indent=1)
+        if history_fn is None:
+            return
+
+        newFile = not os.path.isfile(history_fn)
+        with open(history_fn, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if newFile:
+                writer.writerow(reportColumns)
+            for record in self.records:
+                rasters = [info for info in record['outputs'] + record['inputs']
+                    if 'width' in info]
+                row = dict(record, run=time.strftime('%Y-%m-%dT%H:%M:%S',
+                    time.localtime(self.started)),
+                    inputBytes=sum(info['bytes'] for info in record['inputs']),
+                    outputBytes=sum(info['bytes'] for info in record['outputs']),
+                    width=rasters[0]['width'] if rasters else None,
+                    height=rasters[0]['height'] if rasters else None)
+                writer.writerow(['' if row.get(column) is None else row[column]
+                    for column in reportColumns])
+
+
+# define the stage graph and its scheduler
+
+class Stage:
+    """
+    One step of the pipeline
+
+    Args:
+        name, stage name (also its cache name)
+        func, function that runs the stage (called with *args, **kwargs);
+            must be importable from a module for worker-process stages
+        args, kwargs, arguments for func
+        inputs, list of dataset filenames the stage reads
+        outputs, list of dataset filenames the stage writes
+        enabled, whether the stage's outputs are wanted (stages that only
+            feed enabled stages are run as needed)
+        mainProcess, run in the calling process (e.g. for QGIS processing
+            algorithms, which can't run in a worker process)
+        onComplete, optional function called (in the calling process, with
+            no arguments) once the stage's outputs exist, e.g. to display them
+    """
+
+    def __init__(self, name, func, args=(), kwargs=None, inputs=(), outputs=(),
+        enabled=True, mainProcess=False, onComplete=None):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs or {})
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.enabled = enabled
+        self.mainProcess = mainProcess
+        self.onComplete = onComplete
+
+
+def stageDependencies(stages):
+    """
+    Works out which stages each stage depends on (the ones that write its inputs)
+
+    Args:
+        stages, list of Stage
+    Returns:
+        dict of stage name -> set of stage names
+    """
+    producers = {}
+    for stage in stages:
+        for data_fn in stage.outputs:
+            producers[os.path.abspath(data_fn)] = stage.name
+    return {stage.name: {producers[os.path.abspath(fn)] for fn in stage.inputs
+        if os.path.abspath(fn) in producers} for stage in stages}
+
+
+def neededStages(stages):
+    """
+    Drops disabled branches: keeps the enabled stages and every stage they
+    depend on, in declaration order
+    """
+    dependencies = stageDependencies(stages)
+    needed = set()
+    todo = [stage.name for stage in stages if stage.enabled]
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(dependencies[name])
+    return [stage for stage in stages if stage.name in needed]
+
+
+def workerContext():
+    """
+    Gets a multiprocessing context for worker processes. Workers are spawned
+    (not forked from QGIS) using the Python interpreter that QGIS embeds,
+    since sys.executable is the QGIS application inside the QGIS console.
+    """
+    context = multiprocessing.get_context('spawn')
+    if not os.path.basename(sys.executable).lower().startswith('python'):
+        for python_fn in [os.path.join(sys.exec_prefix, 'python.exe'),
+            os.path.join(sys.exec_prefix, 'python3.exe'),
+            os.path.join(sys.exec_prefix, 'bin', 'python3'),
+            os.path.join(sys.exec_prefix, 'bin', 'python')]:
+            if os.path.isfile(python_fn):
+                context.set_executable(python_fn)
+                break
+    return context
+
+
+def createWorkerPool(workers=None):
+    """
+    Starts a pool of worker processes that several stage graphs can share
+    (see runStageGraph), so the workers and their imports stay warm
+
+    Args:
+        workers, number of worker processes (None or 0 = one per CPU)
+    Returns:
+        ProcessPoolExecutor, or None for 1 worker (run in this process)
+    """
+    if not workers:
+        workers = os.cpu_count() or 1
+    if workers == 1:
+        return None
+    return ProcessPoolExecutor(workers, mp_context=workerContext())
+
+
+def callStage(func, args, kwargs, profile_fn=None):
+    """
+    Runs a stage's function (in a worker process) and measures it
+
+    Returns:
+        dict of measurements (see measureCall)
+    """
+    return measureCall(func, args, kwargs, profile_fn)[1]
+
+
+def runStageGraph(stages, workers=None, cache=None, pool=None, report=None):
+    """
+    Runs a graph of stages, each as soon as the stages it depends on are done.
+    Worker stages run in parallel on a process pool; main-process stages run
+    here one at a time while the pool keeps working. Cache lookups and
+    onComplete callbacks always run here.
+
+    Args:
+        stages, list of Stage
+        workers, number of worker processes (None or 0 = one per CPU;
+            1 = run every stage in this process)
+        cache, optional ArtifactCache to skip stages with unchanged inputs
+        pool, optional worker pool (from createWorkerPool) to use instead of
+            starting one; it's left running for the caller to reuse
+        report, optional RunReport to record each stage in
+    Returns:
+        dict of stage name -> True if it ran, False if restored from the cache
+    """
+    stages = neededStages(stages)
+    dependencies = stageDependencies(stages)
+    ownPool = pool is None
+    if ownPool and any(not stage.mainProcess for stage in stages):
+        pool = createWorkerPool(workers)
+
+    pending = list(stages)
+    running = {}
+    keys = {}
+    ran = {}
+    metrics = {}
+
+    def finish(stage):
+        if cache is not None and ran[stage.name]:
+            cache.store(keys[stage.name], stage.name, stage.outputs)
+        if report is not None:
+            report.addStage(stage.name, ran[stage.name], metrics[stage.name],
+                stage.inputs, stage.outputs, stage.mainProcess or pool is None)
+        if stage.onComplete is not None:
+            stage.onComplete()
+
+    def start(stage):
+        # restore from the cache, or prepare to run; returns True if restored
+        if cache is not None:
+            keys[stage.name] = cache.stageKey(stage.name, stage.inputs,
+                stage.outputs, [stage.args, stage.kwargs])
+            restored, metrics[stage.name] = measureCall(cache.restore,
+                (keys[stage.name], stage.outputs), {})
+            if restored:
+                ran[stage.name] = False
+                return True
+        # with or without a cache: old outputs may be hard links into the
+        # store (from an earlier cached run), which writing over them in
+        # place would corrupt
+        prepareOutputs(stage.outputs)
+        ran[stage.name] = True
+        return False
+
+    def profilePath(stage):
+        return report.profilePath(stage) if report is not None else None
+
+    try:
+        while pending or running:
+            runningNames = {stage.name for stage in running.values()}
+            done = {name for name in ran if name not in runningNames}
+            ready = [stage for stage in pending if dependencies[stage.name] <= done]
+            inline = [stage for stage in ready if stage.mainProcess or pool is None]
+
+            # hand every ready worker stage to the pool
+            for stage in ready:
+                if stage not in inline:
+                    pending.remove(stage)
+                    if start(stage):
+                        finish(stage)
+                    else:
+                        future = pool.submit(callStage, stage.func, stage.args,
+                            stage.kwargs, profilePath(stage))
+                        running[future] = stage
+
+            # run one ready main-process stage while the pool works
+            if inline:
+                stage = inline[0]
+                pending.remove(stage)
+                if not start(stage):
+                    metrics[stage.name] = callStage(stage.func, stage.args,
+                        stage.kwargs, profilePath(stage))
+                finish(stage)
+            elif running:
+                completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    stage = running.pop(future)
+                    # re-raises a worker's exception here
+                    metrics[stage.name] = future.result()
+                    finish(stage)
+            elif not ready:
+                raise ValueError('stages with unmet dependencies: '
+                    + ', '.join(stage.name for stage in pending))
+    finally:
+        if ownPool and pool is not None:
+            pool.shutdown(cancel_futures=True)
+        else:
+            for future in running:
+                future.cancel()
+
+    return ran
@@ -0,0 +1,909 @@
+"""
+Headless vectorizer for classified rasters used by terrainanalysis.py.
+
+Turns a classified (Byte) raster into one polygon per connected region of
+equal class (4-connected, like gdal:polygonize without 8-connectedness):
+    -the raster is read strip by strip as horizontal runs of equal class,
+        so memory use depends on the number of runs, not of cells
+    -runs are joined into regions with a vectorized union-find (hooking
+        plus pointer jumping) over the runs that touch across each row seam,
+        strip seams included
+    -optionally, regions smaller than a minimum mapping unit are merged
+        into their largest neighbor (a sieve)
+    -region boundaries are traced once as arcs between the nodes where
+        three or more regions meet, and each arc is simplified once
+        (Douglas-Peucker with its end nodes fixed), so neighboring polygons
+        keep sharing identical edges. Arcs are simplified independently, so
+        a simplified arc can cross a neighboring arc (or itself) or pass
+        over one; any arc that would is kept unsimplified (see
+        keepTopology), which keeps the polygons free of gaps and overlaps
+    -each region's polygon is assembled from its arcs
+Every step after reading works on flat arrays of all the arcs or rings at
+once (arcs are walked by pointer jumping, simplified a split at a time
+across all arcs, and checked for conflicts with a bucket grid), so there is
+no Python loop over cells, arcs or vertices; only the sieve's merges and
+the features themselves are handled one by one.
+"""
+import numpy as np
+try:
+    from osgeo import gdal, ogr
+except ImportError:
+    gdal = ogr = None
+
+from terrainengine import VectorSink, defaultBlockRows, openBand
+
+
+# define functions to label the connected regions of a classified raster
+
+def readRuns(band, blockRows=defaultBlockRows):
+    """
+    Reads a classified band strip by strip as horizontal runs of equal class
+
+    Args:
+        band, GDAL band to read
+        blockRows, number of rows read per strip
+    Returns:
+        (rows, starts, ends, classes) arrays of the runs, in row order
+    """
+    width = band.XSize
+    rows, starts, classes = [], [], []
+    for row0 in range(0, band.YSize, blockRows):
+        strip = band.ReadAsArray(0, row0, width, min(blockRows, band.YSize - row0))
+        startsRun = np.ones(strip.shape, dtype=bool)
+        startsRun[:, 1:] = strip[:, 1:] != strip[:, :-1]
+        runRows, runStarts = np.nonzero(startsRun)
+        rows.append(runRows + row0)
+        starts.append(runStarts)
+        classes.append(strip[runRows, runStarts])
+    rows, starts = np.concatenate(rows), np.concatenate(starts)
+
+    ends = np.append(starts[1:], width)
+    ends[np.append(rows[1:] != rows[:-1], True)] = width
+    return rows, starts, ends, np.concatenate(classes)
+
+
+def linePieces(rows, starts, height, width):
+    """
+    Splits each horizontal grid line (line r lies between rows r - 1 and r,
+    r = 0 to height) into pieces along which the runs above and below it
+    don't change
+
+    Returns:
+        (lines, pieceStarts, pieceEnds, upperRuns, lowerRuns) arrays of the
+        pieces; runs are -1 past the raster's edges
+    """
+    stride = width + 1
+    lowerKeys = rows * stride + starts # each run lies below line = its row...
+    upperKeys = (rows + 1) * stride + starts # ...and above line = its row + 1
+    # (both are sorted, so a stable sort just merges them)
+    keys = np.sort(np.concatenate([lowerKeys, upperKeys]), kind='stable')
+    keys = keys[np.append(True, keys[1:] != keys[:-1])]
+    lines, pieceStarts = keys // stride, keys % stride
+    pieceEnds = np.append(pieceStarts[1:], width)
+    pieceEnds[np.append(lines[1:] != lines[:-1], True)] = width
+
+    lowerRuns = np.searchsorted(lowerKeys, keys, 'right') - 1
+    lowerRuns[lines >= height] = -1
+    upperRuns = np.searchsorted(upperKeys, keys, 'right') - 1
+    upperRuns[lines == 0] = -1
+    return lines, pieceStarts, pieceEnds, upperRuns, lowerRuns
+
+
+def unionRuns(runCount, first, second):
+    """
+    Joins runs into regions (a vectorized union-find: each round hooks the
+    root of every pair onto the lower of the two roots, then compresses the
+    paths by pointer jumping)
+
+    Args:
+        runCount, number of runs
+        first, second, arrays of the runs to join, pairwise
+    Returns:
+        array of each run's region (the lowest run index in the region)
+    """
+    label = np.arange(runCount)
+    while True:
+        rootA, rootB = label[first], label[second]
+        differ = rootA != rootB
+        if not differ.any():
+            return label
+        rootA, rootB = rootA[differ], rootB[differ]
+        lowest = np.minimum(rootA, rootB)
+        np.minimum.at(label, rootA, lowest)
+        np.minimum.at(label, rootB, lowest)
+        while True:
+            jumped = label[label]
+            if (jumped == label).all():
+                break
+            label = jumped
+
+
+def sieveRegions(label, runSizes, valid, neighborPairs, minCells):
+    """
+    Merges each region smaller than a minimum mapping unit into its largest
+    neighboring region, smallest regions first
+
+    Args:
+        label, array of each run's region (from unionRuns)
+        runSizes, array of each run's size (cells)
+        valid, array of whether each run is data (nodata is never merged)
+        neighborPairs, (first, second) arrays of neighboring regions
+        minCells, minimum region size (cells)
+    Returns:
+        array of each run's region after merging
+    """
+    sizes = np.bincount(label, weights=runSizes, minlength=label.size)
+    regions = np.unique(label)
+    small = regions[(sizes[regions] < minCells) & valid[regions]]
+    if small.size == 0:
+        return label
+
+    isSmall = np.zeros(label.size, dtype=bool)
+    isSmall[small] = True
+    first, second = neighborPairs
+    neighbors = {region:set() for region in small.tolist()}
+    for a, b in zip(*[pair.tolist() for pair in
+        (first[isSmall[first]], second[isSmall[first]])]):
+        neighbors[a].add(b)
+    for a, b in zip(*[pair.tolist() for pair in
+        (second[isSmall[second]], first[isSmall[second]])]):
+        neighbors[a].add(b)
+
+    parent = list(range(label.size))
+    small = small[np.argsort(sizes[small], kind='stable')]
+    sizes = sizes.tolist()
+
+    def find(region):
+        while parent[region] != region:
+            parent[region] = parent[parent[region]]
+            region = parent[region]
+        return region
+
+    for region in small.tolist():
+        if sizes[region] >= minCells:
+            continue
+        candidates = {find(n) for n in neighbors[region]} - {region}
+        if not candidates:
+            continue # surrounded by nodata
+        # (ties go to the first region in raster order, so a cut of the
+        # raster sieves its regions the same way)
+        target = max(candidates, key=lambda n: (sizes[n], -n))
+        parent[region] = target
+        sizes[target] += sizes[region]
+        if sizes[target] < minCells:
+            neighbors[target] |= neighbors[region]
+
+    parent = np.array(parent)
+    while True:
+        jumped = parent[parent]
+        if (jumped == parent).all():
+            return parent[label]
+        parent = jumped
+
+
+# define functions to trace region boundaries as arcs
+
+def spanIndices(starts, stops):
+    """
+    Lists the indices of several spans [start, stop) at once
+
+    Returns:
+        (indices, spans) arrays: every index in the spans, in order, and
+        the span each belongs to
+    """
+    lengths = stops - starts
+    spans = np.repeat(np.arange(starts.size), lengths)
+    ends = np.cumsum(lengths)
+    indices = np.arange(ends[-1] if ends.size else 0) \
+        - np.repeat(ends - lengths - starts, lengths)
+    return indices, spans
+
+
+def chainDistances(successor):
+    """
+    Ranks the elements of chains by pointer jumping: each round, every
+    element not yet at the end of its chain doubles how far ahead it looks
+
+    Args:
+        successor, array of each element's successor in its chain (-1 at
+            the end of a chain; there must be no cycles)
+    Returns:
+        (last, distance) arrays of the last element of each element's chain
+        and the number of steps to it
+    """
+    last = np.where(successor >= 0, successor, np.arange(successor.size))
+    distance = (successor >= 0).astype(np.int64)
+    active = np.flatnonzero(successor >= 0)
+    while active.size:
+        ahead = last[active]
+        distance[active] += distance[ahead]
+        last[active] = last[ahead]
+        active = active[successor[last[active]] >= 0]
+    return last, distance
+
+
+def boundarySegments(rows, starts, ends, region, lines, pieceStarts,
+    pieceEnds, upperRuns, lowerRuns, width):
+    """
+    Lists the straight boundary segments between regions (on the grid of
+    cell corners, x = column, y = row), each directed so that its left
+    region is on its left; segments that continue one another between the
+    same two regions are joined, so a segment ends only where the boundary
+    turns or meets another boundary
+
+    Args:
+        rows, starts, ends, arrays of the runs (from readRuns)
+        region, array of each run's region (-1 for nodata)
+        lines, pieceStarts, pieceEnds, upperRuns, lowerRuns, grid line
+            pieces (from linePieces)
+        width, raster width
+    Returns:
+        (x0, y0, x1, y1, left, right) arrays of the segments (regions are
+        -1 past the raster's edges and on nodata)
+    """
+    runRegion = np.append(region, -1) # so that run -1 maps to region -1
+
+    # horizontal segments run east along the grid lines, with the region
+    # above on their left
+    upper, lower = runRegion[upperRuns], runRegion[lowerRuns]
+    boundary = np.flatnonzero(upper != lower)
+    lines, pieceStarts, pieceEnds = lines[boundary], pieceStarts[boundary], \
+        pieceEnds[boundary]
+    upper, lower = upper[boundary], lower[boundary]
+    continues = np.zeros(boundary.size, dtype=bool)
+    continues[1:] = (lines[1:] == lines[:-1]) & (pieceStarts[1:] == pieceEnds[:-1]) \
+        & (upper[1:] == upper[:-1]) & (lower[1:] == lower[:-1])
+    first = np.flatnonzero(~continues)
+    last = np.append(first[1:], boundary.size) - 1
+    horizontal = (pieceStarts[first], lines[first], pieceEnds[last], lines[first],
+        upper[first], lower[first])
+
+    # vertical segments run south across each row at the start of each run
+    # (and at the row's end), with the region to the east on their left
+    rowEnds = np.flatnonzero(np.append(rows[1:] != rows[:-1], True))
+    x = np.concatenate([starts, np.full(rowEnds.size, width)])
+    y = np.concatenate([rows, rows[rowEnds]])
+    east = np.concatenate([region, np.full(rowEnds.size, -1)])
+    west = np.concatenate([np.where(starts > 0, runRegion[np.arange(starts.size) - 1],
+        -1), region[rowEnds]])
+    boundary = np.flatnonzero(east != west)
+    boundary = boundary[np.lexsort((y[boundary], x[boundary]))] # column by column
+    x, y, east, west = x[boundary], y[boundary], east[boundary], west[boundary]
+    continues = np.zeros(boundary.size, dtype=bool)
+    continues[1:] = (x[1:] == x[:-1]) & (y[1:] == y[:-1] + 1) \
+        & (east[1:] == east[:-1]) & (west[1:] == west[:-1])
+    first = np.flatnonzero(~continues)
+    last = np.append(first[1:], boundary.size) - 1
+    vertical = (x[first], y[first], x[first], y[last] + 1, east[first], west[first])
+
+    return tuple(np.concatenate(pair) for pair in zip(horizontal, vertical))
+
+
+def traceArcs(segments, width):
+    """
+    Joins boundary segments into arcs that run between nodes (cell corners
+    where three or more regions meet) or around closed loops. The chains of
+    segments are found with a union-find, and ordered by pointer jumping.
+
+    Args:
+        segments, boundary segments (from boundarySegments)
+        width, raster width
+    Returns:
+        dict of arc arrays: 'points' (corner x, y of every arc, arc after
+        arc) and 'offsets' (where each arc's points start, plus the total),
+        'left' and 'right' regions, 'start' and 'end' node keys (-1 for
+        closed loops), and the unit 'startDirection' and 'endDirection'
+        (x, y); every corner but the ends is a turn
+    """
+    x0, y0, x1, y1, left, right = segments
+    count = x0.size
+    stride = width + 1
+
+    # segment end e of segment s is 2 * s + e; corners where other than two
+    # ends meet are nodes, and at every other corner the two ends are paired
+    corners = np.stack([x0, y0, x1, y1], axis=1).reshape(-1, 2)
+    cornerKeys = corners[:, 1] * stride + corners[:, 0]
+    order = np.argsort(cornerKeys, kind='stable')
+    sortedKeys = cornerKeys[order]
+    groupStart = np.flatnonzero(np.append(True, sortedKeys[1:] != sortedKeys[:-1]))
+    groupSize = np.diff(np.append(groupStart, sortedKeys.size))
+    atNode = np.zeros(2 * count, dtype=bool)
+    atNode[order] = np.repeat(groupSize != 2, groupSize)
+    pairs = groupStart[groupSize == 2]
+    other = np.full(2 * count, -1)
+    other[order[pairs]] = order[pairs + 1]
+    other[order[pairs + 1]] = order[pairs]
+
+    # chains with no end at a node are closed loops: each is opened at end 0
+    # of its lowest segment
+    paired = np.flatnonzero(other >= 0)
+    chain = unionRuns(count, paired // 2, other[paired] // 2)
+    isLoop = np.ones(count, dtype=bool)
+    isLoop[chain[np.flatnonzero(atNode) // 2]] = False
+    cut = 2 * np.flatnonzero(isLoop & (chain == np.arange(count)))
+    other[other[cut]] = -1
+    other[cut] = -1
+
+    # state 2 * s + e walks segment s in from end e and out of the other end,
+    # into the segment end paired with that one; a chain is walked from
+    # whichever of its two end states is lower (the reversed chain walks the
+    # same segments in from their other ends)
+    states = np.arange(2 * count)
+    last, distance = chainDistances(other[states ^ 1])
+    head = last[states ^ 1] ^ 1
+    states = np.flatnonzero(head < last ^ 1)
+    states = states[np.lexsort((-distance[states], head[states]))]
+
+    arcStarts = np.flatnonzero(np.append(True, head[states][1:] != head[states][:-1]))
+    stateCounts = np.diff(np.append(arcStarts, states.size))
+    offsets = np.concatenate([[0], np.cumsum(stateCounts + 1)])
+    points = np.empty((offsets[-1], 2), dtype=np.float64)
+    points[np.arange(states.size) + np.repeat(np.arange(arcStarts.size),
+        stateCounts)] = corners[states]
+    headStates, lastStates = states[arcStarts], states[arcStarts + stateCounts - 1]
+    points[offsets[1:] - 1] = corners[lastStates ^ 1]
+
+    forward = headStates % 2 == 0
+    headSegments = headStates // 2
+    loop = isLoop[chain[headSegments]]
+    return {'points':points, 'offsets':offsets,
+        'left':np.where(forward, left[headSegments], right[headSegments]),
+        'right':np.where(forward, right[headSegments], left[headSegments]),
+        'start':np.where(loop, -1, cornerKeys[headStates]),
+        'end':np.where(loop, -1, cornerKeys[lastStates ^ 1]),
+        'startDirection':np.sign(points[offsets[:-1] + 1]
+            - points[offsets[:-1]]).astype(np.int64),
+        'endDirection':np.sign(points[offsets[1:] - 1]
+            - points[offsets[1:] - 2]).astype(np.int64)}
+
+
+# define functions to simplify arcs and assemble polygons from them
+
+def farthestPoints(points, spans, fromPoints, toPoints):
+    """
+    Finds the point of each span farthest from the line through two points
+    (or from the first point, if they coincide)
+
+    Args:
+        points, array of (x, y) points
+        spans, (starts, stops) arrays of the spans of points to search
+        fromPoints, toPoints, arrays of each span's line ends
+    Returns:
+        (indices, distances) arrays of each span's farthest point
+    """
+    indices, span = spanIndices(*spans)
+    start, chord = fromPoints[span], (toPoints - fromPoints)[span]
+    offset = points[indices] - start
+    length = np.hypot(chord[:, 0], chord[:, 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distance = np.where(length > 0, np.abs(chord[:, 0] * offset[:, 1]
+            - chord[:, 1] * offset[:, 0]) / length, np.hypot(offset[:, 0], offset[:, 1]))
+
+    # the first of each span's farthest points
+    order = np.lexsort((-distance, span))
+    firsts = order[np.append(True, span[order][1:] != span[order][:-1])]
+    return indices[firsts], distance[firsts]
+
+
+def simplifyArcs(arcs, tolerance):
+    """
+    Simplifies arcs with the Douglas-Peucker algorithm, keeping their end
+    nodes, all arcs at once: each round splits every span farther than the
+    tolerance from its chord at its farthest point. Closed loops (rings
+    with no node, and arcs that leave and come back to the same node) are
+    split at their point farthest from their start first, so they keep at
+    least 3 corners, and are kept as they are if they'd collapse anyway.
+
+    Args:
+        arcs, arcs from traceArcs
+        tolerance, maximum distance of dropped points from the simplified
+            arcs (cells; 0 keeps every corner)
+    Returns:
+        (points, offsets) arrays of the simplified arcs, as in traceArcs
+    """
+    points, offsets = arcs['points'], arcs['offsets']
+    if tolerance <= 0:
+        return points, offsets # (the arcs only have corners that turn)
+
+    first, last = offsets[:-1], offsets[1:] - 1
+    keep = np.zeros(len(points), dtype=bool)
+    keep[first] = keep[last] = True
+    closed = np.flatnonzero(np.all(points[first] == points[last], axis=1))
+    far, distance = farthestPoints(points, (first[closed], last[closed]),
+        points[first[closed]], points[first[closed]])
+    keep[far] = True
+    starts = np.concatenate([first, far])
+    stops = np.concatenate([last, last[closed]])
+    stops[closed] = far
+
+    while starts.size:
+        inner = stops - starts >= 2
+        starts, stops = starts[inner], stops[inner]
+        if not starts.size:
+            break
+        far, distance = farthestPoints(points, (starts + 1, stops),
+            points[starts], points[stops])
+        split = distance > tolerance
+        keep[far[split]] = True
+        starts = np.concatenate([starts[split], far[split]])
+        stops = np.concatenate([far[split], stops[split]])
+
+    kept = np.add.reduceat(keep.astype(np.int64), first)
+    collapsed = closed[kept[closed] < 4]
+    keep[spanIndices(first[collapsed], last[collapsed] + 1)[0]] = True
+    kept[collapsed] = (offsets[1:] - offsets[:-1])[collapsed]
+    return points[keep], np.concatenate([[0], np.cumsum(kept)])
+
+
+def segmentsMeet(p0, p1, q0, q1):
+    """
+    Tests segments p0-p1 against segments q0-q1 (arrays of points that
+    broadcast against each other) for a point in common, other than an end
+    point the two share (unless they fold back along each other there)
+
+    Returns:
+        boolean array
+    """
+    def orientation(a, b, c):
+        return np.sign((b[..., 0] - a[..., 0]) * (c[..., 1] - a[..., 1])
+            - (b[..., 1] - a[..., 1]) * (c[..., 0] - a[..., 0]))
+
+    d1, d2 = orientation(q0, q1, p0), orientation(q0, q1, p1)
+    d3, d4 = orientation(p0, p1, q0), orientation(p0, p1, q1)
+    collinear = (d1 == 0) & (d2 == 0)
+    overlap = np.all((np.minimum(p0, p1) <= np.maximum(q0, q1))
+        & (np.minimum(q0, q1) <= np.maximum(p0, p1)), axis=-1)
+    meet = (d1 * d2 <= 0) & (d3 * d4 <= 0) & (~collinear | overlap)
+
+    for ps, pu in ((p0, p1), (p1, p0)):
+        for qs, qv in ((q0, q1), (q1, q0)):
+            shared = np.all(ps == qs, axis=-1)
+            folded = collinear & (np.sum((pu - ps) * (qv - qs), axis=-1) > 0)
+            meet &= ~shared | folded
+    return meet
+
+
+def boxPairs(lowA, highA, lowB, highB, bucketSize):
+    """
+    Finds the pairs of boxes, one from each set, that overlap or touch, by
+    putting every box in each grid bucket it covers
+
+    Args:
+        lowA, highA, lowB, highB, (n, 2) arrays of the boxes' corners
+        bucketSize, width of the buckets
+    Returns:
+        (first, second) arrays of the indices of the pairs in each set
+    """
+    if not (len(lowA) and len(lowB)):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    def bucketEntries(low, high):
+        first = (low // bucketSize).astype(np.int64)
+        counts = (high // bucketSize).astype(np.int64) - first + 1
+        cells, boxes = spanIndices(np.zeros(len(low), dtype=np.int64),
+            counts[:, 0] * counts[:, 1])
+        columns = counts[boxes, 0]
+        return boxes, first[boxes] + np.stack([cells % columns, cells // columns], axis=1)
+
+    boxesA, bucketsA = bucketEntries(lowA, highA)
+    boxesB, bucketsB = bucketEntries(lowB, highB)
+    origin = np.minimum(bucketsA.min(axis=0), bucketsB.min(axis=0))
+    rowCount = max(bucketsA[:, 1].max(), bucketsB[:, 1].max()) - origin[1] + 1
+    keysA = (bucketsA[:, 0] - origin[0]) * rowCount + bucketsA[:, 1] - origin[1]
+    keysB = (bucketsB[:, 0] - origin[0]) * rowCount + bucketsB[:, 1] - origin[1]
+    order = np.argsort(keysB, kind='stable')
+    keysB = keysB[order]
+    positions, entries = spanIndices(np.searchsorted(keysB, keysA, 'left'),
+        np.searchsorted(keysB, keysA, 'right'))
+    first, second = boxesA[entries], boxesB[order[positions]]
+
+    # count each pair once, in the bucket of the low corner of its overlap
+    for axis in (0, 1):
+        lows = np.maximum(lowA[first, axis], lowB[second, axis])
+        keep = (lows <= np.minimum(highA[first, axis], highB[second, axis])) \
+            & (lows // bucketSize == bucketsA[entries, axis])
+        first, second, entries = first[keep], second[keep], entries[keep]
+    return first, second
+
+
+def arcConflicts(current, currentOffsets, original, offsets, boxes, check,
+    bucketSize):
+    """
+    Finds the simplified arcs that change the topology: those that cross
+    themselves or another arc, or that have another arc's points between
+    them and the arcs they replace (so the points would move to their
+    other side)
+
+    Args:
+        current, currentOffsets, arrays of the arcs' points as they stand
+            (the checked arcs simplified) and where each arc starts
+        original, offsets, arrays of the arcs' unsimplified points and
+            where each arc starts
+        boxes, (low, high) arrays of the corners of the original arcs'
+            bounding boxes
+        check, array of the arcs to check
+        bucketSize, width of the buckets used to find nearby boxes
+    Returns:
+        boolean array, for each checked arc
+    """
+    arcIDs = np.repeat(np.arange(currentOffsets.size - 1), np.diff(currentOffsets))
+    local = np.full(currentOffsets.size - 1, -1)
+    local[check] = np.arange(check.size)
+    conflicts = np.zeros(check.size, dtype=bool)
+
+    # segments that meet (other than at an end point they share)
+    segments = np.flatnonzero(arcIDs[:-1] == arcIDs[1:])
+    p0, p1 = current[segments], current[segments + 1]
+    low, high = np.minimum(p0, p1), np.maximum(p0, p1)
+    checked = np.flatnonzero(local[arcIDs[segments]] >= 0)
+    first, second = boxPairs(low[checked], high[checked], low, high, bucketSize)
+    first = checked[first]
+    distinct = (arcIDs[segments[first]] != arcIDs[segments[second]]) | (first < second)
+    first, second = first[distinct], second[distinct]
+    meet = segmentsMeet(p0[first], p1[first], p0[second], p1[second])
+    conflicts[local[arcIDs[segments[first[meet]]]]] = True
+
+    # other arcs' points in the area between the simplified and original
+    # arcs (the arcs' shared end nodes lie on its boundary, so they're left
+    # out); the area and everything in it lie within the original arc's
+    # bounding box
+    low, high = boxes
+    first, second = boxPairs(low[check], high[check], current, current,
+        bucketSize)
+    endPoints = current[currentOffsets[check]], current[currentOffsets[check + 1] - 1]
+    keep = (arcIDs[second] != check[first]) \
+        & ~np.all(current[second] == endPoints[0][first], axis=1) \
+        & ~np.all(current[second] == endPoints[1][first], axis=1)
+    first, points = first[keep], current[second[keep]].astype(np.int64)
+
+    # (even-odd rule: a rightward ray from a point inside crosses the area's
+    # edges, original and simplified, an odd number of times; the points
+    # are grid corners, so the crossings are compared exactly in integers)
+    edges, owners = spanIndices(offsets[check], offsets[check + 1] - 1)
+    simpleEdges, simpleOwners = spanIndices(currentOffsets[check],
+        currentOffsets[check + 1] - 1)
+    e0 = np.concatenate([original[edges], current[simpleEdges]]).astype(np.int64)
+    e1 = np.concatenate([original[edges + 1], current[simpleEdges + 1]]).astype(np.int64)
+    owners = np.concatenate([owners, simpleOwners])
+    rows, crossing = spanIndices(np.minimum(e0[:, 1], e1[:, 1]),
+        np.maximum(e0[:, 1], e1[:, 1]))
+    e0, e1, owners = e0[crossing], e1[crossing], owners[crossing]
+    crossX = e0[:, 0] - ((rows - e0[:, 1]) * (e0[:, 0] - e1[:, 0])
+        // (e1[:, 1] - e0[:, 1]))
+    width = int(original[:, 0].max()) + 2
+    height = int(original[:, 1].max()) + 2
+    keys = np.sort((owners * height + rows) * width + crossX)
+    rowKeys = (first * height + points[:, 1]) * width
+    crossings = np.searchsorted(keys, rowKeys + width) \
+        - np.searchsorted(keys, rowKeys + points[:, 0] + 1)
+    conflicts[first[crossings % 2 == 1]] = True
+    return conflicts
+
+
+def keepTopology(simplified, original, tolerance):
+    """
+    Puts back the original points of the simplified arcs that would change
+    the topology (see arcConflicts), until no arc does; each round checks
+    every arc left against the arcs as they stand
+
+    Args:
+        simplified, (points, offsets) arrays of the arcs' simplified points
+        original, (points, offsets) arrays of the arcs' unsimplified points
+            (collinear points dropped)
+        tolerance, simplification tolerance (cells)
+    Returns:
+        (points, offsets) arrays of the arcs' points as kept
+    """
+    simplePoints, simpleOffsets = simplified
+    points, offsets = original
+    # (arcs only move up to the tolerance, so only arcs near each other
+    # are compared)
+    bucketSize = int(np.ceil(2 * tolerance)) + 2
+    pool = np.concatenate([points, simplePoints])
+    useOriginal = np.diff(simpleOffsets) == np.diff(offsets)
+
+    def currentArcs():
+        starts = np.where(useOriginal, offsets[:-1], points.shape[0] + simpleOffsets[:-1])
+        lengths = np.where(useOriginal, np.diff(offsets), np.diff(simpleOffsets))
+        indices, _ = spanIndices(starts, starts + lengths)
+        return pool[indices], np.concatenate([[0], np.cumsum(lengths)])
+
+    if useOriginal.all():
+        return simplified
+    low = np.minimum.reduceat(points, offsets[:-1])
+    high = np.maximum.reduceat(points, offsets[:-1])
+    check = np.flatnonzero(~useOriginal)
+    while check.size:
+        current, currentOffsets = currentArcs()
+        conflicting = check[arcConflicts(current, currentOffsets, points, offsets,
+            (low, high), check, bucketSize)]
+        useOriginal[conflicting] = True
+        # putting arcs back can bring the arcs near them into conflict
+        left = np.flatnonzero(~useOriginal)
+        near, _ = boxPairs(low[left], high[left], low[conflicting],
+            high[conflicting], bucketSize)
+        check = left[np.unique(near)]
+    return currentArcs()
+
+
+def directionCodes(directions):
+    """
+    Numbers unit (x, y) grid directions: east 0, south 1, west 2, north 3
+    """
+    dx, dy = directions[:, 0], directions[:, 1]
+    return np.where(dx == 1, 0, np.where(dy == 1, 1, np.where(dx == -1, 2, 3)))
+
+
+def leftTurns(directions):
+    """
+    Lists the ways out of a grid corner from the sharpest left turn to the
+    sharpest right turn (x to the east, y to the south), given the
+    directions in (an array of unit (x, y) steps)
+    """
+    dx, dy = directions[:, 0], directions[:, 1]
+    return [np.stack(way, axis=1) for way in ((dy, -dx), (dx, dy), (-dy, dx))]
+
+
+def assembleRings(arcs):
+    """
+    Chains the arcs around each region into rings, keeping the region on the
+    left and taking the sharpest left turn at each node (so that regions
+    that only touch at a corner stay apart, as with 4-connectedness). Each
+    side of an arc leads on to exactly one other, so the rings are the
+    cycles of the sides, found with a union-find and ordered by pointer
+    jumping; closed loops are rings by themselves.
+
+    Args:
+        arcs, arcs from traceArcs
+    Returns:
+        (ringArcs, ringReverse, ringOffsets, ringRegions) arrays: the arcs
+        of every ring in order, ring after ring, and whether each is walked
+        in reverse; where each ring starts in them (plus the total); and
+        each ring's region
+    """
+    arcCount = arcs['left'].size
+    sideArcs = np.tile(np.arange(arcCount), 2)
+    reverse = np.repeat([False, True], arcCount)
+    regions = np.concatenate([arcs['left'], arcs['right']])
+    valid = regions >= 0
+    sideArcs, reverse, regions = sideArcs[valid], reverse[valid], regions[valid]
+    isLoop = arcs['start'][sideArcs] < 0
+    loopArcs, loopReverse, loopRegions = sideArcs[isLoop], reverse[isLoop], \
+        regions[isLoop]
+    sideArcs, reverse, regions = sideArcs[~isLoop], reverse[~isLoop], \
+        regions[~isLoop]
+
+    # each side leads on to the side of the same region leaving its end node
+    # at the sharpest left turn
+    count = sideArcs.size
+    starts = np.where(reverse, arcs['end'][sideArcs], arcs['start'][sideArcs])
+    ends = np.where(reverse, arcs['start'][sideArcs], arcs['end'][sideArcs])
+    sign = np.where(reverse, -1, 1)[:, None]
+    directionsOut = sign * np.where(reverse[:, None], arcs['endDirection'][sideArcs],
+        arcs['startDirection'][sideArcs])
+    directionsIn = sign * np.where(reverse[:, None], arcs['startDirection'][sideArcs],
+        arcs['endDirection'][sideArcs])
+    regionRanks = np.unique(regions, return_inverse=True)[1].reshape(-1)
+    nodeRanks = np.unique(np.concatenate([starts, ends]),
+        return_inverse=True)[1].reshape(-1)
+    nodeCount = int(nodeRanks.max()) + 1 if count else 0
+    keys = (regionRanks * nodeCount + nodeRanks[:count]) * 4 \
+        + directionCodes(directionsOut)
+    order = np.argsort(keys)
+    sortedKeys = keys[order]
+    following = np.full(count, -1)
+    for way in leftTurns(directionsIn)[::-1]: # (the sharpest left turn last)
+        wayKeys = (regionRanks * nodeCount + nodeRanks[count:]) * 4 \
+            + directionCodes(way)
+        found = np.minimum(np.searchsorted(sortedKeys, wayKeys), count - 1)
+        exists = sortedKeys[found] == wayKeys
+        following[exists] = order[found[exists]]
+
+    # each ring is walked from its lowest side
+    linked = np.flatnonzero(following >= 0)
+    ring = unionRuns(count, linked, following[linked])
+    distance = chainDistances(np.where(following == ring, -1, following))[1]
+    order = np.lexsort((-distance, ring))
+    ringStarts = np.flatnonzero(np.append(True, ring[order][1:] != ring[order][:-1])) \
+        if count else np.zeros(0, dtype=np.int64)
+
+    loopCount = loopArcs.size
+    return (np.concatenate([loopArcs, sideArcs[order]]),
+        np.concatenate([loopReverse, reverse[order]]),
+        np.concatenate([np.arange(loopCount), loopCount + ringStarts,
+            [loopCount + count]]),
+        np.concatenate([loopRegions, regions[order][ringStarts]]))
+
+
+def ringPoints(rings, simplified):
+    """
+    Joins the (simplified) arcs of every ring into closed rings of points
+
+    Args:
+        rings, rings from assembleRings
+        simplified, (points, offsets) of the arcs from simplifyArcs
+    Returns:
+        (points, offsets) arrays: the points of every ring, ring after
+        ring, and where each ring starts (plus the total)
+    """
+    ringArcs, ringReverse, ringOffsets, ringRegions = rings
+    points, offsets = simplified
+    # every arc but the first of a ring leaves out its first point (the
+    # previous arc's last)
+    skip = np.ones(ringArcs.size, dtype=np.int64)
+    skip[ringOffsets[:-1]] = 0
+    lengths = offsets[ringArcs + 1] - offsets[ringArcs] - skip
+    positions, element = spanIndices(skip, skip + lengths)
+    arcs = ringArcs[element]
+    indices = np.where(ringReverse[element], offsets[arcs + 1] - 1 - positions,
+        offsets[arcs] + positions)
+    ringLengths = np.add.reduceat(lengths, ringOffsets[:-1]) if ringArcs.size \
+        else np.zeros(0, dtype=np.int64)
+    return points[indices], np.concatenate([[0], np.cumsum(ringLengths)])
+
+
+def signedArea(points):
+    """
+    Gets the signed area of a closed ring (negative for a region's outer
+    boundary on the grid of cell corners, where y runs south)
+    """
+    x, y = points[:, 0], points[:, 1]
+    return 0.5 * np.sum(x[:-1] * y[1:] - x[1:] * y[:-1])
+
+
+def signedAreas(points, offsets):
+    """
+    Gets the signed areas (see signedArea) of rings, ring after ring (as
+    from ringPoints)
+    """
+    if offsets.size < 2:
+        return np.zeros(0)
+    x, y = points[:, 0], points[:, 1]
+    terms = np.append(x[:-1] * y[1:] - x[1:] * y[:-1], 0)
+    terms[offsets[1:] - 1] = 0 # (from one ring's last point to the next's first)
+    return 0.5 * np.add.reduceat(terms, offsets[:-1])
+
+
+def ringWkb(points, geotransform):
+    """
+    Encodes grid corner points as a (little-endian) WKB linear ring, in map
+    coordinates
+    """
+    x0, xres, _, y0, _, yres = geotransform
+    coordinates = np.empty((len(points), 2))
+    coordinates[:, 0] = x0 + points[:, 0] * xres
+    coordinates[:, 1] = y0 + points[:, 1] * yres
+    return np.uint32(len(points)).tobytes() + coordinates.astype('<f8').tobytes()
+
+
+def polygonWkb(rings):
+    """
+    Encodes WKB linear rings (outer ring first) as a WKB polygon
+    """
+    return b'\x01' + np.uint32(ogr.wkbPolygon).tobytes() \
+        + np.uint32(len(rings)).tobytes() + b''.join(rings)
+
+
+def regionGeometry(rings, geotransform):
+    """
+    Makes an OGR polygon from a region's rings (outer boundary first, then
+    holes); in the unexpected case of several outer boundaries, each hole
+    goes to the smallest outer boundary around it, in a multipolygon
+    """
+    areas = [signedArea(points) for points in rings]
+    outers = [points for points, area in zip(rings, areas) if area < 0]
+    holes = [points for points, area in zip(rings, areas) if area > 0]
+    if len(outers) == 1:
+        return ogr.CreateGeometryFromWkb(polygonWkb([ringWkb(points, geotransform)
+            for points in outers + holes]))
+
+    polygons = [(points.min(axis=0), points.max(axis=0),
+        [ringWkb(points, geotransform)]) for points in outers]
+    for points in holes:
+        low, high = points.min(axis=0), points.max(axis=0)
+        around = [item for item in polygons
+            if (item[0] <= low).all() and (item[1] >= high).all()] or polygons
+        smallest = min(around, key=lambda item: np.prod(item[1] - item[0]))
+        smallest[2].append(ringWkb(points, geotransform))
+    return ogr.CreateGeometryFromWkb(b'\x01' + np.uint32(ogr.wkbMultiPolygon).tobytes()
+        + np.uint32(len(polygons)).tobytes()
+        + b''.join(polygonWkb(item[2]) for item in polygons))
+
+
+# define function to vectorize a classified raster
+
+def polygonizeClasses(inRaster, vectorOut, minArea=0, simplifyTolerance=0,
+    fieldName='class', blockRows=defaultBlockRows):
+    """
+    Vectorizes a classified raster into one polygon per connected region of
+    equal class (4-connected), storing each polygon's class in a field;
+    nodata cells aren't vectorized
+
+    Args:
+        inRaster, classified raster filename to use for input
+        vectorOut, filename to use for output
+        minArea, minimum mapping unit (map units squared): smaller regions
+            are merged into their largest neighbor (0 = keep every region)
+        simplifyTolerance, Douglas-Peucker tolerance (map units) for the
+            shared region boundaries (0 = only drop collinear corners);
+            boundaries that would cross or pass over another are kept
+            unsimplified
+        fieldName, name of the class field (its range and the number of
+            polygons of each class are saved beside the output; see
+            readVectorSummary)
+        blockRows, number of rows read per strip
+    Returns:
+        None
+    """
+    srcDS = gdal.Open(inRaster)
+    band = openBand(inRaster, srcDS)
+    width, height = band.XSize, band.YSize
+    geotransform = srcDS.GetGeoTransform()
+    cellSize = abs(geotransform[1])
+    nodata = band.GetNoDataValue()
+
+    rows, starts, ends, classes = readRuns(band, blockRows)
+    valid = classes != nodata if nodata is not None else np.ones(rows.size, dtype=bool)
+    lines, pieceStarts, pieceEnds, upperRuns, lowerRuns = linePieces(rows,
+        starts, height, width)
+
+    # join the runs of equal class that touch across row seams into regions
+    touching = (upperRuns >= 0) & (lowerRuns >= 0)
+    upper, lower = upperRuns[touching], lowerRuns[touching]
+    same = valid[upper] & (classes[upper] == classes[lower])
+    region = unionRuns(rows.size, upper[same], lower[same])
+
+    if minArea > 0:
+        # neighboring regions, across row seams and within rows
+        sameRow = np.flatnonzero(rows[1:] == rows[:-1])
+        first = np.concatenate([upper[~same], sameRow])
+        second = np.concatenate([lower[~same], sameRow + 1])
+        data = valid[first] & valid[second]
+        region = sieveRegions(region, ends - starts, valid,
+            (region[first[data]], region[second[data]]), minArea / cellSize ** 2)
+    region[~valid] = -1
+
+    segments = boundarySegments(rows, starts, ends, region, lines, pieceStarts,
+        pieceEnds, upperRuns, lowerRuns, width)
+    arcs = traceArcs(segments, width)
+    tolerance = simplifyTolerance / cellSize
+    simplified = keepTopology(simplifyArcs(arcs, tolerance),
+        (arcs['points'], arcs['offsets']), tolerance)
+
+    # every ring's WKB, from one buffer of map coordinates
+    rings = assembleRings(arcs)
+    points, offsets = ringPoints(rings, simplified)
+    areas = signedAreas(points, offsets)
+    x0, xres, _, y0, _, yres = geotransform
+    coordinates = np.empty(points.shape)
+    coordinates[:, 0] = x0 + points[:, 0] * xres
+    coordinates[:, 1] = y0 + points[:, 1] * yres
+    data = coordinates.astype('<f8').tobytes()
+    offsets = offsets.tolist()
+    ringBytes = [np.uint32(stop - start).tobytes() + data[16 * start:16 * stop]
+        for start, stop in zip(offsets[:-1], offsets[1:])]
+
+    # each region's rings, outer boundary first
+    ringRegions = rings[3]
+    order = np.lexsort((areas > 0, ringRegions))
+    regionIDs = ringRegions[order]
+    groupStarts = np.flatnonzero(np.append(True, regionIDs[1:] != regionIDs[:-1]))
+    outerCounts = np.add.reduceat((areas[order] < 0).astype(np.int64), groupStarts) \
+        if order.size else groupStarts
+    groupStops = np.append(groupStarts[1:], order.size)
+
+    sink = VectorSink(vectorOut, srcDS.GetProjection(), ogr.wkbPolygon,
+        [(fieldName, ogr.OFTInteger)], summaryFields=(fieldName,))
+    order = order.tolist()
+    for regionID, start, stop, outerCount in zip(regionIDs[groupStarts].tolist(),
+        groupStarts.tolist(), groupStops.tolist(), outerCounts.tolist()):
+        feature = sink.newFeature()
+        feature.SetField(fieldName, int(classes[regionID]))
+        if outerCount == 1:
+            feature.SetGeometry(ogr.CreateGeometryFromWkb(polygonWkb(
+                [ringBytes[i] for i in order[start:stop]])))
+        else:
+            feature.SetGeometry(regionGeometry([points[offsets[i]:offsets[i + 1]]
+                for i in order[start:stop]], geotransform))
+        sink.add(feature)
+    sink.close()
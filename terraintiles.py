@@ -0,0 +1,626 @@
+"""
+Tiled, distributed execution for the terrain analysis pipeline.
+
+Any local raster operator (one whose output cells depend only on the input
+cells within a fixed distance, e.g. slope/aspect/hillshade, which need a
+one-cell neighborhood) can run tiled: the input raster is cut into tiles
+with an overlap halo as wide as the operator's neighborhood, each tile is
+processed as a task, and the tiles' interiors are stitched into the full
+outputs, seamlessly (every output cell sees exactly the neighbors it would
+in one full-size run).
+
+Tasks go through a job queue kept on the filesystem (a folder of pending,
+running and done task files, claimed by atomic renames), standing in for a
+cluster scheduler: the stage starts a pool of local worker processes, and
+workers on other machines that share the filesystem can join with
+    python terraintiles.py worker <queue folder>
+
+Depression filling isn't local (a depression can span any number of tiles),
+so it keeps its own tiled algorithm instead, re-flooding tiles from their
+neighbors' border levels until they agree (see fillTiled).
+
+Local operators' outputs for a large area can also be clipped to the
+project areas inside it (see clipRasters), with the same cells as a run
+over each area (away from the area's edges); terrainbatch.py does this to
+share the work of overlapping areas.
+"""
+import argparse
+import importlib
+import os
+import pickle
+import shutil
+import socket
+import sys
+import time
+import traceback
+import uuid
+
+import numpy as np
+try:
+    from osgeo import gdal
+except ImportError:
+    gdal = None
+
+from terrainengine import BandHistogram, createRaster, defaultBlockRows, \
+    defaultRasterFormat, finishRaster, openBand
+from terrainhydrology import tileWindows
+from terrainpipeline import Stage, companionFiles, removeDataset, \
+    workerContext
+
+# default tile size (cells) for tiled stages
+defaultTileSize = 2048
+
+# seconds between checks of the job queue
+queuePollSeconds = 0.5
+
+# seconds after which a claimed task is requeued (its worker presumably died),
+# and after which waiting gives up if none of the tasks has been claimed or
+# finished in the meantime (no worker is left to run them)
+queueStaleSeconds = 3600
+
+# bins of the histogram used to recompute the statistics of stitched outputs
+stitchHistogramBins = 4096
+
+
+# define the filesystem job queue
+
+class JobQueue:
+    """
+    Job queue kept in a folder on a (possibly shared) filesystem: a task is a
+    pickle in pending/, claimed by renaming it into running/ (a rename is
+    atomic, so two workers never claim the same task) and finished by
+    writing its result to done/
+
+    Args:
+        queue_folder, folder for the queue
+    """
+
+    def __init__(self, queue_folder):
+        self.queue_folder = queue_folder
+        for state in ('pending', 'running', 'done'):
+            os.makedirs(os.path.join(queue_folder, state), exist_ok=True)
+
+    def path(self, state, taskId):
+        """
+        Gets the filename of a task in a state
+        """
+        return os.path.join(self.queue_folder, state, taskId + '.task')
+
+    def submit(self, func, args=(), kwargs=None):
+        """
+        Adds a task to the queue
+
+        Args:
+            func, importable function (or its 'module.function' name)
+            args, kwargs, arguments for func (must pickle)
+        Returns:
+            task ID
+        """
+        if not isinstance(func, str):
+            func = func.__module__ + '.' + func.__qualname__
+        # IDs sort in submission order, so tasks are claimed first in, first out
+        taskId = '%020d_%s' % (time.time_ns(), uuid.uuid4().hex[:8])
+        tmp_fn = os.path.join(self.queue_folder, taskId + '.tmp')
+        with open(tmp_fn, 'wb') as f:
+            pickle.dump({'func':func, 'args':tuple(args),
+                'kwargs':dict(kwargs or {})}, f)
+        os.replace(tmp_fn, self.path('pending', taskId))
+        return taskId
+
+    def claim(self):
+        """
+        Claims the oldest pending task
+
+        Returns:
+            (task ID, task dict), or None if no task is pending
+        """
+        for name in sorted(os.listdir(os.path.join(self.queue_folder, 'pending'))):
+            taskId = name[:-len('.task')]
+            try:
+                os.rename(self.path('pending', taskId), self.path('running', taskId))
+            except OSError:
+                continue # another worker got it first
+            os.utime(self.path('running', taskId)) # when it was claimed
+            with open(self.path('running', taskId), 'rb') as f:
+                return taskId, pickle.load(f)
+        return None
+
+    def complete(self, taskId, error=None):
+        """
+        Marks a claimed task done (with the traceback if it failed)
+        """
+        tmp_fn = os.path.join(self.queue_folder, taskId + '.tmp')
+        with open(tmp_fn, 'wb') as f:
+            pickle.dump({'error':error, 'worker':socket.gethostname()}, f)
+        os.replace(tmp_fn, self.path('done', taskId))
+        try:
+            os.remove(self.path('running', taskId))
+        except OSError:
+            pass # requeued as stale in the meantime
+
+    def requeueStale(self, maxSeconds):
+        """
+        Moves tasks claimed longer than maxSeconds ago (e.g. by a worker that
+        died) back to pending
+        """
+        running_folder = os.path.join(self.queue_folder, 'running')
+        for name in os.listdir(running_folder):
+            taskId = name[:-len('.task')]
+            try:
+                if time.time() - os.path.getmtime(self.path('running', taskId)) \
+                    > maxSeconds:
+                    os.rename(self.path('running', taskId),
+                        self.path('pending', taskId))
+            except OSError:
+                pass # finished (or requeued) in the meantime
+
+    def wait(self, taskIds, staleSeconds=queueStaleSeconds, workers=()):
+        """
+        Waits for tasks to finish, then clears their results
+
+        Args:
+            taskIds, IDs of the tasks to wait for
+            staleSeconds, requeue tasks claimed longer ago than this, and stop
+                with an error once none of the tasks has been running or
+                finished for this long (None = wait forever)
+            workers, local worker processes; waiting stops with an error if
+                they've all exited while tasks are still pending
+        Returns:
+            None (raises RuntimeError if any task failed, or no worker is
+            left to run them)
+        """
+        remaining = set(taskIds)
+        errors = []
+        lastProgress = time.time()
+        while remaining:
+            for taskId in list(remaining):
+                done_fn = self.path('done', taskId)
+                if os.path.isfile(done_fn):
+                    with open(done_fn, 'rb') as f:
+                        result = pickle.load(f)
+                    os.remove(done_fn)
+                    remaining.discard(taskId)
+                    lastProgress = time.time()
+                    if result['error'] is not None:
+                        errors.append(result['error'])
+                elif os.path.isfile(self.path('running', taskId)):
+                    lastProgress = time.time()
+            if errors:
+                raise RuntimeError('tile task failed:\n' + errors[0])
+            if remaining:
+                if workers and not any(worker.is_alive() for worker in workers):
+                    raise RuntimeError('the local workers exited with tasks '
+                        'still queued')
+                if staleSeconds is not None:
+                    if time.time() - lastProgress > staleSeconds:
+                        raise RuntimeError('no worker has run a task in '
+                            + str(staleSeconds) + ' seconds, with '
+                            + str(len(remaining)) + ' still queued')
+                    self.requeueStale(staleSeconds)
+                time.sleep(queuePollSeconds)
+
+
+def resolveFunction(funcName):
+    """
+    Imports a function from its 'module.function' name
+    """
+    moduleName, name = funcName.rsplit('.', 1)
+    return getattr(importlib.import_module(moduleName), name)
+
+
+def runWorker(queue_folder, idleSeconds=None, stop_fn=None):
+    """
+    Runs tasks from a job queue until it's been idle for idleSeconds
+    (None = forever) or a file named 'stop' appears in the queue folder
+    (or stop_fn, if given, appears); a task that's running is finished first
+
+    Args:
+        queue_folder, folder of the job queue
+        idleSeconds, how long to wait for new tasks before exiting
+        stop_fn, optional file that stops just this worker
+    Returns:
+        number of tasks run
+    """
+    queue = JobQueue(queue_folder)
+    stop_fns = [os.path.join(queue_folder, 'stop')]
+    if stop_fn is not None:
+        stop_fns.append(stop_fn)
+    count, idleSince = 0, time.time()
+    while not any(os.path.exists(data_fn) for data_fn in stop_fns):
+        claimed = queue.claim()
+        if claimed is None:
+            if idleSeconds is not None and time.time() - idleSince > idleSeconds:
+                break
+            time.sleep(queuePollSeconds)
+            continue
+
+        taskId, task = claimed
+        error = None
+        try:
+            resolveFunction(task['func'])(*task['args'], **task['kwargs'])
+        except Exception:
+            error = traceback.format_exc()
+        queue.complete(taskId, error)
+        count += 1
+        idleSince = time.time()
+    return count
+
+
+def startLocalWorkers(queue_folder, stop_fn, count=None, idleSeconds=None):
+    """
+    Starts worker processes on this machine for a job queue
+
+    Args:
+        queue_folder, folder of the job queue
+        stop_fn, file that stops these workers (see stopLocalWorkers); it
+            must not exist yet
+        count, number of workers (None or 0 = one per CPU)
+        idleSeconds, how long each waits for new tasks before exiting
+    Returns:
+        list of processes (stop them with stopLocalWorkers)
+    """
+    context = workerContext()
+    workers = [context.Process(target=runWorker,
+        args=(queue_folder, idleSeconds, stop_fn))
+        for i in range(count or os.cpu_count() or 1)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def stopLocalWorkers(workers, stop_fn):
+    """
+    Stops local worker processes once each finishes the task it's running
+    (which may belong to another run on a shared queue, so they aren't
+    killed) and waits for them to exit
+
+    Args:
+        workers, processes from startLocalWorkers
+        stop_fn, the stop file they were started with
+    Returns:
+        None
+    """
+    open(stop_fn, 'w').close()
+    for worker in workers:
+        worker.join()
+    os.remove(stop_fn)
+
+
+# define functions to cut rasters into haloed tiles (or clip them to an
+# area) and stitch them back
+
+def haloWindow(window, halo, width, height):
+    """
+    Grows a tile window by a halo, clipped to the raster's edges
+
+    Returns:
+        (col0, row0, cols, rows) window
+    """
+    col0, row0, cols, rows = window
+    haloCol0, haloRow0 = max(col0 - halo, 0), max(row0 - halo, 0)
+    haloCol1 = min(col0 + cols + halo, width)
+    haloRow1 = min(row0 + rows + halo, height)
+    return haloCol0, haloRow0, haloCol1 - haloCol0, haloRow1 - haloRow0
+
+
+def cutTile(raster_fn, tile_fn, window):
+    """
+    Copies a window of a raster to a tile raster (GeoTIFF)
+
+    Args:
+        raster_fn, raster to cut from
+        tile_fn, filename to use for the tile
+        window, (col0, row0, cols, rows) window to copy
+    Returns:
+        None
+    """
+    col0, row0, cols, rows = window
+    srcDS = gdal.Open(raster_fn)
+    srcBand = openBand(raster_fn, srcDS)
+    gt = srcDS.GetGeoTransform()
+    tileGT = (gt[0] + col0 * gt[1] + row0 * gt[2], gt[1], gt[2],
+        gt[3] + col0 * gt[4] + row0 * gt[5], gt[4], gt[5])
+    nodata = srcBand.GetNoDataValue()
+    tileDS = createRaster(tile_fn, cols, rows, tileGT, srcDS.GetProjection(),
+        srcBand.DataType, nodata, 'GTiff')
+    tileDS.GetRasterBand(1).WriteArray(srcBand.ReadAsArray(col0, row0, cols, rows))
+    tileDS = None
+
+
+def clipWindow(srcDS, extent):
+    """
+    Gets the window of a raster's cells that covers an extent (snapped
+    outward to whole cells and clipped to the raster's edges)
+
+    Args:
+        srcDS, GDAL dataset of the raster
+        extent, (xmin, ymin, xmax, ymax) in the raster's CRS
+    Returns:
+        (col0, row0, cols, rows) window
+    """
+    gt = srcDS.GetGeoTransform()
+    col0 = int(np.floor((extent[0] - gt[0]) / gt[1] + 1e-6))
+    col1 = int(np.ceil((extent[2] - gt[0]) / gt[1] - 1e-6))
+    row0 = int(np.floor((extent[3] - gt[3]) / gt[5] + 1e-6))
+    row1 = int(np.ceil((extent[1] - gt[3]) / gt[5] - 1e-6))
+    col0, row0 = max(col0, 0), max(row0, 0)
+    col1, row1 = min(col1, srcDS.RasterXSize), min(row1, srcDS.RasterYSize)
+    if col1 <= col0 or row1 <= row0:
+        raise ValueError('the extent ' + str(tuple(extent))
+            + ' does not overlap the raster')
+    return col0, row0, col1 - col0, row1 - row0
+
+
+def clipRasters(raster_fns, out_fns, extent, rasterFormat=defaultRasterFormat,
+    resampling=None):
+    """
+    Clips rasters to the cells covering an extent, e.g. a project area's DEM
+    and derivatives from ones computed once for a larger shared area; the
+    statistics of rasters that carry them (see BandHistogram) are recomputed
+    for the clipped cells
+
+    Args:
+        raster_fns, rasters to clip from
+        out_fns, filenames to use for output, one per raster
+        extent, (xmin, ymin, xmax, ymax) to clip to
+        rasterFormat, output format (see createRaster)
+        resampling, optional dict of output -> overview resampling method
+            (default NEAREST)
+    Returns:
+        None
+    """
+    for raster_fn, out_fn in zip(raster_fns, out_fns):
+        srcDS = gdal.Open(raster_fn)
+        srcBand = openBand(raster_fn, srcDS)
+        gdalBand = srcDS.GetRasterBand(1)
+        nodata = gdalBand.GetNoDataValue()
+        col0, row0, cols, rows = clipWindow(srcDS, extent)
+        gt = srcDS.GetGeoTransform()
+        clipGT = (gt[0] + col0 * gt[1] + row0 * gt[2], gt[1], gt[2],
+            gt[3] + col0 * gt[4] + row0 * gt[5], gt[4], gt[5])
+        outDS = createRaster(out_fn, cols, rows, clipGT, srcDS.GetProjection(),
+            gdalBand.DataType, nodata, rasterFormat)
+        outBand = outDS.GetRasterBand(1)
+
+        # the range of the histogram comes from the source's statistics
+        srcStats = gdalBand.GetMetadata()
+        histogram = None
+        if 'STATISTICS_MINIMUM' in srcStats:
+            low = float(srcStats['STATISTICS_MINIMUM'])
+            high = float(srcStats['STATISTICS_MAXIMUM'])
+            histogram = BandHistogram(low, max(high, low + 1e-6),
+                stitchHistogramBins)
+
+        for blockRow0 in range(0, rows, defaultBlockRows):
+            blockRows = min(defaultBlockRows, rows - blockRow0)
+            block = srcBand.ReadAsArray(col0, row0 + blockRow0, cols, blockRows)
+            outBand.WriteArray(block, 0, blockRow0)
+            if histogram is not None:
+                values = block.astype(np.float64)
+                if nodata is not None:
+                    values[values == nodata] = np.nan
+                histogram.add(values)
+
+        if histogram is not None:
+            histogram.writeStatistics(outBand)
+        outBand = outDS = srcBand = gdalBand = srcDS = None
+        finishRaster(out_fn, rasterFormat, (resampling or {}).get(out_fn, 'NEAREST'))
+
+
+def stitchTiles(tiles, raster_fn, srcDS, rasterFormat=defaultRasterFormat,
+    resampling='NEAREST', base_fn=None):
+    """
+    Stitches the interiors of tile rasters into one raster, or patches them
+    into a copy of an existing raster; if the tiles carry statistics (see
+    BandHistogram), the output's statistics are recomputed once it's written
+
+    Args:
+        tiles, list of (window, halo window, tile filename)
+        raster_fn, filename to use for output
+        srcDS, GDAL dataset whose grid the output uses
+        rasterFormat, output format (see createRaster)
+        resampling, overview resampling method
+        base_fn, optional raster (on srcDS's grid) to fill the cells outside
+            the tiles from; it may be raster_fn itself, which is replaced
+    Returns:
+        None
+    """
+    firstBand = gdal.Open(tiles[0][2]).GetRasterBand(1)
+    nodata = firstBand.GetNoDataValue()
+    width, height = srcDS.RasterXSize, srcDS.RasterYSize
+
+    # the range of the histogram comes from the tiles' (and base's) statistics
+    statsSources = [tile_fn for window, haloWin, tile_fn in tiles]
+    if base_fn is not None:
+        statsSources.append(base_fn)
+    stats = [gdal.Open(data_fn).GetRasterBand(1).GetMetadata()
+        for data_fn in statsSources]
+    histogram = None
+    if all('STATISTICS_MINIMUM' in tileStats for tileStats in stats):
+        low = min(float(tileStats['STATISTICS_MINIMUM']) for tileStats in stats)
+        high = max(float(tileStats['STATISTICS_MAXIMUM']) for tileStats in stats)
+        histogram = BandHistogram(low, max(high, low + 1e-6), stitchHistogramBins)
+
+    # write to a new file when patching a raster in place (the old one may
+    # be hard-linked into the stage cache, so it must not be modified)
+    out_fn = raster_fn
+    if base_fn is not None and os.path.abspath(base_fn) == os.path.abspath(raster_fn):
+        stem, ext = os.path.splitext(raster_fn)
+        out_fn = stem + '_patch' + ext
+    outDS = createRaster(out_fn, width, height, srcDS.GetGeoTransform(),
+        srcDS.GetProjection(), firstBand.DataType, nodata, rasterFormat)
+    outBand = outDS.GetRasterBand(1)
+
+    if base_fn is not None:
+        baseBand = openBand(base_fn)
+        for row0 in range(0, height, defaultBlockRows):
+            rows = min(defaultBlockRows, height - row0)
+            outBand.WriteArray(baseBand.ReadAsArray(0, row0, width, rows), 0, row0)
+        baseBand = None
+
+    for (col0, row0, cols, rows), haloWin, tile_fn in tiles:
+        tileBand = gdal.Open(tile_fn).GetRasterBand(1)
+        outBand.WriteArray(tileBand.ReadAsArray(col0 - haloWin[0],
+            row0 - haloWin[1], cols, rows), col0, row0)
+
+    if histogram is not None:
+        outBand.FlushCache()
+        for row0 in range(0, height, defaultBlockRows):
+            values = outBand.ReadAsArray(0, row0, width,
+                min(defaultBlockRows, height - row0)).astype(np.float64)
+            if nodata is not None:
+                values[values == nodata] = np.nan
+            histogram.add(values)
+        histogram.writeStatistics(outBand)
+    outBand = outDS = None
+    finishRaster(out_fn, rasterFormat, resampling)
+
+    if out_fn != raster_fn:
+        replaceDataset(out_fn, raster_fn)
+
+
+def replaceDataset(new_fn, data_fn):
+    """
+    Replaces a dataset (and its sidecar files) with another one, renaming
+    the new one's files to the old one's name
+    """
+    removeDataset(data_fn)
+    newStem = os.path.splitext(os.path.basename(new_fn))[0]
+    stem = os.path.splitext(os.path.basename(data_fn))[0]
+    for fn in companionFiles(new_fn):
+        folder, name = os.path.split(fn)
+        os.replace(fn, os.path.join(os.path.dirname(data_fn), stem + name[len(newStem):]))
+
+
+# define functions to run a stage tiled
+
+def replacePaths(value, paths):
+    """
+    Replaces filepaths inside stage arguments (paths is a dict of old -> new)
+    """
+    if isinstance(value, str):
+        return paths.get(value, value)
+    if isinstance(value, dict):
+        return {k: replacePaths(v, paths) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(replacePaths(v, paths) for v in value)
+    return value
+
+
+def runTiled(funcName, args, kwargs, inputs, outputs, halo,
+    tileSize=defaultTileSize, queue_folder=None, localWorkers=None,
+    staleSeconds=queueStaleSeconds, resampling=None):
+    """
+    Runs a local raster operator tile by tile on a job queue and stitches
+    its outputs. Each input is cut into haloed tiles on the grid of the
+    first input, the operator runs once per tile (with its input and output
+    filepaths swapped for the tiles'), and each output is stitched from the
+    tiles' interiors. Output rasters are written in the format given by the
+    operator's rasterFormat argument (tiles are always plain GeoTIFFs).
+
+    Args:
+        funcName, 'module.function' name of the operator
+        args, kwargs, arguments for the operator
+        inputs, input rasters (all on the same grid)
+        outputs, output rasters (on the inputs' grid)
+        halo, cells of overlap the operator needs around each tile
+        tileSize, tile size (cells)
+        queue_folder, folder for the job queue and the tiles (on a filesystem
+            shared with any remote workers)
+        localWorkers, local worker processes to start (None or 0 = one per
+            CPU; remote workers can join the queue as well)
+        staleSeconds, requeue tile tasks claimed longer ago than this, and
+            give up once none has run for this long (see JobQueue.wait)
+        resampling, optional dict of output -> overview resampling method
+            (default NEAREST)
+    Returns:
+        None
+    """
+    srcDS = gdal.Open(inputs[0])
+    width, height = srcDS.RasterXSize, srcDS.RasterYSize
+    if queue_folder is None:
+        queue_folder = os.path.join(os.path.dirname(outputs[0]), 'queue')
+    tiles_folder = os.path.join(queue_folder, 'tiles', uuid.uuid4().hex)
+    rasterFormat = kwargs.get('rasterFormat', defaultRasterFormat)
+
+    queue = JobQueue(queue_folder)
+    os.makedirs(tiles_folder)
+    stop_fn = os.path.join(tiles_folder, 'stop')
+    workers = startLocalWorkers(queue_folder, stop_fn, localWorkers)
+    try:
+        tiles = {data_fn: [] for data_fn in outputs}
+        taskIds = []
+        for i, window in enumerate(tileWindows(width, height, tileSize)):
+            haloWin = haloWindow(window, halo, width, height)
+            tile_folder = os.path.join(tiles_folder, str(i))
+            os.makedirs(tile_folder)
+
+            paths = {}
+            for data_fn in inputs:
+                paths[data_fn] = os.path.join(tile_folder, 'in_'
+                    + os.path.splitext(os.path.basename(data_fn))[0] + '.tif')
+                cutTile(data_fn, paths[data_fn], haloWin)
+            for data_fn in outputs:
+                paths[data_fn] = os.path.join(tile_folder, 'out_'
+                    + os.path.splitext(os.path.basename(data_fn))[0] + '.tif')
+                tiles[data_fn].append((window, haloWin, paths[data_fn]))
+
+            tileKwargs = replacePaths(kwargs, paths)
+            if 'rasterFormat' in kwargs:
+                tileKwargs['rasterFormat'] = 'GTiff'
+            taskIds.append(queue.submit(funcName, replacePaths(args, paths),
+                tileKwargs))
+
+        queue.wait(taskIds, staleSeconds, workers)
+    finally:
+        stopLocalWorkers(workers, stop_fn)
+
+    for data_fn in outputs:
+        stitchTiles(tiles[data_fn], data_fn, srcDS, rasterFormat,
+            (resampling or {}).get(data_fn, 'NEAREST'))
+    shutil.rmtree(tiles_folder, ignore_errors=True)
+
+
+def tiledStage(stage, halo, tileSize=defaultTileSize, queue_folder=None,
+    localWorkers=None, staleSeconds=queueStaleSeconds, resampling=None):
+    """
+    Wraps a pipeline stage (a local raster operator) so it runs tiled on a
+    job queue (see runTiled); the wrapped stage runs in the calling process,
+    since it only cuts, queues and stitches while the workers compute
+
+    Args:
+        stage, Stage to wrap (its inputs and outputs must be rasters on one grid)
+        halo, tileSize, queue_folder, localWorkers, staleSeconds, resampling,
+            see runTiled
+    Returns:
+        Stage
+    """
+    funcName = stage.func.__module__ + '.' + stage.func.__qualname__
+    return Stage(stage.name, runTiled,
+        args = (funcName, stage.args, stage.kwargs, stage.inputs, stage.outputs,
+            halo),
+        kwargs = {'tileSize':tileSize, 'queue_folder':queue_folder,
+            'localWorkers':localWorkers, 'staleSeconds':staleSeconds,
+            'resampling':resampling},
+        inputs = stage.inputs, outputs = stage.outputs, enabled = stage.enabled,
+        mainProcess = True, onComplete = stage.onComplete)
+
+
+def main(argv=None):
+    """
+    Runs a worker for a job queue (e.g. on another machine sharing the
+    filesystem)
+    """
+    parser = argparse.ArgumentParser(description='Run tile tasks from a '
+        'terrain analysis job queue.')
+    parser.add_argument('command', choices=['worker'])
+    parser.add_argument('queue_folder', help='folder of the job queue')
+    parser.add_argument('--idle', type=float, default=None, help='exit after '
+        'this many seconds without tasks (default: run until a "stop" file '
+        'appears in the queue folder)')
+    args = parser.parse_args(argv)
+    print('tasks run:', runWorker(args.queue_folder, args.idle))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,8 @@
+"""
+Shared setup for the tests: the terrain modules live at the top of the
+repository.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
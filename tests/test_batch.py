@@ -0,0 +1,27 @@
+"""
+Tests of how a batch's areas are grouped into shared runs.
+"""
+from terrainbatch import batchJobs, clusterAreas, coveredArea
+
+
+def test_coveredArea_counts_overlaps_once():
+    assert coveredArea([(0, 0, 10, 10), (5, 5, 15, 15)]) == 175
+
+
+def test_clusterAreas_keeps_far_and_sparse_areas_apart():
+    aois = [(0, 0, 10, 10), (5, 5, 15, 15), # overlapping
+        (100, 0, 110, 10), # on its own
+        (0, 0, 1, 100), (0, 99, 100, 100)] # overlapping, but their box is empty
+    assert sorted(clusterAreas(aois)) == [[0, 1], [2], [3], [4]]
+
+
+def test_batchJobs_shares_a_run_per_cluster(tmp_path):
+    areas = [{'name':'a', 'AOI':[0, 0, 10, 10]},
+        {'name':'b', 'AOI':[5, 5, 15, 15]},
+        {'name':'c', 'AOI':[100, 0, 110, 10]}]
+    shared, configs = batchJobs({'DEM_folder':str(tmp_path)}, areas, str(tmp_path))
+    assert len(shared) == 1
+    assert tuple(shared[0]['AOI']) == (0, 0, 15, 15)
+    assert configs[0]['shared_folder'] == configs[1]['shared_folder'] \
+        == shared[0]['analysis_folder']
+    assert configs[2]['shared_folder'] is None
@@ -0,0 +1,45 @@
+"""
+Tests of the class tables and of the joining of contour pieces at strip seams.
+"""
+import numpy as np
+
+from terrainengine import classNodata, classifyValues, compassClassTable, \
+    joinSeamLines, slopeClassTable
+
+
+def test_classifyValues_slope_bounds_are_inclusive():
+    table = slopeClassTable([5, 10, 15, 20, 30, float('inf')])
+    values = np.array([0, 5, 5.001, 10, 30, 31, 1e6, np.nan, -1])
+    assert classifyValues(values, table).tolist() == \
+        [1, 1, 2, 2, 5, 6, 6, classNodata, classNodata]
+
+
+def test_classifyValues_compass_wraps_around_north():
+    table = compassClassTable(8)
+    values = np.array([0, 22.49, 22.5, 90, 180, 292.5, 337.49, 337.5, 359.9,
+        np.nan])
+    assert classifyValues(values, table).tolist() == \
+        [1, 1, 2, 3, 5, 8, 8, 1, 1, classNodata]
+
+
+def test_joinSeamLines_joins_pieces_across_the_seam():
+    above = [(0.0, 5.0), (1.0, 0.0)]
+    below = [(2.0, -5.0), (1.0, 0.0)] # drawn the other way
+    assert joinSeamLines([above, below], 0.0, 1e-6) == \
+        [[(0.0, 5.0), (1.0, 0.0), (2.0, -5.0)]]
+
+
+def test_joinSeamLines_closes_rings():
+    above = [(0.0, 0.0), (1.0, 1.0), (2.0, 0.0)]
+    below = [(0.0, 0.0), (1.0, -1.0), (2.0, 0.0)]
+    [ring] = joinSeamLines([above, below], 0.0, 1e-6)
+    assert len(ring) == 5 and ring[0] == ring[-1]
+
+
+def test_joinSeamLines_leaves_other_lines_alone():
+    lines = [[(5.0, 0.0), (6.0, 1.0)], # ends on the seam, but meets nothing
+        [(9.0, 9.0), (8.0, 8.0)], # off the seam
+        [(3.0, 2.0), (2.0, 0.0)], [(2.0, 1e-9), (1.0, -1.0)]] # within tolerance
+    joined = joinSeamLines(lines, 0.0, 1e-6)
+    assert sorted(map(len, joined)) == [2, 2, 3]
+    assert [(3.0, 2.0), (2.0, 0.0), (1.0, -1.0)] in joined
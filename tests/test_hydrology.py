@@ -0,0 +1,180 @@
+"""
+Tests of the fill and drainage cores on small synthetic DEMs.
+"""
+import heapq
+
+import numpy as np
+import pytest
+
+import terrainhydrology
+
+
+from terrainengine import MappedBand, demNodata
+from terrainhydrology import edgeCells, fillArray, fillTiled, flowDirections, \
+    neighborSteps, padded, priorityFlood, receivers, routeFlow
+
+
+class ArrayBand:
+    """
+    Output band that writes into an in-memory array
+    """
+
+    def __init__(self, shape):
+        self.array = np.full(shape, demNodata, dtype=np.float32)
+
+    def WriteArray(self, values, col0, row0):
+        self.array[row0:row0 + values.shape[0], col0:col0 + values.shape[1]] = values
+
+
+def syntheticDEM(size, seed=0):
+    """
+    Makes a rough surface full of depressions, with a nodata hole
+    """
+    rng = np.random.default_rng(seed)
+    dem = np.cumsum(np.cumsum(rng.normal(size=(size, size)), 0), 1) / 50
+    dem += rng.normal(scale=2, size=(size, size))
+    dem[size // 3:size // 3 + 20, size // 2:size // 2 + 15] = np.nan
+    # float32 values, as read back from a float32 raster
+    return dem.astype(np.float32).astype(np.float64)
+
+
+def interiorFlats(filled):
+    """
+    Counts the cells with no lower neighbor that aren't outlets (cells on
+    the DEM's edge or next to nodata)
+    """
+    outlet = np.zeros((filled.shape[0] + 2, filled.shape[1] + 2), dtype=bool)
+    outlet.flat[edgeCells(~np.isnan(padded(filled)))] = True
+    flats = (flowDirections(filled, 1.0) == 0) & ~np.isnan(filled)
+    return int((flats & ~outlet[1:-1, 1:-1]).sum())
+
+
+def fillNodata32(filled):
+    """
+    Converts a fill to the output type, with the DEM nodata value
+    """
+    return np.where(np.isnan(filled), demNodata, filled).astype(np.float32)
+
+
+def heapFlood(z, seeds, seedLevels, steps):
+    """
+    Runs the priority flood the textbook way, popping one cell at a time
+    off a heap
+    """
+    level = np.full(z.shape, np.inf)
+    level[seeds] = seedLevels
+    heap = [(level[cell], cell) for cell in seeds]
+    heapq.heapify(heap)
+    while heap:
+        cellLevel, cell = heapq.heappop(heap)
+        if cellLevel > level[cell]:
+            continue
+        for offset, rise in steps:
+            neighbor = cell + offset
+            neighborLevel = max(z[neighbor], cellLevel + rise)
+            if neighborLevel < level[neighbor]: # (false for nodata)
+                level[neighbor] = neighborLevel
+                heapq.heappush(heap, (neighborLevel, neighbor))
+    return level
+
+
+def floodInputs(dem, minSlope):
+    """
+    Gets priorityFlood's arguments for filling a DEM array from its outlets
+    """
+    work = padded(dem).ravel()
+    seeds = edgeCells(~np.isnan(work.reshape(dem.shape[0] + 2, -1)))
+    return work, seeds, work[seeds], neighborSteps(dem.shape[1] + 2, 1.0, minSlope)
+
+
+def walkedFlow(downstream):
+    """
+    Accumulates flow and Strahler order the slow way: each cell adds itself
+    to every cell on its path downstream, and a cell's order follows from
+    its donors' (visited once all of them are done)
+    """
+    size = downstream.size
+    accumulation = np.zeros(size, dtype=np.int64)
+    for cell in range(size):
+        while cell >= 0:
+            accumulation[cell] += 1
+            cell = downstream[cell]
+
+    donors = [[] for _ in range(size)]
+    for cell in range(size):
+        if downstream[cell] >= 0:
+            donors[downstream[cell]].append(cell)
+    order = np.zeros(size, dtype=np.int64)
+    stack = list(range(size))
+    while stack:
+        cell = stack[-1]
+        pending = [donor for donor in donors[cell] if order[donor] == 0]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        orders = [order[donor] for donor in donors[cell]]
+        highest = max(orders, default=1)
+        order[cell] = highest + (orders.count(highest) >= 2)
+    return accumulation, order
+
+
+def test_routeFlow_counts_a_confluence():
+    # cells 0 and 1 join at 2, which drains with 3 into 4
+    downstream = np.array([2, 2, 4, 4, -1])
+    accumulation, order = routeFlow(downstream)
+    assert accumulation.tolist() == [1, 1, 3, 1, 5]
+    assert order.tolist() == [1, 1, 2, 1, 2]
+
+
+def test_routeFlow_matches_walking_the_flow_paths():
+    filled = fillArray(syntheticDEM(60, seed=3), 1.0)
+    downstream = receivers(flowDirections(filled, 1.0), ~np.isnan(filled))
+    accumulation, order = routeFlow(downstream)
+    expectedAccumulation, expectedOrder = walkedFlow(downstream)
+    np.testing.assert_array_equal(accumulation, expectedAccumulation)
+    np.testing.assert_array_equal(order, expectedOrder)
+    assert order.max() >= 3 # the DEM has a real network
+
+
+@pytest.mark.parametrize('minSlope', [0.01, 0])
+def test_priorityFlood_matches_a_heap_flood(minSlope):
+    args = floodInputs(syntheticDEM(90, seed=1), minSlope)
+    np.testing.assert_array_equal(priorityFlood(*args), heapFlood(*args))
+
+
+def test_priorityFlood_relaxes_each_cell_a_bounded_number_of_times(monkeypatch):
+    monkeypatch.setattr(terrainhydrology, 'floodBucketRises', 4)
+    relaxed = []
+    relaxNeighbors = terrainhydrology.relaxNeighbors
+    def countingRelax(z, level, frontier, offsets, rises):
+        relaxed.append(frontier)
+        return relaxNeighbors(z, level, frontier, offsets, rises)
+    monkeypatch.setattr(terrainhydrology, 'relaxNeighbors', countingRelax)
+
+    args = floodInputs(syntheticDEM(120, seed=2), 0.01)
+    level = priorityFlood(*args)
+    counts = np.bincount(np.concatenate(relaxed), minlength=level.size)
+    assert counts.max() <= 5
+    np.testing.assert_array_equal(level, heapFlood(*args))
+
+
+def test_fillArray_leaves_no_flats():
+    filled = fillArray(syntheticDEM(120), 1.0)
+    assert interiorFlats(filled) == 0
+
+
+@pytest.mark.parametrize('size, tileSize', [(300, 64), (257, 50), (120, 37)])
+def test_fillTiled_matches_fillArray(size, tileSize):
+    dem = syntheticDEM(size)
+    expected = fillNodata32(fillArray(dem, 1.0))
+
+    band = MappedBand(np.where(np.isnan(dem), demNodata, dem).astype(np.float32),
+        demNodata, None) # (no GDAL data type needed)
+    out = ArrayBand(dem.shape)
+    fillTiled(band, out, 1.0, 0.01, tileSize)
+
+    np.testing.assert_array_equal(out.array, expected)
+    tiled = np.where(out.array == demNodata, np.nan, out.array).astype(np.float64)
+    assert interiorFlats(tiled) == 0
+
@@ -0,0 +1,136 @@
+"""
+Tests of which settings force a full run instead of an incremental patch,
+and of joining patched lines to the features they continue.
+"""
+import numpy as np
+import pytest
+
+from terrainengine import createRaster, createVectorLayer, finishRaster, gdal, \
+    joinLinkedLines, ogr, readVectorSummary
+from terrainincremental import boundaryLinks, outputSettings, patchPolygons, \
+    replaceFeatures
+from terrainjobs import jobConfig
+from terrainpipeline import Stage
+from terrainpolygons import polygonizeClasses
+
+needsGdal = pytest.mark.skipif(ogr is None, reason='needs the GDAL bindings')
+
+
+def test_outputSettings_ignore_reporting_and_run_settings(tmp_path):
+    config = jobConfig({'data_folder':str(tmp_path)})
+    toggled = dict(config, run_report=1 - config['run_report'],
+        profile_stages=['fillSinks'], worker_count=3, fill_tileSize=512)
+    assert outputSettings(toggled) == outputSettings(config)
+
+
+def test_outputSettings_keep_product_settings(tmp_path):
+    config = jobConfig({'data_folder':str(tmp_path)})
+    assert outputSettings(dict(config, desired_grain=3)) != outputSettings(config)
+
+
+def test_boundaryLinks_join_pieces_that_meet_on_the_window_edge():
+    bounds = (2, 0, 8, 10)
+    lines = [[(0, 5), (2, 5)], [(8, 5), (10, 5)], # cut back to outside
+        [(2, 5), (5, 6), (8, 5)], # the patch inside
+        [(2, 5), (4, 3)]] # another level, ending at the same point
+    groups = [10, 10, 10, 20]
+    joined = joinLinkedLines(lines, boundaryLinks(lines, groups, bounds, 1e-6))
+    assert sorted(joined) == [([(0, 5), (2, 5), (5, 6), (8, 5), (10, 5)], [0, 2, 1]),
+        ([(2, 5), (4, 3)], [3])]
+
+
+def test_boundaryLinks_close_a_ring_cut_by_the_window():
+    lines = [[(2, 4), (0, 4), (0, 6), (2, 6)], [(2, 6), (4, 5), (2, 4)]]
+    [(points, members)] = joinLinkedLines(lines,
+        boundaryLinks(lines, [1, 1], (2, 0, 8, 10), 1e-6))
+    assert points[0] == points[-1] and sorted(members) == [0, 1]
+
+
+def writeLines(vector_fn, lines):
+    """
+    Writes (ID, ELEV, points) line features to a new layer
+    """
+    ds, layer = createVectorLayer(vector_fn, '', ogr.wkbLineString,
+        [('ID', ogr.OFTInteger), ('ELEV', ogr.OFTReal)])
+    for featureId, level, points in lines:
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField('ID', featureId)
+        feature.SetField('ELEV', level)
+        line = ogr.Geometry(ogr.wkbLineString)
+        for x, y in points:
+            line.AddPoint_2D(x, y)
+        feature.SetGeometry(line)
+        layer.CreateFeature(feature)
+    layer = ds = None
+
+
+@needsGdal
+def test_replaceFeatures_joins_the_patch_to_the_features_it_continues(tmp_path):
+    contour_fn = str(tmp_path / 'contours.gpkg')
+    patch_fn = str(tmp_path / 'patch.gpkg')
+    writeLines(contour_fn, [(1, 10.0, [(0, 5), (10, 5)]),
+        (2, 20.0, [(0, 8), (10, 8)])])
+    writeLines(patch_fn, [(1, 10.0, [(1, 5), (2, 5), (5, 6), (8, 5), (9, 5)]),
+        (1, 20.0, [(1, 8), (9, 8)])])
+    replaceFeatures(contour_fn, patch_fn, (2, 0, 8, 10), 1e-6)
+
+    features = []
+    for feature in ogr.Open(contour_fn).GetLayer(0):
+        points = [point[:2] for point in feature.GetGeometryRef().GetPoints()]
+        if points[0] > points[-1]:
+            points.reverse()
+        features.append((feature.GetField('ELEV'), feature.GetField('ID'), points))
+    assert sorted(features) == [
+        (10.0, 1, [(0, 5), (2, 5), (5, 6), (8, 5), (10, 5)]),
+        (20.0, 2, [(0, 8), (2, 8), (8, 8), (10, 8)])]
+
+
+def writeClasses(raster_fn, classes):
+    """
+    Writes a class array as a Byte GeoTIFF of 1 m cells (0 = nodata)
+    """
+    outDS = createRaster(raster_fn, classes.shape[1], classes.shape[0],
+        (0, 1, 0, classes.shape[0], 0, -1), '', gdal.GDT_Byte, 0, 'GTiff')
+    outDS.GetRasterBand(1).WriteArray(classes)
+    outDS = None
+    finishRaster(raster_fn, 'GTiff')
+
+
+def layerPolygons(vector_fn):
+    """
+    Lists the class, area, envelope and perimeter of each polygon of a
+    layer, sorted
+    """
+    polygons = []
+    for feature in ogr.Open(vector_fn).GetLayer(0):
+        geometry = feature.GetGeometryRef()
+        polygons.append((feature.GetField('class'), round(geometry.GetArea(), 6),
+            tuple(round(value, 6) for value in geometry.GetEnvelope()),
+            round(geometry.Boundary().Length(), 6)))
+    return sorted(polygons)
+
+
+@needsGdal
+def test_patchPolygons_match_a_full_rebuild(tmp_path):
+    rng = np.random.default_rng(0)
+    field = rng.normal(size=(80, 80))
+    for _ in range(3):
+        field = (field + np.roll(field, 1, 0) + np.roll(field, 1, 1)) / 3
+    classes = np.digitize(field, np.quantile(field, [0.05, 0.4, 0.75])).astype(np.uint8)
+    changed = classes.copy()
+    changed[30:40, 35:45] = rng.integers(1, 4, (10, 10))
+
+    classes_fn = str(tmp_path / 'classes.tif')
+    vector_fn, full_fn = str(tmp_path / 'vector.gpkg'), str(tmp_path / 'full.gpkg')
+    kwargs = {'minArea':4, 'simplifyTolerance':1}
+    writeClasses(classes_fn, classes)
+    polygonizeClasses(classes_fn, vector_fn, **kwargs)
+    writeClasses(classes_fn, changed)
+    stage = Stage('vectorSlope', polygonizeClasses, (classes_fn, vector_fn), kwargs,
+        [classes_fn], [vector_fn])
+    assert patchPolygons(stage, (35, 30, 10, 10), (0, 80, 80, 80), 1,
+        str(tmp_path / 'work'))
+
+    polygonizeClasses(classes_fn, full_fn, **kwargs)
+    assert layerPolygons(vector_fn) == layerPolygons(full_fn)
+    assert readVectorSummary(vector_fn) == readVectorSummary(full_fn)
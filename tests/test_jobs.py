@@ -0,0 +1,49 @@
+"""
+Tests of how a job's settings are checked and its outputs named.
+"""
+import pytest
+
+from terrainhydrology import maxInMemoryFillCells
+from terrainjobs import jobConfig, jobPaths, jobStages
+
+
+def test_jobConfig_rejects_equal_base_and_index_intervals(tmp_path):
+    with pytest.raises(ValueError, match='must differ'):
+        jobConfig({'data_folder':str(tmp_path), 'baseContourInt':10,
+            'indexContourInt':10})
+    # fine when only one of them is produced
+    jobConfig({'data_folder':str(tmp_path), 'baseContourInt':10,
+        'indexContourInt':10, 'produce_indexContours':0})
+
+
+def test_jobPaths_gives_every_contour_interval_its_own_file(tmp_path):
+    config = jobConfig({'data_folder':str(tmp_path),
+        'contour_intervalSweep':[2, 5, 10, 20]})
+    contours = jobPaths(config)['contours']
+    assert sorted(contours) == [2, 5, 10, 20]
+    assert len(set(contours.values())) == 4
+
+
+def test_jobPaths_leaves_out_the_default_channels_when_only_sweeping(tmp_path):
+    config = jobConfig({'data_folder':str(tmp_path), 'produce_channels':0,
+        'channel_thresholdSweep':[3, 6]})
+    paths = jobPaths(config)
+    assert sorted(paths['channelNetworks']) == [3, 6]
+    stages = {stage.name: stage for stage in jobStages(config, paths,
+        [{'fn':str(tmp_path / 'dem.tif'), 'bounds':(0, 0, 200, 200)}])}
+    assert stages['channels'].enabled
+    assert paths['channels'] not in stages['channels'].outputs
+    assert paths['channels'] not in stages['vectorPackage'].inputs
+
+
+def test_jobStages_turns_down_drainage_too_large_for_memory(tmp_path):
+    side = 2 * (int(maxInMemoryFillCells ** 0.5) + 1) # cells at 2 m
+    tiles = [{'fn':str(tmp_path / 'dem.tif'), 'bounds':(0, 0, side, side)}]
+    config = jobConfig({'data_folder':str(tmp_path)})
+    with pytest.raises(ValueError, match='too large to compute drainage'):
+        jobStages(config, jobPaths(config), tiles)
+    # fine without channels, or within a small enough AOI
+    config = jobConfig({'data_folder':str(tmp_path), 'produce_channels':0})
+    jobStages(config, jobPaths(config), tiles)
+    config = jobConfig({'data_folder':str(tmp_path), 'AOI':(0, 0, 1000, 1000)})
+    jobStages(config, jobPaths(config), tiles)
@@ -0,0 +1,42 @@
+"""
+Tests of the LRU cache of lazily computed derivative tiles.
+"""
+import numpy as np
+
+from terrainlazy import LRUTileCache
+
+
+def tile(size):
+    """
+    Makes a tile of size bytes
+    """
+    return np.zeros(size, dtype=np.uint8)
+
+
+def test_put_evicts_the_least_recently_used_tiles():
+    cache = LRUTileCache(300)
+    for key in 'abc':
+        cache.put(key, tile(100))
+    assert cache.get('a') is not None # now the most recently used
+    cache.put('d', tile(100))
+    assert list(cache.tiles) == ['c', 'a', 'd']
+    assert cache.bytes == 300
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_put_keeps_a_new_tile_larger_than_the_limit():
+    cache = LRUTileCache(100)
+    cache.put('a', tile(50))
+    cache.put('b', tile(500))
+    assert list(cache.tiles) == ['b']
+    assert cache.bytes == 500
+
+
+def test_put_replaces_a_cached_tile():
+    cache = LRUTileCache(1000)
+    cache.put('a', tile(100))
+    cache.put('a', tile(300))
+    assert cache.bytes == 300
+    cache.clear()
+    assert cache.bytes == 0 and not cache.tiles
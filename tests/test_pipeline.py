@@ -0,0 +1,202 @@
+"""
+Tests of the stage output cache and the stage graph scheduler.
+"""
+import os
+import time
+
+import pytest
+
+from terrainjobs import jobConfig, jobPaths, jobStages
+from terrainpipeline import ArtifactCache, Stage, neededStages, \
+    runStageGraph, stageDependencies
+
+
+# define stage functions (at module level, so worker processes can import them)
+
+def writeText(out_fn, text):
+    """
+    Writes text to a file
+    """
+    with open(out_fn, 'w') as f:
+        f.write(text)
+
+
+def joinText(in_fns, out_fn):
+    """
+    Writes the text of several files, one line each, to a file
+    """
+    lines = []
+    for in_fn in in_fns:
+        with open(in_fn) as f:
+            lines.append(f.read())
+    writeText(out_fn, '\n'.join(lines))
+
+
+def meetText(out_fn, other_fn, timeout=30):
+    """
+    Writes a file, then waits for another stage to write its own (which
+    only happens if both stages were started before either finished)
+    """
+    writeText(out_fn, 'met')
+    deadline = time.time() + timeout
+    while not os.path.isfile(other_fn):
+        if time.time() > deadline:
+            raise TimeoutError(other_fn + ' was never written')
+        time.sleep(0.01)
+
+
+def failStage(out_fn):
+    """
+    Fails without writing its output
+    """
+    raise ValueError('stage failed on purpose')
+
+
+def readText(data_fn):
+    """
+    Reads a text file
+    """
+    with open(data_fn) as f:
+        return f.read()
+
+
+# test the artifact cache
+
+def test_run_skips_a_stage_whose_inputs_and_parameters_are_unchanged(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    in_fn, out_fn = str(tmp_path / 'in.txt'), str(tmp_path / 'out.txt')
+    writeText(in_fn, 'a')
+
+    assert cache.run('join', [in_fn], [out_fn], joinText, [in_fn], out_fn)
+    os.remove(out_fn)
+    assert not cache.run('join', [in_fn], [out_fn], joinText, [in_fn], out_fn)
+    assert readText(out_fn) == 'a'
+
+    writeText(in_fn, 'b') # changed input: runs again
+    assert cache.run('join', [in_fn], [out_fn], joinText, [in_fn], out_fn)
+    assert readText(out_fn) == 'b'
+
+
+def test_stageKey_changes_only_for_the_stage_whose_parameter_changed(tmp_path):
+    DEM_fn = str(tmp_path / 'dem.tif')
+    writeText(DEM_fn, 'elevations')
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+
+    def stageKeys(indexContourInt):
+        config = jobConfig({'data_folder':str(tmp_path), 'DEM_grain':2,
+            'indexContourInt':indexContourInt})
+        stages = neededStages(jobStages(config, jobPaths(config),
+            [{'fn':DEM_fn, 'bounds':(0, 0, 200, 200)}]))
+        return {stage.name: cache.stageKey(stage.name, stage.inputs,
+            stage.outputs, [stage.args, stage.kwargs]) for stage in stages}
+
+    before, after = stageKeys(10), stageKeys(20)
+    assert sorted(before) == sorted(after)
+    assert [name for name in before if before[name] != after[name]] == ['contours']
+
+
+def test_restore_links_outputs_that_can_be_rewritten_safely(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'))
+    out_fn = str(tmp_path / 'out.txt')
+    cache.run('write', [], [out_fn], writeText, out_fn, 'first')
+    key = cache.stageKey('write', [], [out_fn], [(out_fn, 'first'), {}])
+    entry_fn = os.path.join(cache.cache_folder, key, 'out.txt')
+
+    assert cache.restore(key, [out_fn])
+    assert os.path.samefile(out_fn, entry_fn) # a hard link, not a copy
+
+    # running the stage again with other parameters rewrites the output
+    # without writing through the link into the store
+    assert cache.run('write', [], [out_fn], writeText, out_fn, 'second')
+    assert readText(out_fn) == 'second'
+    assert readText(entry_fn) == 'first'
+    assert cache.restore(key, [out_fn])
+    assert readText(out_fn) == 'first'
+
+
+def test_store_evicts_least_recently_used_entries_past_the_size_limit(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'), maxSizeGB=250 / 2 ** 30)
+    keys = {}
+    for name in ['a', 'b', 'c']:
+        out_fn = str(tmp_path / (name + '.txt'))
+        cache.run(name, [], [out_fn], writeText, out_fn, name * 100)
+        keys[name] = cache.stageKey(name, [], [out_fn], [(out_fn, name * 100), {}])
+        if name == 'b':
+            # use a again, so b is now the least recently used
+            assert cache.restore(keys['a'], [str(tmp_path / 'a.txt')])
+
+    entries = cache.manifest['entries']
+    assert sorted(entries) == sorted([keys['a'], keys['c']])
+    assert sum(entry['size'] for entry in entries.values()) <= cache.maxSizeBytes
+    assert not os.path.exists(os.path.join(cache.cache_folder, keys['b']))
+
+    # the manifest on disk agrees
+    assert sorted(ArtifactCache(cache.cache_folder).manifest['entries']) == \
+        sorted(entries)
+
+
+# test the stage graph scheduler
+
+def test_runStageGraph_runs_dependencies_first(tmp_path):
+    path = lambda name: str(tmp_path / (name + '.txt'))
+    finished = []
+    stage = lambda name, func, args, inputs=(): Stage(name, func, args,
+        inputs=inputs, outputs=[path(name)],
+        onComplete=lambda: finished.append(name))
+    # declared out of order
+    stages = [stage('joined', joinText, ([path('left'), path('right')],
+            path('joined')), inputs=[path('left'), path('right')]),
+        stage('right', joinText, ([path('source')], path('right')),
+            inputs=[path('source')]),
+        stage('left', writeText, (path('left'), 'left')),
+        stage('source', writeText, (path('source'), 'source'))]
+
+    assert stageDependencies(stages)['joined'] == {'left', 'right'}
+    ran = runStageGraph(stages, workers=1)
+    assert ran == dict.fromkeys(['joined', 'right', 'left', 'source'], True)
+    assert finished.index('source') < finished.index('right') \
+        < finished.index('joined')
+    assert finished.index('left') < finished.index('joined')
+    assert readText(path('joined')) == 'left\nsource'
+
+
+def test_runStageGraph_skips_disabled_branches(tmp_path):
+    path = lambda name: str(tmp_path / (name + '.txt'))
+    stages = [Stage('source', writeText, (path('source'), 'source'),
+            outputs=[path('source')], enabled=False),
+        Stage('wanted', joinText, ([path('source')], path('wanted')),
+            inputs=[path('source')], outputs=[path('wanted')]),
+        Stage('feeder', writeText, (path('feeder'), 'feeder'),
+            outputs=[path('feeder')], enabled=False),
+        Stage('unwanted', joinText, ([path('feeder')], path('unwanted')),
+            inputs=[path('feeder')], outputs=[path('unwanted')], enabled=False)]
+
+    # source is disabled, but it feeds an enabled stage
+    assert [stage.name for stage in neededStages(stages)] == ['source', 'wanted']
+    assert sorted(runStageGraph(stages, workers=1)) == ['source', 'wanted']
+    assert not os.path.exists(path('feeder'))
+    assert not os.path.exists(path('unwanted'))
+
+
+def test_runStageGraph_dispatches_independent_stages_together(tmp_path):
+    path = lambda name: str(tmp_path / (name + '.txt'))
+    # each stage waits for the other's output, so neither can finish unless
+    # both were handed to the pool at once
+    stages = [Stage('first', meetText, (path('first'), path('second')),
+            outputs=[path('first')]),
+        Stage('second', meetText, (path('second'), path('first')),
+            outputs=[path('second')])]
+    assert runStageGraph(stages, workers=2) == {'first':True, 'second':True}
+
+
+def test_runStageGraph_stops_downstream_of_a_failed_stage(tmp_path):
+    path = lambda name: str(tmp_path / (name + '.txt'))
+    stages = [Stage('failing', failStage, (path('failing'),),
+            outputs=[path('failing')]),
+        Stage('downstream', joinText, ([path('failing')], path('downstream')),
+            inputs=[path('failing')], outputs=[path('downstream')])]
+
+    # the worker's exception is raised in the calling process
+    with pytest.raises(ValueError, match='on purpose'):
+        runStageGraph(stages, workers=2)
+    assert not os.path.exists(path('downstream'))
@@ -0,0 +1,161 @@
+"""
+Tests of the region labeling and polygon assembly of the vectorizer.
+"""
+import numpy as np
+import pytest
+
+
+from terrainengine import MappedBand
+from terrainpolygons import assembleRings, boundarySegments, keepTopology, \
+    linePieces, readRuns, ringPoints, signedArea, simplifyArcs, traceArcs, \
+    unionRuns
+
+
+def regionRings(classes, tolerance=0):
+    """
+    Runs the vectorizer's steps (as polygonizeClasses does, without the
+    sieve) on a class array, with 0 as nodata
+
+    Returns:
+        dict of region -> (class, list of ring point arrays)
+    """
+    height, width = classes.shape
+    band = MappedBand(classes, 0.0, None) # (no GDAL data type needed)
+    rows, starts, ends, runClasses = readRuns(band)
+    valid = runClasses != 0
+    lines, pieceStarts, pieceEnds, upperRuns, lowerRuns = linePieces(rows,
+        starts, height, width)
+    touching = (upperRuns >= 0) & (lowerRuns >= 0)
+    upper, lower = upperRuns[touching], lowerRuns[touching]
+    same = valid[upper] & (runClasses[upper] == runClasses[lower])
+    region = unionRuns(rows.size, upper[same], lower[same])
+    region[~valid] = -1
+
+    arcs = traceArcs(boundarySegments(rows, starts, ends, region, lines,
+        pieceStarts, pieceEnds, upperRuns, lowerRuns, width), width)
+    simplified = keepTopology(simplifyArcs(arcs, tolerance),
+        (arcs['points'], arcs['offsets']), tolerance)
+    rings = assembleRings(arcs)
+    points, offsets = ringPoints(rings, simplified)
+    regions = {}
+    for i, regionID in enumerate(rings[3].tolist()):
+        regions.setdefault(regionID, (int(runClasses[regionID]), []))[1].append(
+            points[offsets[i]:offsets[i + 1]])
+    return regions
+
+
+def componentSizes(classes):
+    """
+    Gets the (class, cell count) of each 4-connected region of equal class
+    (0 = nodata), by flood filling
+    """
+    height, width = classes.shape
+    seen = np.zeros(classes.shape, dtype=bool)
+    sizes = []
+    for row in range(height):
+        for col in range(width):
+            if seen[row, col] or classes[row, col] == 0:
+                continue
+            seen[row, col] = True
+            stack, count = [(row, col)], 0
+            while stack:
+                r, c = stack.pop()
+                count += 1
+                for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+                    if 0 <= nr < height and 0 <= nc < width and not seen[nr, nc] \
+                        and classes[nr, nc] == classes[row, col]:
+                        seen[nr, nc] = True
+                        stack.append((nr, nc))
+            sizes.append((int(classes[row, col]), count))
+    return sorted(sizes)
+
+
+def randomClasses(size, seed):
+    """
+    Makes a patchy class array (classes 1-3, with some nodata)
+    """
+    rng = np.random.default_rng(seed)
+    field = rng.normal(size=(size, size))
+    for _ in range(3):
+        field = (field + np.roll(field, 1, 0) + np.roll(field, 1, 1)) / 3
+    classes = np.digitize(field, np.quantile(field, [0.1, 0.45, 0.8]))
+    return classes.astype(np.uint8) # 0 (the lowest tenth) is nodata
+
+
+@pytest.mark.parametrize('size, seed', [(40, 0), (57, 1)])
+def test_regions_match_connected_components(size, seed):
+    classes = randomClasses(size, seed)
+    regions = regionRings(classes)
+    areas = []
+    for regionClass, rings in regions.values():
+        ringAreas = [signedArea(points) for points in rings]
+        assert sum(area < 0 for area in ringAreas) == 1 # one outer boundary
+        for points in rings:
+            assert (points[0] == points[-1]).all()
+        areas.append((regionClass, int(round(-sum(ringAreas)))))
+    assert sorted(areas) == componentSizes(classes)
+
+
+def test_holes_and_corner_touches():
+    classes = np.array([
+        [1, 1, 1, 1, 1, 0],
+        [1, 2, 2, 1, 1, 0],
+        [1, 2, 2, 1, 1, 3],
+        [1, 1, 1, 1, 3, 0],
+        [1, 1, 1, 1, 1, 0],
+        [0, 0, 0, 0, 0, 0]], dtype=np.uint8)
+    regions = regionRings(classes)
+    ringCounts = sorted((regionClass, len(rings))
+        for regionClass, rings in regions.values())
+    # the 1s have a hole (the 2s); the 3s touch only at a corner, so stay apart
+    assert ringCounts == [(1, 2), (2, 1), (3, 1), (3, 1)]
+
+
+def test_simplified_regions_keep_their_rings():
+    classes = randomClasses(60, 2)
+    exact = regionRings(classes)
+    simplified = regionRings(classes, tolerance=1.5)
+    assert sorted(exact) == sorted(simplified)
+    for regionID, (regionClass, rings) in simplified.items():
+        assert len(rings) == len(exact[regionID][1])
+        areas = [signedArea(points) for points in rings]
+        assert sum(area < 0 for area in areas) == 1
+        assert all(area != 0 for area in areas) # no ring collapsed
+
+
+def test_unionRuns_labels_each_component_by_its_lowest_run():
+    rng = np.random.default_rng(3)
+    runCount = 500
+    first, second = rng.integers(0, runCount, (2, 300))
+    # (a reference union-find, one pair at a time)
+    parent = list(range(runCount))
+
+    def find(run):
+        while parent[run] != run:
+            run = parent[run]
+        return run
+
+    for a, b in zip(first.tolist(), second.tolist()):
+        rootA, rootB = find(a), find(b)
+        parent[max(rootA, rootB)] = min(rootA, rootB)
+    expected = [find(run) for run in range(runCount)]
+    assert unionRuns(runCount, first, second).tolist() == expected
+
+
+def test_keepTopology_puts_back_arcs_that_would_change_the_topology():
+    arcs = [
+        [(0, 0), (0, 4), (10, 4), (10, 0)], # would pass over the next arc
+        [(4, 1), (4, 2), (6, 2)],
+        [(20, 0), (20, 1), (30, 1), (30, 0)], # would cross the next arc
+        [(25, -1), (25, 2)],
+        [(40, 0), (40, 1), (50, 1), (50, 0)]] # free to move
+    simplifiedArcs = [[arc[0], arc[-1]] if len(arc) == 4 else arc for arc in arcs]
+
+    def flatten(pieces):
+        return (np.array([point for piece in pieces for point in piece], dtype=float),
+            np.cumsum([0] + [len(piece) for piece in pieces]))
+
+    points, offsets = keepTopology(flatten(simplifiedArcs), flatten(arcs), 3)
+    kept = [points[start:stop].tolist() for start, stop in zip(offsets[:-1], offsets[1:])]
+    assert kept == [list(map(list, arc)) for arc in arcs[:4]] \
+        + [list(map(list, simplifiedArcs[4]))]
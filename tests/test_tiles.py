@@ -0,0 +1,100 @@
+"""
+Tests of the filesystem job queue and of cutting, clipping and stitching
+tiles.
+"""
+import os
+import time
+
+import numpy as np
+import pytest
+
+import terraintiles
+from terrainengine import createRaster, finishRaster, gdal
+from terraintiles import JobQueue, clipRasters, cutTile, startLocalWorkers, \
+    stitchTiles, stopLocalWorkers
+
+needsGdal = pytest.mark.skipif(gdal is None, reason='needs the GDAL bindings')
+
+
+@pytest.fixture(autouse=True)
+def fastPolling(monkeypatch):
+    monkeypatch.setattr(terraintiles, 'queuePollSeconds', 0.01)
+
+
+def test_wait_returns_once_tasks_are_done(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    taskId = queue.submit('os.getcwd')
+    claimedId, task = queue.claim()
+    assert claimedId == taskId
+    queue.complete(taskId)
+    queue.wait([taskId], staleSeconds=1)
+
+
+def test_wait_gives_up_when_no_worker_runs_the_tasks(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    taskId = queue.submit('os.getcwd')
+    with pytest.raises(RuntimeError, match='no worker'):
+        queue.wait([taskId], staleSeconds=0.2)
+
+
+def test_wait_requeues_a_dead_workers_task_and_then_gives_up(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    taskId = queue.submit('os.getcwd')
+    queue.claim() # claimed by a worker that never finishes it
+    with pytest.raises(RuntimeError, match='no worker'):
+        queue.wait([taskId], staleSeconds=0.2)
+    assert queue.claim()[0] == taskId # back in pending
+
+
+def test_stopLocalWorkers_lets_the_running_task_finish(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    stop_fn = str(tmp_path / 'stop_ours')
+    workers = startLocalWorkers(str(tmp_path), stop_fn, count=1)
+    taskId = queue.submit('time.sleep', (1.5,)) # e.g. another run's task
+    deadline = time.time() + 60
+    while not os.path.isfile(queue.path('running', taskId)):
+        assert time.time() < deadline
+        time.sleep(0.01)
+    stopLocalWorkers(workers, stop_fn)
+
+    assert not any(worker.is_alive() for worker in workers)
+    assert os.path.isfile(queue.path('done', taskId))
+    assert not os.listdir(tmp_path / 'running')
+    assert not os.path.exists(stop_fn)
+
+
+def writeNoNodataRaster(raster_fn, values):
+    """
+    Writes an array as a GeoTIFF that has no nodata value
+    """
+    outDS = createRaster(raster_fn, values.shape[1], values.shape[0],
+        (0, 1, 0, values.shape[0], 0, -1), '', gdal.GDT_Float32, None, 'GTiff')
+    outDS.GetRasterBand(1).WriteArray(values)
+    outDS = None
+    finishRaster(raster_fn, 'GTiff')
+
+
+@needsGdal
+def test_tiles_and_clips_of_a_raster_without_nodata(tmp_path):
+    values = np.arange(48, dtype=np.float32).reshape(6, 8)
+    dem_fn = str(tmp_path / 'dem.tif')
+    writeNoNodataRaster(dem_fn, values)
+
+    tiles = []
+    for i, window in enumerate([(0, 0, 4, 6), (4, 0, 4, 6)]):
+        tile_fn = str(tmp_path / ('tile' + str(i) + '.tif'))
+        cutTile(dem_fn, tile_fn, window)
+        assert gdal.Open(tile_fn).GetRasterBand(1).GetNoDataValue() is None
+        tiles.append((window, window, tile_fn))
+
+    stitched_fn = str(tmp_path / 'stitched.tif')
+    stitchTiles(tiles, stitched_fn, gdal.Open(dem_fn), 'GTiff')
+    band = gdal.Open(stitched_fn).GetRasterBand(1)
+    assert band.GetNoDataValue() is None
+    np.testing.assert_array_equal(band.ReadAsArray(), values)
+
+    clip_fn = str(tmp_path / 'clip.tif')
+    clipRasters([dem_fn], [clip_fn], (2, 1, 5, 4), 'GTiff')
+    band = gdal.Open(clip_fn).GetRasterBand(1)
+    assert band.GetNoDataValue() is None
+    np.testing.assert_array_equal(band.ReadAsArray(), values[2:5, 2:5])